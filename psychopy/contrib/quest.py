@@ -31,7 +31,7 @@
 # OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
 # DAMAGE.
 
-__all__ = ['QuestObject']
+__all__ = ['QuestObject', 'QuestBatch']
 
 import math
 import copy
@@ -323,25 +323,40 @@ class QuestObject:
         if len(getinf(self.pdf)[0]):
             raise RuntimeError('prior pdf is not finite')
 
-        # recompute the pdf from the historical record of trials
-        for intensity, response in zip(self.intensity,self.response):
-            inten = max(-1e10,min(1e10,intensity)) # make intensity finite
-            ii = len(self.pdf) + self.i-round((inten-self.tGuess)/self.grain)-1
-            if ii[0]<0:
-                ii = ii-ii[0]
-            if ii[-1]>=self.s2.shape[1]:
-                ii = ii+self.s2.shape[1]-ii[-1]-1
-            iii = ii.astype(num.int_)
-            if not num.allclose(ii,iii):
-                raise ValueError('truncation error')
-            self.pdf = self.pdf*self.s2[response,iii]
-            if self.normalizePdf and k%100==0:
-                self.pdf = self.pdf/num.sum(self.pdf) # avoid underflow; keep the pdf normalized
+        # recompute the pdf from the historical record of trials (all at
+        # once, summing the log likelihoods of the trials)
+        if len(self.intensity):
+            iii = self._s2Indices(self.intensity)
+            response = num.asarray(self.response, dtype=num.int_)
+            err = num.seterr(divide='ignore')
+            try:
+                logPdf = num.log(self.pdf) + num.sum(num.log(self.s2[response[:,None],iii]), axis=0)
+            finally:
+                num.seterr(**err)
+            # the likelihood of a long history underflows, so scale the pdf
+            # to a maximum of 1 (it's normalized wherever it's used)
+            if num.isfinite(logPdf.max()):
+                logPdf = logPdf - logPdf.max()
+            self.pdf = num.exp(logPdf)
         if self.normalizePdf:
             self.pdf = self.pdf/num.sum(self.pdf) # avoid underflow; keep the pdf normalized
         if len(getinf(self.pdf)[0]):
             raise RuntimeError('prior pdf is not finite')
 
+    def _s2Indices(self,intensities):
+        """Indices into self.s2 (one row per intensity) of the likelihood of
+        each candidate threshold in self.x, given a trial at each intensity
+        (clipped to the range of self.s2)"""
+        inten = num.clip(num.asarray(intensities, dtype=float), -1e10, 1e10) # make intensity finite
+        steps = (inten-self.tGuess)/self.grain
+        steps = num.sign(steps)*num.floor(num.abs(steps)+0.5) # round half away from zero, as round()
+        ii = (len(self.pdf)-1-steps)[:,None] + self.i[None,:]
+        first = ii[:,0]
+        last = ii[:,-1]
+        nS2 = self.s2.shape[1]
+        shift = num.where(first<0, -first, num.where(last>=nS2, nS2-last-1, 0))
+        return (ii + shift[:,None]).astype(num.int_)
+
     def update(self,intensity,response):
         """Update Quest posterior pdf.
 
@@ -378,6 +393,80 @@ class QuestObject:
         self.intensity.append(intensity)
         self.response.append(response)
         
+class QuestBatch(object):
+    """Many independent Quest staircases, updated together.
+
+    All the staircases share the parameters (and prior) of a QuestObject,
+    and have one row each in `logPdf`, the log of their posterior pdfs. Keeping
+    the log (and only normalising when a pdf is used) means that the pdfs
+    never underflow and a trial is just an addition of log likelihoods. This
+    is much faster than using a QuestObject for each staircase when running
+    simulations.
+
+    Intensities, responses and results are arrays with one value per
+    staircase.
+    """
+    def __init__(self,quest,nRuns):
+        self.quest = quest
+        self.nRuns = nRuns
+        err = num.seterr(divide='ignore')
+        try:
+            self.logS2 = num.log(quest.s2)
+            self.logPdf = num.tile(num.log(quest.pdf), (nRuns,1))
+        finally:
+            num.seterr(**err)
+
+    def update(self,intensities,responses):
+        """Update the posterior of each staircase for a trial at the given
+        intensities with the given responses (0 or 1)"""
+        iii = self.quest._s2Indices(intensities)
+        responses = num.asarray(responses, dtype=num.int_)
+        self.logPdf += self.logS2[responses[:,None],iii]
+
+    def pdf(self):
+        """The posterior pdfs (normalised so that each row sums to 1)"""
+        pdf = num.exp(self.logPdf - self.logPdf.max(axis=1)[:,None])
+        return pdf/pdf.sum(axis=1)[:,None]
+
+    def mean(self):
+        """Mean of each posterior pdf (the threshold estimates)"""
+        return self.quest.tGuess + num.dot(self.pdf(), self.quest.x)
+
+    def sd(self):
+        """Standard deviation of each posterior pdf"""
+        pdf = self.pdf()
+        x = self.quest.x
+        return num.sqrt(num.dot(pdf, x**2) - num.dot(pdf, x)**2)
+
+    def mode(self):
+        """Mode of each posterior pdf"""
+        return self.quest.tGuess + self.quest.x[num.argmax(self.logPdf, axis=1)]
+
+    def quantile(self,quantileOrder=None):
+        """Quantile of each posterior pdf (by default the one recommended for
+        the next trial, as for QuestObject.quantile)"""
+        if quantileOrder is None:
+            quantileOrder = self.quest.quantileOrder
+        x = self.quest.x
+        cum = num.cumsum(self.pdf(), axis=1)
+        target = quantileOrder*cum[:,-1]
+        # interpolate between the last point below the target and the next
+        above = num.minimum(num.sum(cum < target[:,None], axis=1), len(x)-1)
+        below = num.maximum(above-1, 0)
+        rows = num.arange(self.nRuns)
+        cumBelow = num.where(above > 0, cum[rows,below], 0.0)
+        xBelow = num.where(above > 0, x[below], x[0])
+        span = cum[rows,above] - cumBelow
+        frac = num.where(span > 0, (target-cumBelow)/num.where(span > 0, span, 1), 0)
+        return self.quest.tGuess + xBelow + frac*(x[above]-xBelow)
+
+    def simulate(self,tTest,tActual,rng=num.random):
+        """Simulated responses (as for QuestObject.simulate) of observers with
+        thresholds tActual, to trials at intensities tTest"""
+        q = self.quest
+        t = num.clip(num.asarray(tTest)-tActual, q.x2[0], q.x2[-1])
+        return num.interp(t, q.x2, q.p2) > rng.random_sample(self.nRuns)
+
 def demo():
     """Demo script for Quest routines.
 
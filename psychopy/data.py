@@ -5,17 +5,20 @@
 # Distributed under the terms of the GNU General Public License (GPL).
 
 from psychopy import gui, logging
-from psychopy.tools.arraytools import extendArr, shuffleArray
 from psychopy.tools.fileerrortools import handleFileCollision
 import psychopy
 import cPickle, string, sys, platform, os, time, copy, csv
 import numpy
+from numpy.lib._iotools import NameValidator
 from scipy import optimize, special
-from contrib.quest import *    #used for QuestHandler
+from psychopy.contrib.quest import *    #used for QuestHandler
 import inspect #so that Handlers can find the script that called them
 import codecs, locale
 import weakref
 import re
+import threading, Queue
+import ast, hashlib, fnmatch
+import json, struct
 
 try:
     import openpyxl
@@ -24,10 +27,707 @@ try:
     haveOpenpyxl=True
 except:
     haveOpenpyxl=False
+try:
+    import tables  #PyTables (as used by iohub) for HDF5 output
+    haveTables=True
+except ImportError:
+    haveTables=False
 
 _experiments=weakref.WeakValueDictionary()
 _nonalphanumeric_re = re.compile(r'\W') # will match all bad var name chars
 
+def _formatWideTextCell(value, delim):
+    """Format one cell of a wide text file (quoted if it contains a comma or
+    newline) followed by the delimiter
+    """
+    value = unicode(value)
+    if ',' in value or '\n' in value:
+        return u'"%s"%s' %(value, delim)
+    return u'%s%s' %(value, delim)
+
+def _wideTextCells(values, quote=False):
+    """Convert a column of values to unicode cells. If `quote` then cells
+    containing a comma or newline are quoted (the whole column is checked
+    at once so that most columns need no per-cell test)
+    """
+    cells = [val if type(val) is unicode else unicode(val) for val in values]
+    if quote:
+        joined = u''.join(cells)
+        if ',' in joined or '\n' in joined:
+            cells = [u'"%s"' %cell if (',' in cell or '\n' in cell) else cell
+                     for cell in cells]
+    return cells
+
+def _writeWideText(f, columns, nRows, delim, lineEnd='\n', quote=False,
+                   chunkSize=10000):
+    """Write the rows of a wide text file from a list of `columns` (each a
+    list of nRows values), converting one column at a time and writing
+    `chunkSize` rows at a time
+    """
+    if not columns:
+        f.write(u'\n'*nRows)
+        return
+    cells = [_wideTextCells(column, quote=quote) for column in columns]
+    for start in range(0, nRows, chunkSize):
+        rows = zip(*[column[start:start+chunkSize] for column in cells])
+        f.write(u''.join([delim.join(row)+lineEnd for row in rows]))
+
+def _isMissing(val):
+    return val is None or val is numpy.ma.masked or \
+        (type(val) in [str, unicode] and val == '')
+
+def _columnArray(values):
+    """Convert a column of values to an array; float (with NaN for missing
+    values) if all the values are numbers, otherwise unicode strings
+    """
+    present = [val for val in values if not _isMissing(val)]
+    if all([isinstance(val, (int, long, float, numpy.number)) for val in present]):
+        if len(present) == len(values):
+            return numpy.array(values)
+        return numpy.array([numpy.nan if _isMissing(val) else val for val in values],
+                           dtype=float)
+    return numpy.array([u'' if _isMissing(val) else unicode(val) for val in values],
+                       dtype=unicode)
+
+def _saveColumns(fileName, names, columns):
+    """Save named columns of values to a binary file, either .npz (one
+    array per name) or .hdf5/.h5 (a table called 'data', requires PyTables)
+    """
+    arrays = [_columnArray(column) for column in columns]
+    if fileName.lower().endswith('.npz'):
+        numpy.savez(fileName, **dict(zip(names, arrays)))
+    else:
+        if not haveTables:
+            raise ImportError, 'PyTables (tables) is required for saving files in HDF5 format, but was not found.'
+        #PyTables doesn't store unicode so use utf-8 encoded strings
+        for ii, arr in enumerate(arrays):
+            if arr.dtype.kind == 'U':
+                arrays[ii] = numpy.array([val.encode('utf-8') for val in arr],
+                                         dtype=str)
+        if arrays:
+            records = numpy.rec.fromarrays(arrays, names=[str(name) for name in names])
+        else:
+            records = numpy.zeros(0, dtype=[('empty', int)])
+        h5file = tables.openFile(fileName, mode='w')
+        try:
+            h5file.createTable(h5file.root, 'data', records)
+        finally:
+            h5file.close()
+    logging.info('saved data columns to %s' %fileName)
+
+#files saved by saveAsColumns: an 8-byte signature followed by records, each
+#a 16-byte record header (kind, length of its json header, length of its
+#data), the json header and then the data. 'INFO' records hold the metadata
+#and each 'ROWS' record holds a block of rows, stored a column at a time, so
+#that the file can be appended to and each block of a column memory-mapped
+_COLUMNS_SIGNATURE = 'PSYCOLS\x00'
+_COLUMNS_VERSION = 1
+_COLUMNS_RECORD = struct.Struct('<4sIQ')
+
+def _padTo8(nBytes):
+    return (-nBytes) % 8
+
+def _jsonSafe(obj):
+    """Convert handler info to something that can be saved as json (other
+    objects are saved as their unicode representation)
+    """
+    if obj is None or type(obj) in [bool, int, long, float, unicode]:
+        return obj
+    if type(obj) is str:
+        return obj.decode('utf-8', 'replace')
+    if isinstance(obj, numpy.ndarray):
+        return _jsonSafe(obj.tolist())
+    if isinstance(obj, numpy.generic):
+        return _jsonSafe(obj.item())
+    if isinstance(obj, dict):
+        return dict([(unicode(key), _jsonSafe(val)) for key, val in obj.items()])
+    if isinstance(obj, (list, tuple, FactorialTrialList)):
+        return [_jsonSafe(val) for val in obj]
+    return unicode(obj)
+
+def _readColumnRecords(f):
+    """Read the record headers of an open column data file, returning a list
+    of (kind, header, dataOffset, dataLength) and the position at which the
+    last complete record ends (a record being written when an experiment
+    crashed is ignored)
+    """
+    f.seek(0, 2)
+    fileSize = f.tell()
+    f.seek(0)
+    if f.read(len(_COLUMNS_SIGNATURE)) != _COLUMNS_SIGNATURE:
+        raise IOError, '%s is not a column data file' %f.name
+    records = []
+    validEnd = f.tell()
+    while validEnd + _COLUMNS_RECORD.size <= fileSize:
+        kind, headerLength, dataLength = _COLUMNS_RECORD.unpack(
+            f.read(_COLUMNS_RECORD.size))
+        dataOffset = validEnd + _COLUMNS_RECORD.size + headerLength + _padTo8(headerLength)
+        if dataOffset + dataLength > fileSize:
+            break
+        try:
+            header = json.loads(f.read(headerLength).decode('utf-8'))
+        except ValueError:
+            break
+        records.append((kind, header, dataOffset, dataLength))
+        validEnd = dataOffset + dataLength
+        f.seek(validEnd)
+    if validEnd < fileSize:
+        logging.warning('%s ends with an incomplete block of data, which was '
+                        'ignored' %f.name)
+    return records, validEnd
+
+def _storableColumn(column):
+    """Convert a column of values to an array that can be saved in a column
+    data file (numbers or unicode strings)
+    """
+    if isinstance(column, numpy.ndarray) and column.dtype.kind in 'biufU' \
+            and not isinstance(column, numpy.ma.MaskedArray):
+        return numpy.ascontiguousarray(column)
+    arr = _columnArray(list(column))
+    if arr.dtype.kind not in 'biufU':  # e.g. ints too big for int64
+        arr = numpy.array([unicode(val) for val in column], dtype=unicode)
+    return arr
+
+class ColumnDataWriter(object):
+    """Writes a column data file (as read by :class:`ColumnDataFile` and
+    saved by the saveAsColumns method of the handlers) a block of rows at a
+    time, so that the data from each trial can be appended as it is
+    collected.
+
+    Usage::
+
+        writer = data.ColumnDataWriter('subj01.psycol', info={'participant':'01'})
+        for thisTrial in trials:
+            ...
+            writer.addRow({'ori':thisTrial.ori, 'resp':resp, 'rt':rt})
+        writer.close()
+
+    Rows are written to disk every `rowsPerBlock` rows and when flush() or
+    close() is called. Numeric columns are stored as numbers (floats with NaN
+    for any missing values) and all others as unicode strings. If
+    `appendFile` is True and the file exists then new rows are added to the
+    end of it, and `info` is added to its existing info.
+    """
+    def __init__(self, fileName, info=None, appendFile=False, rowsPerBlock=100):
+        self.fileName = fileName
+        self.rowsPerBlock = rowsPerBlock
+        self._rows = []
+        self._names = []  # all the names seen in the buffered rows, in order
+        if appendFile and os.path.exists(fileName):
+            self._file = open(fileName, 'r+b')
+            validEnd = _readColumnRecords(self._file)[1]
+            self._file.seek(validEnd)
+            self._file.truncate()
+        else:
+            self._file = open(fileName, 'wb')
+            self._file.write(_COLUMNS_SIGNATURE)
+            if info is None:
+                info = {}
+        if info is not None:
+            self.addInfo(info)
+
+    def _writeRecord(self, kind, header, blocks=()):
+        headerBytes = json.dumps(header).encode('utf-8')
+        dataLength = sum([len(block) + _padTo8(len(block)) for block in blocks])
+        self._file.write(_COLUMNS_RECORD.pack(kind, len(headerBytes), dataLength))
+        self._file.write(headerBytes + '\x00'*_padTo8(len(headerBytes)))
+        for block in blocks:
+            self._file.write(block)
+            self._file.write('\x00'*_padTo8(len(block)))
+
+    def addInfo(self, info):
+        """Add (json-compatible) information about the data, such as the
+        extraInfo of an experiment, to the file
+        """
+        self._writeRecord('INFO', {'version': _COLUMNS_VERSION,
+                                   'info': _jsonSafe(info)})
+        self._file.flush()
+
+    def addRow(self, row):
+        """Add a row (a dict of values, by name) to the file
+        """
+        for name in row:
+            if name not in self._names:
+                self._names.append(name)
+        self._rows.append(row)
+        if len(self._rows) >= self.rowsPerBlock:
+            self.flush()
+
+    def addColumns(self, names, columns):
+        """Add a block of rows, given as a list of `names` and a list of
+        `columns` (each a sequence of one value per row)
+        """
+        self.flush()
+        nRows = len(columns[0]) if columns else 0
+        arrays = []
+        for name, column in zip(names, columns):
+            if len(column) != nRows:
+                raise ValueError, 'All the columns must have the same number of rows'
+            arrays.append(_storableColumn(column))
+        header = {'nRows': nRows, 'columns': []}
+        offset = 0
+        for name, arr in zip(names, arrays):
+            header['columns'].append([unicode(name), arr.dtype.str, offset])
+            offset += arr.nbytes + _padTo8(arr.nbytes)
+        self._writeRecord('ROWS', header, [arr.tostring() for arr in arrays])
+        self._file.flush()
+
+    def flush(self):
+        """Write any rows that are waiting to be written
+        """
+        if not self._rows:
+            return
+        rows, names = self._rows, self._names
+        self._rows, self._names = [], []
+        self.addColumns(names, [[row.get(name) for row in rows] for name in names])
+
+    def close(self):
+        """Write any remaining rows and close the file
+        """
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+    def __del__(self):
+        self.close()
+
+class ColumnDataFile(object):
+    """Reads a column data file (as saved by the saveAsColumns method of the
+    handlers or by a :class:`ColumnDataWriter`) without unpickling anything.
+
+    Each column is returned as a numpy array, which is memory-mapped from the
+    file (so only the parts that are used are read from disk) if the column
+    was saved in one block, e.g.::
+
+        dat = data.ColumnDataFile('subj01.psycol')
+        print dat.names, dat.nRows, dat.info['extraInfo']
+        rts = dat['rt']
+        meanRT = numpy.nanmean(rts[dat['corr']==1])
+
+    Columns made of several blocks (such as rows appended a trial at a time)
+    are joined into one array. Rows that have no value for a column are NaN
+    (numbers) or u'' (strings).
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.info = {}
+        self.names = []
+        self.nRows = 0
+        self._blocks = {}  # name: list of (firstRow, nRows, dtype, offset)
+        f = open(fileName, 'rb')
+        try:
+            records = _readColumnRecords(f)[0]
+        finally:
+            f.close()
+        for kind, header, dataOffset, dataLength in records:
+            if kind == 'INFO':
+                self.info.update(header['info'])
+            elif kind == 'ROWS':
+                for name, dtype, offset in header['columns']:
+                    if name not in self._blocks:
+                        self.names.append(name)
+                        self._blocks[name] = []
+                    self._blocks[name].append((self.nRows, header['nRows'],
+                                               numpy.dtype(str(dtype)),
+                                               dataOffset+offset))
+                self.nRows += header['nRows']
+
+    def _mapBlock(self, nRows, dtype, offset):
+        if nRows == 0 or dtype.itemsize == 0:
+            return numpy.zeros(nRows, dtype=dtype)
+        return numpy.memmap(self.fileName, dtype=dtype, mode='r',
+                            offset=offset, shape=(nRows,))
+
+    def __getitem__(self, name):
+        blocks = self._blocks[name]
+        if len(blocks) == 1 and blocks[0][1] == self.nRows:
+            return self._mapBlock(*blocks[0][1:])
+        dtypes = [dtype for firstRow, nRows, dtype, offset in blocks]
+        complete = sum([nRows for firstRow, nRows, dtype, offset in blocks]) == self.nRows
+        if any([dtype.kind == 'U' for dtype in dtypes]):
+            dtype = numpy.dtype((unicode, max([dtype.itemsize//4 for dtype in dtypes
+                                               if dtype.kind == 'U'])))
+            missing = u''
+        else:
+            dtype = reduce(numpy.promote_types, dtypes)
+            missing = numpy.nan
+            if not complete:
+                dtype = numpy.promote_types(dtype, float)
+        arr = numpy.empty(self.nRows, dtype=dtype)
+        if not complete:
+            arr[:] = missing
+        for firstRow, nRows, blockType, offset in blocks:
+            arr[firstRow:firstRow+nRows] = self._mapBlock(nRows, blockType, offset)
+        return arr
+
+    def get(self, name, default=None):
+        if name in self._blocks:
+            return self[name]
+        return default
+
+    def keys(self):
+        return list(self.names)
+
+    def __contains__(self, name):
+        return name in self._blocks
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return self.nRows
+
+    def __repr__(self):
+        return '<ColumnDataFile %s: %i rows of %s>' %(self.fileName, self.nRows,
+                                                      ', '.join(self.names))
+
+def convertPsydat(fileName, newFileName=None):
+    """Convert a (pickled) .psydat file, as saved by the saveAsPickle method
+    of an :class:`ExperimentHandler`, :class:`TrialHandler`,
+    :class:`StairHandler` or :class:`MultiStairHandler`, to a column data
+    file (see :class:`ColumnDataFile`).
+
+    If no `newFileName` is given the extension is changed to .psycol.
+    Returns the name of the new file.
+    """
+    from psychopy.tools.filetools import fromFile
+    handler = fromFile(fileName)
+    if not hasattr(handler, 'saveAsColumns'):
+        raise TypeError, '%s does not contain a PsychoPy data handler' %fileName
+    if newFileName is None:
+        newFileName = os.path.splitext(fileName)[0]+'.psycol'
+    return handler.saveAsColumns(newFileName, fileCollisionMethod='overwrite')
+
+def _readWideTextColumns(fileName):
+    """Read the names and columns of values of a wide-format csv data file
+    (as saved by saveAsWideText), converting numeric columns to numbers
+    """
+    f = open(fileName, 'rb')
+    rows = [row for row in csv.reader(f) if row]
+    f.close()
+    if not rows:
+        return [], []
+    header = rows[0]
+    if header[0].startswith(codecs.BOM_UTF8):
+        header[0] = header[0][len(codecs.BOM_UTF8):]
+    while header and header[-1] == '':
+        header.pop()  # each line ends with a delimiter
+    nCols = len(header)
+    for row in rows[1:]:
+        row.extend(['']*(nCols-len(row)))
+    names = [name.decode('utf-8') for name in header]
+    columns = [_csvColumnValues([row[colN] for row in rows[1:]])
+               for colN in range(nCols)]
+    return names, columns
+
+def _loadSessionColumns(fileName):
+    """Load the data of one session (a .psydat, .psycol or wide-format .csv
+    file) as (names, arrays, extraInfo), or (None, None, errorMessage) if it
+    can't be loaded (run in a multiprocessing.Pool by mergeSessions)
+    """
+    try:
+        extraInfo = {}
+        if fileName.lower().endswith('.csv'):
+            names, columns = _readWideTextColumns(fileName)
+        else:
+            from psychopy.tools.filetools import fromFile
+            contents = fromFile(fileName)
+            if isinstance(contents, ColumnDataFile):
+                names = contents.names
+                columns = [numpy.array(contents[name]) for name in names]
+                extraInfo = contents.info.get('extraInfo')
+            elif isinstance(contents, ExperimentHandler):
+                names, columns = contents._getColumns()
+                extraInfo = contents.extraInfo
+            elif isinstance(contents, _BaseTrialHandler):
+                names, columns = contents._getColumnData()
+                extraInfo = getattr(contents, 'extraInfo', None)
+            else:
+                raise TypeError, 'the file does not contain a PsychoPy data handler'
+        if not isinstance(extraInfo, dict):
+            extraInfo = {}
+        return names, [_storableColumn(column) for column in columns], _jsonSafe(extraInfo)
+    except Exception, err:
+        return None, None, unicode(err)
+
+def mergeSessions(directory, pattern='*.psydat', cacheFile=None,
+                  infoColumns=('participant', 'session'), nProcesses=1):
+    """Merge the data from many sessions (e.g. one file per participant) into
+    a single table, for group-level analysis.
+
+    The files in `directory` (and its subfolders) that match `pattern` (or a
+    list of patterns) are loaded, in `nProcesses` processes, and their rows
+    combined. .psydat files can contain an ExperimentHandler or any of the
+    trial handlers, and .csv files should be in the wide format of
+    saveAsWideText. Columns are matched by name; sessions without a column
+    have NaN (numbers) or u'' (strings) in it.
+
+    Each `infoColumns` name that is in a session's extraInfo, but not already
+    a column, is added as a column (so that rows can be grouped by
+    participant, for example), along with a `sessionFile` column giving the
+    file (relative to `directory`) that each row came from.
+
+    The merged table is saved in `cacheFile` (by default
+    `mergedSessions.psycol` in `directory`) and returned as a
+    :class:`ColumnDataFile`. Next time only the new files are loaded and
+    added to it (it is rebuilt if a file has been changed or removed).
+
+    Usage::
+
+        dat = data.mergeSessions('data', pattern=['*.psydat'], nProcesses=4)
+        for participant in numpy.unique(dat['participant']):
+            print participant, numpy.nanmean(dat['rt'][dat['participant']==participant])
+
+    The same can be done from the command line with::
+
+        python -m psychopy.data merge data --pattern *.psydat --processes 4
+    """
+    if cacheFile is None:
+        cacheFile = os.path.join(directory, 'mergedSessions.psycol')
+    if isinstance(pattern, basestring):
+        patterns = [pattern]
+    else:
+        patterns = list(pattern)
+    #find the files and when they were last changed
+    found = {}
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.abspath(path) == os.path.abspath(cacheFile):
+                continue
+            if any([fnmatch.fnmatch(name, thisPattern) for thisPattern in patterns]):
+                stat = os.stat(path)
+                found[os.path.relpath(path, directory)] = [stat.st_mtime, stat.st_size]
+    #which are already in the cache?
+    sessions = {}
+    appendFile = False
+    if os.path.exists(cacheFile):
+        try:
+            cached = ColumnDataFile(cacheFile)
+        except IOError:
+            cached = None
+        if cached is not None and cached.info.get('patterns') == patterns:
+            sessions = cached.info.get('mergedSessions', {})
+            inCache = set(cached['sessionFile']) if 'sessionFile' in cached else set()
+            if all([found.get(rel) == sessions[rel] for rel in sessions]) \
+                    and inCache.issubset(sessions):
+                appendFile = True
+            else:
+                logging.info('Session files have changed since %s was saved; '
+                             'merging them all again' %cacheFile)
+                sessions = {}
+    newFiles = sorted([rel for rel in found if rel not in sessions])
+    if appendFile and not newFiles:
+        return cached
+    #load the new files and add them to the cache
+    writer = ColumnDataWriter(cacheFile, appendFile=appendFile,
+                              info=None if appendFile else {'patterns': patterns})
+    paths = [os.path.join(directory, rel) for rel in newFiles]
+    if nProcesses > 1 and len(paths) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(min(nProcesses, len(paths)))
+        loaded = pool.imap(_loadSessionColumns, paths, chunksize=4)
+    else:
+        pool = None
+        loaded = (_loadSessionColumns(path) for path in paths)
+    try:
+        for fileN, (names, arrays, extraInfo) in enumerate(loaded):
+            rel = newFiles[fileN]
+            if names is None:
+                logging.warning('Could not merge %s: %s' %(rel, extraInfo))
+                continue
+            nRows = len(arrays[0]) if arrays else 0
+            for key in infoColumns:
+                if key in extraInfo and key not in names:
+                    names.append(key)
+                    arrays.append(_storableColumn([extraInfo[key]]*nRows))
+            names.append('sessionFile')
+            arrays.append(numpy.array([rel]*nRows, dtype=unicode))
+            writer.addColumns(names, arrays)
+            sessions[rel] = found[rel]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        writer.addInfo({'mergedSessions': sessions})
+        writer.close()
+    logging.info('merged %i new session files into %s' %(len(newFiles), cacheFile))
+    return ColumnDataFile(cacheFile)
+
+def _mergeSessionsCommand(argv):
+    """Command-line interface for mergeSessions (see the usage there)
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m psychopy.data merge',
+        description='Merge the data files of many sessions into one table')
+    parser.add_argument('directory', help='folder containing the data files')
+    parser.add_argument('--pattern', '-p', action='append',
+        help='file name pattern (default *.psydat), can be given more than once')
+    parser.add_argument('--cache', '-c', default=None,
+        help='merged file (default DIRECTORY/mergedSessions.psycol)')
+    parser.add_argument('--processes', '-j', type=int, default=1,
+        help='number of processes used to load the files')
+    parser.add_argument('--info', '-i', action='append',
+        help='extraInfo key to add as a column (default participant and session)')
+    args = parser.parse_args(argv)
+    dat = mergeSessions(args.directory, pattern=args.pattern or '*.psydat',
+                        cacheFile=args.cache,
+                        infoColumns=args.info or ('participant', 'session'),
+                        nProcesses=args.processes)
+    print '%i sessions, %i rows, saved in %s' %(len(dat.info.get('mergedSessions', {})),
+                                              dat.nRows, dat.fileName)
+    print 'columns: %s' %', '.join(dat.names)
+    return 0
+
+class _EntryStream(object):
+    """Appends the entries of an :class:`ExperimentHandler` to a csv file as
+    they are completed, from a background thread, so that they needn't be
+    kept in memory and aren't lost if the experiment crashes.
+
+    The columns are the names seen so far (new ones are added at the end as
+    new data names or loop parameters appear) so earlier rows simply have
+    fewer cells. The names, and the row at which each was first used, are
+    kept in a small `.names` file alongside (rewritten when a name is added).
+    """
+    def __init__(self, fileRoot):
+        self.fileName = fileRoot+'_stream.csv'
+        self.namesFileName = fileRoot+'_stream.names'
+        self.names = []
+        self.firstRows = []  # row at which each name was first used
+        self.nRows = 0
+        self.multiLine = False  # whether any value contains a newline
+        self.hasQuotes = False  # whether any value contains a " (escaped as "")
+        self.savedRows = None  # rows in the last file saved from the stream
+        self._file = codecs.open(self.fileName, 'w', encoding='utf-8')
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, entry, names):
+        """Queue an entry (dict) to be written. `names` gives the preferred
+        order for any names not already in the file
+        """
+        self._queue.put((entry, names))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                self._write(*item)
+            except Exception, err:
+                logging.error("Failed to stream experiment data: %s" %err)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, entry, names):
+        newNames = [name for name in names if name not in self.names]
+        newNames += [name for name in entry if
+                     name not in self.names and name not in newNames]
+        if newNames:
+            self.names.extend(newNames)
+            self.firstRows.extend([self.nRows]*len(newNames))
+            namesFile = codecs.open(self.namesFileName, 'w', encoding='utf-8')
+            for name, row in zip(self.names, self.firstRows):
+                namesFile.write(u'%i\t%s\n' %(row, name))
+            namesFile.close()
+        cells = []
+        for name in self.names:
+            if name in entry:
+                value = unicode(entry[name])
+                if u'"' in value:
+                    #quoted as by csv.writer, so csv.reader gets the value back
+                    self.hasQuotes = True
+                    cells.append(u'"%s",' %value.replace(u'"', u'""'))
+                else:
+                    cells.append(_formatWideTextCell(value, ','))
+                if '\n' in cells[-1]:
+                    self.multiLine = True
+            else:
+                cells.append(u',')
+        self._file.write(u''.join(cells)+u'\n')
+        self._file.flush()  # a line at a time so a crash loses nothing
+        self.nRows += 1
+
+    def wait(self):
+        """Wait until all queued entries have been written
+        """
+        self._queue.join()
+
+    def writeWideText(self, f, names, delim, matrixOnly=False):
+        """Write the streamed rows to the open file `f` as a wide text file
+        with the given column `names` (which must include all streamed names)
+        """
+        self.wait()
+        if not matrixOnly:
+            f.write(u''.join([u'%s%s' %(name, delim) for name in names]))
+            f.write('\n')
+        if names[:len(self.names)] == self.names and delim == ',' \
+                and not self.multiLine and not self.hasQuotes:
+            #rows just need padding for the columns added after them
+            nCols = len(names)
+            nCellsAtRow = numpy.searchsorted(self.firstRows, numpy.arange(self.nRows),
+                                             side='right')
+            streamFile = codecs.open(self.fileName, 'r', encoding='utf-8')
+            for rowN, line in enumerate(streamFile):
+                f.write(line[:-1] + delim*(nCols-nCellsAtRow[rowN]) + '\n')
+            streamFile.close()
+        else:
+            #columns are reordered (or a new delimiter) so parse the rows
+            colIndex = [self.names.index(name) if name in self.names else None
+                        for name in names]
+            streamFile = open(self.fileName, 'rb')
+            for row in csv.reader(streamFile):
+                row = [cell.decode('utf-8') for cell in row]
+                for ii in colIndex:
+                    if ii is None or ii >= len(row) or row[ii] == '':
+                        f.write(delim)
+                    else:
+                        f.write(_formatWideTextCell(row[ii], delim))
+                f.write('\n')
+            streamFile.close()
+
+    def getColumns(self, names):
+        """Return the streamed values (as strings) for each of `names`
+        """
+        self.wait()
+        colIndex = [self.names.index(name) if name in self.names else None
+                    for name in names]
+        columns = [[] for name in names]
+        streamFile = open(self.fileName, 'rb')
+        for row in csv.reader(streamFile):
+            for column, ii in zip(columns, colIndex):
+                if ii is None or ii >= len(row):
+                    column.append(u'')
+                else:
+                    column.append(row[ii].decode('utf-8'))
+        streamFile.close()
+        return columns
+
+    def setSaved(self):
+        """Record that all the rows written so far have been saved to a data
+        file (call after wait())
+        """
+        self.savedRows = self.nRows
+
+    def close(self, remove=False):
+        """Finish writing. The stream files are then deleted if `remove` is
+        True, but only if no rows have been added since they were last saved
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+        if remove and self.savedRows == self.nRows:
+            for fileName in [self.fileName, self.namesFileName]:
+                if os.path.exists(fileName):
+                    os.remove(fileName)
+
 class ExperimentHandler(object):
     """A container class for keeping track of multiple loops/handlers
 
@@ -39,6 +739,7 @@ class ExperimentHandler(object):
         exp = data.ExperimentHandler(name="Face Preference",version='0.1.0')
 
     """
+    _stream = None  # see streamData (also for handlers pickled without it)
     def __init__(self,
                 name='',
                 version='',
@@ -48,7 +749,8 @@ class ExperimentHandler(object):
                 savePickle=True,
                 saveWideText=True,
                 dataFileName='',
-                autoLog=True):
+                autoLog=True,
+                streamData=False):
         """
         :parameters:
 
@@ -77,6 +779,18 @@ class ExperimentHandler(object):
                 The handler will attempt to populate the file even in the
                 event of a (not too serious) crash!
 
+            streamData : True or False
+                If True (and a dataFileName is given) each entry is appended,
+                by a background thread, to `dataFileName_stream.csv` as soon
+                as nextEntry() is called, instead of being kept in
+                self.entries. Memory use then stays constant however many
+                trials are run, and the data survive a crash. The final
+                saveAsWideText just adds the complete header to those rows.
+                The stream files are removed when the handler is deleted if
+                no entries have been added since the data were last saved
+                (otherwise they hold the only copy of the later entries).
+                The entries are not included in the psydat file.
+
         """
         self.loops=[]
         self.loopsUnfinished=[]
@@ -96,10 +810,13 @@ class ExperimentHandler(object):
         self._paramNamesSoFar=[]
         self.dataNames=[]#names of all the data (eg. resp.keys)
         self.autoLog = autoLog
+        self._stream = None
         if dataFileName in ['', None]:
             logging.warning('ExperimentHandler created with no dataFileName parameter. No data will be saved in the event of a crash')
         else:
             checkValidFilePath(dataFileName, makeValid=True) #fail now if we fail at all!
+            if streamData:
+                self._stream = _EntryStream(dataFileName)
     def __del__(self):
         if self.dataFileName not in ['', None]:
             if self.autoLog:
@@ -108,6 +825,17 @@ class ExperimentHandler(object):
                 self.saveAsPickle(self.dataFileName)
             if self.saveWideText==True:
                 self.saveAsWideText(self.dataFileName+'.csv', delim=',')
+        if self._stream is not None:
+            #the data are in the wide text file now, unless it wasn't saved
+            #or entries were added after it was
+            self._stream.close(remove=True)
+            if os.path.exists(self._stream.fileName) and self._stream.nRows:
+                logging.warning('Data for %s ExperimentHandler are in %s' %(self.name, self._stream.fileName))
+    def __getstate__(self):
+        #the stream (a thread and an open file) can't be pickled
+        state = self.__dict__.copy()
+        state['_stream'] = None
+        return state
     def addLoop(self, loopHandler):
         """Add a loop such as a :class:`~psychopy.data.TrialHandler` or :class:`~psychopy.data.StairHandler`
         Data from this loop will be included in the resulting data files.
@@ -228,7 +956,13 @@ class ExperimentHandler(object):
         #add the extraInfo dict to the data
         if type(self.extraInfo)==dict:
             this.update(self.extraInfo)#NB update() really means mergeFrom()
-        self.entries.append(this)
+        if self._stream is not None:
+            names = self._getAllParamNames()
+            names.extend(self.dataNames)
+            names.extend(self._getExtraInfo()[0])
+            self._stream.add(this, names)
+        else:
+            self.entries.append(this)
         #then create new empty entry for n
         self.thisEntry = {}
     def saveAsWideText(self, fileName, delim=None,
@@ -242,7 +976,18 @@ class ExperimentHandler(object):
 
         If `matrixOnly=True` then the file will not contain a header row, which can be handy if you want to append data
         to an existing file of the same format.
+
+        If `fileName` ends with .npz or .hdf5 (.h5) the same columns are saved in
+        that binary format instead (HDF5 needs PyTables). Numeric columns are saved
+        as floats (NaN where there is no value) and others as strings.
         """
+        if os.path.splitext(fileName)[1].lower() in ['.npz', '.hdf5', '.h5']:
+            names, columns = self._getColumns()
+            _saveColumns(fileName, names, columns)
+            if self._stream is not None:
+                self._stream.setSaved()
+            self.saveWideText=False
+            return
 
         #create the file or print to stdout
         if appendFile: writeFormat='a'
@@ -268,26 +1013,75 @@ class ExperimentHandler(object):
         names = self._getAllParamNames()
         names.extend(self.dataNames)
         names.extend(self._getExtraInfo()[0]) #names from the extraInfo dictionary
+        if self._stream is not None:
+            #the entries are already on disk
+            self._stream.wait()
+            names.extend([name for name in self._stream.names if name not in names])
+            self._stream.writeWideText(f, names, delim, matrixOnly=matrixOnly)
+            if fileName != 'stdout':
+                f.close()
+                self._stream.setSaved()
+            self.saveWideText=False
+            return
         #write a header line
         if not matrixOnly:
             for heading in names:
                 f.write(u'%s%s' %(heading,delim))
             f.write('\n')
-        #write the data for each entry
-
-        for entry in self.entries:
-            for name in names:
-                entry.keys()
-                if name in entry.keys():
-                    if ',' in unicode(entry[name]) or '\n' in unicode(entry[name]):
-                        f.write(u'"%s"%s' %(entry[name],delim))
-                    else:
-                        f.write(u'%s%s' %(entry[name],delim))
-                else:
-                    f.write(delim)
-            f.write('\n')
-        f.close()
+        #write the data, a column at a time
+        columns = [[entry.get(name, u'') for entry in self.entries]
+                   for name in names]
+        _writeWideText(f, columns, len(self.entries), delim,
+                       lineEnd=delim+'\n', quote=True)
+        if f != sys.stdout:
+            f.close()
         self.saveWideText=False
+    def _getColumns(self):
+        """Returns the names and the columns of values (one per entry) of the
+        wide-format data (as strings if the entries have been streamed)
+        """
+        names = self._getAllParamNames()
+        names.extend(self.dataNames)
+        names.extend(self._getExtraInfo()[0])
+        if self._stream is not None:
+            names.extend([name for name in self._stream.names if name not in names])
+            columns = self._stream.getColumns(names)
+        else:
+            columns = [[entry.get(name, u'') for entry in self.entries]
+                       for name in names]
+        return names, columns
+    def saveAsColumns(self, fileName, appendFile=False, fileCollisionMethod='rename'):
+        """Saves the entries (as for saveAsWideText) and information about the
+        experiment to a column data file, which can be loaded much faster than
+        a pickle file (see :class:`ColumnDataFile`). The extension `.psycol`
+        is added if needed.
+
+        If `appendFile` is True and the file exists the entries are added to
+        the end of it. Returns the name of the file saved.
+
+        :Parameters:
+
+            fileCollisionMethod: Collision method passed to :func:`~psychopy.tools.fileerrortools.handleFileCollision`
+        """
+        if not fileName.endswith('.psycol'):
+            fileName+='.psycol'
+        if os.path.exists(fileName) and not appendFile:
+            fileName = handleFileCollision(fileName, fileCollisionMethod)
+        names, columns = self._getColumns()
+        if self._stream is not None:
+            #recover the numbers from the streamed text
+            columns = [_csvColumnValues([cell.encode('utf-8') for cell in column])
+                       for column in columns]
+        info = {'handler': self.__class__.__name__, 'name': self.name,
+                'version': self.version, 'extraInfo': self.extraInfo,
+                'runtimeInfo': self.runtimeInfo, 'originPath': self.originPath,
+                'dataNames': self.dataNames}
+        writer = ColumnDataWriter(fileName, info=info, appendFile=appendFile)
+        writer.addColumns(names, columns)
+        writer.close()
+        if self.autoLog:
+            logging.info('saved data to %s' %fileName)
+        return fileName
     def saveAsPickle(self,fileName, fileCollisionMethod = 'rename'):
         """Basically just saves a copy of self (with data) to a pickle file.
 
@@ -315,10 +1109,15 @@ class ExperimentHandler(object):
 
         Experiment handler will attempt automatically to save data (even in the event of a crash if possible).
         So if you quit your script early you may want to tell the Handler not to save out the data files for this run.
-        This is the method that allows you to do that.
+        This is the method that allows you to do that. Entries that have been
+        streamed (see `streamData`) are still left in the stream file.
         """
         self.savePickle=False
         self.saveWideText=False
+        if self._stream is not None:
+            #keep the streamed entries, in case they are wanted after all
+            self._stream.close()
+            self._stream = None
 
 class TrialType(dict):
     """This is just like a dict, except that you can access keys with obj.key
@@ -387,6 +1186,50 @@ class _BaseTrialHandler(object):
         f = open(fileName, 'wb')
         cPickle.dump(self, f)
         f.close()
+    def _getColumnData(self):
+        """Returns the names and the columns of values (one per trial) that
+        saveAsColumns saves (empty if no trials have been run)
+        """
+        raise NotImplementedError
+    def _getColumnInfo(self):
+        info = {'handler': self.__class__.__name__}
+        for attr in ['name', 'nReps', 'method', 'seed', 'trialList', 'nTrials',
+                     'startVal', 'startValSd', 'nReversals', 'stepSizes',
+                     'stepType', 'nUp', 'nDown', 'minVal', 'maxVal',
+                     'reversalIntensities', 'reversalPoints', 'conditions',
+                     'extraInfo', 'originPath']:
+            if hasattr(self, attr):
+                info[attr] = getattr(self, attr)
+        return info
+    def saveAsColumns(self, fileName, appendFile=False, fileCollisionMethod='rename'):
+        """Saves the data (one row per trial) and the parameters of the handler
+        to a column data file, which can be loaded much faster than a pickle
+        file (see :class:`ColumnDataFile`). The extension `.psycol` is added if
+        needed.
+
+        If `appendFile` is True and the file exists the trials are added to
+        the end of it. Returns the name of the file saved.
+
+        :Parameters:
+
+            fileCollisionMethod: Collision method passed to :func:`~psychopy.tools.fileerrortools.handleFileCollision`
+        """
+        names, columns = self._getColumnData()
+        if not columns or len(columns[0]) == 0:
+            if self.autoLog:
+                logging.info('.saveAsColumns() called but no trials completed. Nothing saved')
+            return -1
+        if not fileName.endswith('.psycol'):
+            fileName+='.psycol'
+        if os.path.exists(fileName) and not appendFile:
+            fileName = handleFileCollision(fileName, fileCollisionMethod)
+        writer = ColumnDataWriter(fileName, info=self._getColumnInfo(),
+                                  appendFile=appendFile)
+        writer.addColumns(names, columns)
+        writer.close()
+        if self.autoLog:
+            logging.info('saved data to %s' %fileName)
+        return fileName
     def saveAsText(self,fileName,
                    stimOut=[],
                    dataOut=('n','all_mean','all_std', 'all_raw'),
@@ -686,6 +1529,11 @@ class TrialHandler(_BaseTrialHandler):
 
             .thisIndex - the index of the current trial in the original conditions list
 
+            .sequenceIndices - the index of the condition for each [trialN, repN].
+                For the 'random', 'sequential' and 'fullRandom' methods this
+                is created as needed but can be used like the array of earlier
+                versions (it's saved in psydat files as that array)
+
             .nTotal - the total number of trials that will be run
 
             .nRemaining - the total number of trials remaining
@@ -713,9 +1561,11 @@ class TrialHandler(_BaseTrialHandler):
         else:
             self.trialList =trialList
         #convert any entry in the TrialList into a TrialType object (with obj.key or obj[key] access)
-        for n, entry in enumerate(trialList):
-            if type(entry)==dict:
-                trialList[n]=TrialType(entry)
+        #(a FactorialTrialList creates TrialTypes itself, as they are needed)
+        if not isinstance(trialList, FactorialTrialList):
+            for n, entry in enumerate(trialList):
+                if type(entry)==dict:
+                    trialList[n]=TrialType(entry)
         self.nReps = int(nReps)
         self.nTotal = self.nReps*len(self.trialList)
         self.nRemaining =self.nTotal #subtract 1 each trial
@@ -733,8 +1583,7 @@ class TrialHandler(_BaseTrialHandler):
         self.data = DataHandler(trials=self)
         if dataTypes!=None:
             self.data.addDataType(dataTypes)
-        self.data.addDataType('ran')
-        self.data['ran'].mask=False#this is a bool - all entries are valid
+        self.data.addDataType('ran', allValid=True)#this is a bool - all entries are valid
         self.data.addDataType('order')
         #generate stimulus sequence
         if self.method in ['random','sequential', 'fullRandom']:
@@ -746,6 +1595,12 @@ class TrialHandler(_BaseTrialHandler):
 
     def __iter__(self):
         return self
+    def __getstate__(self):
+        #psydat files store the sequence as the array of earlier versions
+        state = self.__dict__.copy()
+        if isinstance(state.get('sequenceIndices'), _TrialSequence):
+            state['sequenceIndices'] = numpy.array(self.sequenceIndices)
+        return state
     def __repr__(self):
         """prints a more verbose version of self as string"""
         return self.__str__(verbose=True)
@@ -792,7 +1647,9 @@ class TrialHandler(_BaseTrialHandler):
         This is called automatically when the TrialHandler is initialised so doesn't
         need an explicit call from the user.
 
-        The returned sequence has form indices[stimN][repN]
+        The returned sequence has form indices[stimN][repN] (or indices[stimN, repN],
+        which is much quicker) and can be converted to an array with numpy.array().
+        The order for each rep of method='random' is only created when it's needed.
         Example: sequential with 6 trialtypes (rows), 5 reps (cols), returns:
             [[0 0 0 0 0]
              [1 1 1 1 1]
@@ -810,27 +1667,11 @@ class TrialHandler(_BaseTrialHandler):
         Note that users can make any sequence whatsoever outside of PsychoPy, and
         specify sequential order; any order is possible this way.
         """
-        # create indices for a single rep
-        indices = numpy.asarray(self._makeIndices(self.trialList), dtype=int)
-
-        if self.method == 'random':
-            sequenceIndices = []
-            seed=self.seed
-            for thisRep in range(self.nReps):
-                thisRepSeq = shuffleArray(indices.flat, seed=seed).tolist()
-                seed=None#so that we only seed the first pass through!
-                sequenceIndices.append(thisRepSeq)
-            sequenceIndices = numpy.transpose(sequenceIndices)
-        elif self.method == 'sequential':
-            sequenceIndices = numpy.repeat(indices,self.nReps,1)
-        elif self.method == 'fullRandom':
-            # indices*nReps, flatten, shuffle, unflatten; only use seed once
-            sequential = numpy.repeat(indices, self.nReps,1) # = sequential
-            randomFlat = shuffleArray(sequential.flat, seed=self.seed)
-            sequenceIndices = numpy.reshape(randomFlat, (len(indices), self.nReps))
+        sequenceIndices = _TrialSequence(len(self.trialList), self.nReps,
+                                         self.method, seed=self.seed)
         if self.autoLog:
             logging.exp('Created sequence: %s, trialTypes=%d, nReps=%i, seed=%s' %
-                (self.method, len(indices), self.nReps, str(self.seed) )  )
+                (self.method, len(self.trialList), self.nReps, str(self.seed) )  )
         return sequenceIndices
 
     def _makeIndices(self,inputArray):
@@ -899,7 +1740,7 @@ class TrialHandler(_BaseTrialHandler):
 
         #fetch the trial info
         if self.method in ['random','sequential','fullRandom']:
-            self.thisIndex = self.sequenceIndices[self.thisTrialN][self.thisRepN]
+            self.thisIndex = self.sequenceIndices[self.thisTrialN, self.thisRepN]
             self.thisTrial = self.trialList[self.thisIndex]
             self.data.add('ran',1)
             self.data.add('order',self.thisN)
@@ -914,8 +1755,8 @@ class TrialHandler(_BaseTrialHandler):
         # check that we don't go out of bounds for either positive or negative offsets:
         if n>self.nRemaining or self.thisN+n < 0:
             return None
-        seqs = numpy.array(self.sequenceIndices).transpose().flat
-        condIndex=seqs[self.thisN+n]
+        repN, trialN = divmod(self.thisN+n, len(self.trialList))
+        condIndex = self.sequenceIndices[trialN, repN]
         return self.trialList[condIndex]
 
     def getEarlierTrial(self, n=-1):
@@ -1116,11 +1957,20 @@ class TrialHandler(_BaseTrialHandler):
             appendFile:
                 will add this output to the end of the specified file if it already exists.
 
+        If `fileName` ends with .npz or .hdf5 (.h5) the same columns are saved in that binary
+        format instead (HDF5 needs PyTables). Numeric columns are saved as floats (NaN where
+        there is no value) and others as strings.
+
         """
         if self.thisTrialN<1 and self.thisRepN<1:#if both are <1 we haven't started
             logging.info('TrialHandler.saveAsWideText called but no trials completed. Nothing saved')
             return -1
 
+        header, columns, nTrials = self._getWideColumns()
+        if os.path.splitext(fileName)[1].lower() in ['.npz', '.hdf5', '.h5']:
+            _saveColumns(fileName, header, columns)
+            return
+
         #create the file or print to stdout
         if appendFile:
             writeFormat='a'
@@ -1133,6 +1983,27 @@ class TrialHandler(_BaseTrialHandler):
             if delim==',': f = codecs.open(fileName+'.csv', writeFormat, encoding="utf-8")
             else: f=codecs.open(fileName+'.txt',writeFormat, encoding = "utf-8")
 
+        if not matrixOnly:
+            # write the header row:
+            f.write(delim.join(header) + '\n')
+
+        # write the data matrix:
+        _writeWideText(f, columns, nTrials, delim)
+
+        if f != sys.stdout:
+            f.close()
+            logging.info('saved wide-format data to %s' %f.name)
+
+    def _getColumnData(self):
+        if self.thisTrialN<1 and self.thisRepN<1:#if both are <1 we haven't started
+            return [], []
+        header, columns, nTrials = self._getWideColumns()
+        return header, columns
+
+    def _getWideColumns(self):
+        """Returns the header, the columns of values (one value per trial, in the
+        order they were run) and the number of trials for saveAsWideText
+        """
         # collect parameter names related to the stimuli:
         if self.trialList[0]:
             header = self.trialList[0].keys()
@@ -1141,71 +2012,53 @@ class TrialHandler(_BaseTrialHandler):
         # and then add parameter names related to data (e.g. RT)
         header.extend(self.data.dataTypes)
 
-        # loop through each trial, gathering the actual values:
-        dataOut = []
-        trialCount = 0
-        # total number of trials = number of trialtypes * number of repetitions:
-
-        repsPerType={}
-        for rep in range(self.nReps):
-            for trialN in range(len(self.trialList)):
-                #find out what trial type was on this trial
-                trialTypeIndex = self.sequenceIndices[trialN, rep]
-                #determine which repeat it is for this trial
-                if trialTypeIndex not in repsPerType.keys():
-                    repsPerType[trialTypeIndex]=0
-                else:
-                    repsPerType[trialTypeIndex]+=1
-                repThisType=repsPerType[trialTypeIndex]#what repeat are we on for this trial type?
+        # the trial type of each trial, in the order they were run, and which
+        # repeat of that type it was:
+        typeIndices = numpy.array(self.sequenceIndices).transpose().ravel()
+        nTrials = len(typeIndices)
+        order = numpy.argsort(typeIndices, kind='mergesort')
+        firstOfType = numpy.searchsorted(typeIndices[order], typeIndices[order])
+        repIndices = numpy.empty(nTrials, dtype=int)
+        repIndices[order] = numpy.arange(nTrials) - firstOfType
+        typeList = typeIndices.tolist()
+
+        columns = {}
+        for parameterName in header:
+            if parameterName in columns:
+                continue
+            # the header includes both trial and data variables, so take the value from the
+            # trial type if it has one, else the data (or a null value if neither has it):
+            inTrial = [bool(thisType) and parameterName in thisType for thisType in self.trialList]
+            typeVals = [thisType[parameterName] if inType else None
+                        for thisType, inType in zip(self.trialList, inTrial)]
+            if all(inTrial):
+                columns[parameterName] = [typeVals[ii] for ii in typeList]
+                continue
+            if parameterName in self.data:
+                vals = self.data[parameterName][typeIndices, repIndices]
+                dataVals = numpy.ma.getdata(vals).tolist()
+                for trialN in numpy.flatnonzero(numpy.ma.getmaskarray(vals)):
+                    dataVals[trialN] = numpy.ma.masked
+            else:
+                dataVals = ['']*nTrials
+            if any(inTrial):
+                columns[parameterName] = [typeVals[ii] if inTrial[ii] else dataVals[trialN]
+                                          for trialN, ii in enumerate(typeList)]
+            else:
+                columns[parameterName] = dataVals
 
-                # create a dictionary representing each trial:
-                # this is wide format, so we want fixed information (e.g. subject ID, date, etc) repeated every line if it exists:
-                if (self.extraInfo != None):
-                    nextEntry = self.extraInfo.copy()
-                else:
-                    nextEntry = {}
-
-                # add a trial number so the original order of the data can always be recovered if sorted during analysis:
-                trialCount += 1
-                nextEntry["TrialNumber"] = trialCount
-
-                # now collect the value from each trial of the variables named in the header:
-                for parameterName in header:
-                    # the header includes both trial and data variables, so need to check before accessing:
-                    if self.trialList[trialTypeIndex] and parameterName in self.trialList[trialTypeIndex]:
-                        nextEntry[parameterName] = self.trialList[trialTypeIndex][parameterName]
-                    elif parameterName in self.data:
-                        nextEntry[parameterName] = self.data[parameterName][trialTypeIndex][repThisType]
-                    else: # allow a null value if this parameter wasn't explicitly stored on this trial:
-                        nextEntry[parameterName] = ''
-
-                #store this trial's data
-                dataOut.append(nextEntry)
-
-        # get the extra 'wide' parameter names into the header line:
+        # add a trial number so the original order of the data can always be recovered if
+        # sorted during analysis, and (this is wide format) fixed information (e.g. subject
+        # ID, date, etc) repeated on every line:
         header.insert(0,"TrialNumber")
+        if "TrialNumber" not in columns:
+            columns["TrialNumber"] = range(1, nTrials+1)
         if (self.extraInfo != None):
             for key in self.extraInfo:
                 header.insert(0, key)
-
-        if not matrixOnly:
-        # write the header row:
-            nextLine = ''
-            for parameterName in header:
-                nextLine = nextLine + parameterName + delim
-            f.write(nextLine[:-1] + '\n') # remove the final orphaned tab character
-
-        # write the data matrix:
-        for trial in dataOut:
-            nextLine = ''
-            for parameterName in header:
-                nextLine = nextLine + unicode(trial[parameterName]) + delim
-            nextLine = nextLine[:-1] # remove the final orphaned tab character
-            f.write(nextLine + '\n')
-
-        if f != sys.stdout:
-            f.close()
-            logging.info('saved wide-format data to %s' %f.name)
+                if key not in columns:
+                    columns[key] = [self.extraInfo[key]]*nTrials
+        return header, [columns[name] for name in header], nTrials
 
     def addData(self, thisType, value, position=None):
         """Add data for the current trial
@@ -1222,7 +2075,7 @@ def importTrialTypes(fileName, returnFieldNames=False):
     logging.warning("importTrialTypes is DEPRECATED (as of v1.70.00). Please use `importConditions` for identical functionality.")
     return importConditions(fileName, returnFieldNames)
 
-def importConditions(fileName, returnFieldNames=False):
+def importConditions(fileName, returnFieldNames=False, useCache=False):
     """Imports a list of conditions from an .xlsx, .csv, or .pkl file
 
     The output is suitable as an input to :class:`TrialHandler` `trialTypes` or to
@@ -1241,6 +2094,15 @@ def importConditions(fileName, returnFieldNames=False):
         - begin with a letter (upper or lower case)
         - contain no spaces or other punctuation (underscores are permitted)
 
+    Cells that look like a list (e.g. "[1, 2]"), or in .xlsx files a tuple,
+    are converted to one (only for literal values; other cells are left as
+    strings).
+
+    If `useCache=True` the conditions from .csv and .xlsx files are also saved
+    (in a conditionsCache folder in the user preferences folder) under a hash
+    of the file contents, so that the same file is not parsed again. The
+    cache is not cleared automatically (delete the folder to clear it).
+
     """
     def _assertValidVarNames(fieldNames, fileName):
         """screens a list of names as candidate variable names. if all names are
@@ -1261,28 +2123,7 @@ def importConditions(fileName, returnFieldNames=False):
     if not os.path.isfile(fileName):
         raise ImportError, 'Conditions file not found: %s' %os.path.abspath(fileName)
 
-    if fileName.endswith('.csv'):
-        #use csv import library to fetch the fieldNames
-        f = open(fileName, 'rU')#the U converts line endings to os.linesep (not unicode!)
-        trialsArr = numpy.recfromcsv(f, case_sensitive=True)
-        fieldNames = trialsArr.dtype.names
-        _assertValidVarNames(fieldNames, fileName)
-        f.close()
-        #convert the record array into a list of dicts
-        trialList = []
-        for trialN, trialType in enumerate(trialsArr):
-            thisTrial ={}
-            for fieldN, fieldName in enumerate(fieldNames):
-                val = trialsArr[trialN][fieldN]
-                if type(val)==numpy.string_:
-                    val = unicode(val.decode('utf-8'))
-                    #if it looks like a list, convert it:
-                    if val.startswith('[') and val.endswith(']'):
-                        #exec('val=%s' %unicode(val.decode('utf8')))
-                        val = eval(val)
-                thisTrial[fieldName] = val
-            trialList.append(thisTrial)
-    elif fileName.endswith('.pkl'):
+    if fileName.endswith('.pkl'):
         f = open(fileName, 'rU') # is U needed?
         try:
             trialsArr = cPickle.load(f)
@@ -1298,37 +2139,22 @@ def importConditions(fileName, returnFieldNames=False):
                 thisTrial[fieldName] = row[fieldN] # type is correct, being .pkl
             trialList.append(thisTrial)
     else:
-        if not haveOpenpyxl:
-            raise ImportError, 'openpyxl is required for loading excel format files, but it was not found.'
-        try:
-            wb = load_workbook(filename = fileName)
-        except: # InvalidFileException(unicode(e)): # this fails
-            raise ImportError, 'Could not open %s as conditions' % fileName
-        ws = wb.worksheets[0]
-        nCols = ws.get_highest_column()
-        nRows = ws.get_highest_row()
-
-        #get parameter names from the first row header
-        fieldNames = []
-        for colN in range(nCols):
-            fieldName = ws.cell(_getExcelCellName(col=colN, row=0)).value
-            fieldNames.append(fieldName)
-        _assertValidVarNames(fieldNames, fileName)
-
-        #loop trialTypes
-        trialList = []
-        for rowN in range(1, nRows):#skip header first row
-            thisTrial={}
-            for colN in range(nCols):
-                val = ws.cell(_getExcelCellName(col=colN, row=rowN)).value
-                #if it looks like a list, convert it
-                if type(val) in [unicode, str] and (
-                        val.startswith('[') and val.endswith(']') or
-                        val.startswith('(') and val.endswith(')') ):
-                    val = eval(val)
-                fieldName = fieldNames[colN]
-                thisTrial[fieldName] = val
-            trialList.append(thisTrial)
+        #conditions parsed before (from a file with identical contents) are cached
+        cacheFileName = None
+        if useCache:
+            cacheFileName = _getConditionsCacheFileName(fileName)
+        cached = _readConditionsCache(cacheFileName)
+        if cached:
+            trialList, fieldNames = cached
+        else:
+            if fileName.endswith('.csv'):
+                fieldNames, columns = _readCsvColumns(fileName)
+            else:
+                fieldNames, columns = _readXlsxColumns(fileName)
+            _assertValidVarNames(fieldNames, fileName)
+            #convert the columns into a list of dicts
+            trialList = [dict(zip(fieldNames, row)) for row in zip(*columns)]
+            _writeConditionsCache(cacheFileName, trialList, fieldNames)
 
     logging.exp('Imported %s as conditions, %d conditions, %d params' %
                  (fileName, len(trialList), len(fieldNames)))
@@ -1337,7 +2163,152 @@ def importConditions(fileName, returnFieldNames=False):
     else:
         return trialList
 
-def createFactorialTrialList(factors):
+_conditionsCacheVersion = 1  # increase if the parsing changes
+
+def _parseConditionsCell(val, tuples=True):
+    """Convert a cell that looks like a list (or, if `tuples`, a tuple) of
+    literals to one (without using eval) or return it unchanged
+    """
+    if type(val) in [unicode, str] and (
+            val.startswith('[') and val.endswith(']') or
+            tuples and val.startswith('(') and val.endswith(')') ):
+        try:
+            return ast.literal_eval(val)
+        except (ValueError, SyntaxError):
+            logging.warning('Conditions value %s looks like a list but is not '
+                            'a list of values; keeping it as text' %val)
+    return val
+
+def _csvColumnValues(cells):
+    """Convert a column of csv cells (strings) to int, float or bool values
+    (as numpy scalars) if they all are, or unicode otherwise (blank cells
+    in numeric columns are NaN)
+    """
+    strCells = numpy.array(cells, dtype=str)
+    missing = strCells == ''
+    if missing.all():
+        return [u'']*len(cells)
+    if not missing.any():
+        try:
+            return list(strCells.astype(numpy.int64))
+        except ValueError:
+            pass
+    try:
+        return list(numpy.where(missing, 'nan', strCells).astype(float))
+    except ValueError:
+        pass
+    lower = numpy.char.lower(strCells)
+    if not missing.any() and numpy.all((lower == 'true') | (lower == 'false')):
+        return list(lower == 'true')
+    #only lists are converted from csv cells, so e.g. "(3)" stays text
+    return [_parseConditionsCell(cell.decode('utf-8'), tuples=False) for cell in cells]
+
+def _readCsvColumns(fileName):
+    """Read the names (from the first row) and the columns of values of a
+    conditions file in csv format
+    """
+    f = open(fileName, 'rU')#the U converts line endings to os.linesep (not unicode!)
+    rows = [row for row in csv.reader(f) if any(row)]  # skip blank lines
+    f.close()
+    if not rows:
+        return [], []
+    header = rows[0]
+    if header[0].startswith(codecs.BOM_UTF8):
+        header[0] = header[0][len(codecs.BOM_UTF8):]
+    #names are made valid in the same way as numpy.recfromcsv
+    fieldNames = list(NameValidator(case_sensitive=True)([name.strip() for name in header]))
+    nCols = len(fieldNames)
+    for rowN, row in enumerate(rows):
+        if len(row) > nCols and any(row[nCols:]):
+            raise ImportError, 'Conditions file %s: row %i has more values than there are parameter names' %(fileName, rowN+1)
+        if len(row) < nCols:
+            row.extend(['']*(nCols-len(row)))
+    columns = [_csvColumnValues([row[colN] for row in rows[1:]])
+               for colN in range(nCols)]
+    return fieldNames, columns
+
+def _readXlsxColumns(fileName):
+    """Read the names (from the first row) and the columns of values of a
+    conditions file in xlsx format (streaming the rows, read-only)
+    """
+    if not haveOpenpyxl:
+        raise ImportError, 'openpyxl is required for loading excel format files, but it was not found.'
+    try:
+        try:
+            wb = load_workbook(filename=fileName, read_only=True)
+        except TypeError: #older openpyxl
+            wb = load_workbook(filename=fileName, use_iterators=True)
+    except: # InvalidFileException(unicode(e)): # this fails
+        raise ImportError, 'Could not open %s as conditions' % fileName
+    try:
+        ws = wb.worksheets[0]
+        rows = []
+        for row in ws.iter_rows():
+            #cells from older openpyxl iterators have internal_value instead of value
+            rows.append([cell.value if hasattr(cell, 'value') else cell.internal_value
+                         for cell in row])
+    finally:
+        #a read-only workbook keeps the file open until it's closed
+        if hasattr(wb, 'close'):
+            wb.close()
+    if not rows:
+        return [], []
+    #get parameter names from the first row header
+    fieldNames = rows[0]
+    while fieldNames and fieldNames[-1] is None:
+        fieldNames.pop()
+    nCols = len(fieldNames)
+    columns = [[] for fieldName in fieldNames]
+    for row in rows[1:]:#skip header first row
+        row = row + [None]*(nCols-len(row))
+        for colN in range(nCols):
+            columns[colN].append(_parseConditionsCell(row[colN]))
+    return fieldNames, columns
+
+def _getConditionsCacheFileName(fileName):
+    """The name of the cache file for the (current) contents of a conditions file
+    """
+    f = open(fileName, 'rb')
+    digest = hashlib.sha1(f.read())
+    f.close()
+    digest.update('%s%i' %(os.path.splitext(fileName)[1], _conditionsCacheVersion))
+    return os.path.join(psychopy.prefs.paths['userPrefsDir'], 'conditionsCache',
+                        digest.hexdigest()+'.pickle')
+
+def _readConditionsCache(cacheFileName):
+    """Returns (trialList, fieldNames) from the cache file, or None if there's none
+    """
+    if not cacheFileName or not os.path.isfile(cacheFileName):
+        return None
+    try:
+        f = open(cacheFileName, 'rb')
+        try:
+            return cPickle.load(f)
+        finally:
+            f.close()
+    except Exception, err:
+        logging.debug('Failed to read cached conditions %s: %s' %(cacheFileName, err))
+        return None
+
+def _writeConditionsCache(cacheFileName, trialList, fieldNames):
+    if not cacheFileName:
+        return
+    try:
+        cacheDir = os.path.dirname(cacheFileName)
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        #write to a temporary file first so other processes never see a partial one
+        tmpFileName = '%s.%i' %(cacheFileName, os.getpid())
+        f = open(tmpFileName, 'wb')
+        cPickle.dump((trialList, fieldNames), f, cPickle.HIGHEST_PROTOCOL)
+        f.close()
+        if os.path.exists(cacheFileName):
+            os.remove(cacheFileName)  # rename can't replace files on windows
+        os.rename(tmpFileName, cacheFileName)
+    except Exception, err:
+        logging.debug('Failed to cache conditions in %s: %s' %(cacheFileName, err))
+
+def createFactorialTrialList(factors, lazy=False):
     """Create a trialList by entering a list of factors with names (keys) and levels (values)
     it will return a trialList in which all factors have been factorially combined (so for example
     if there are two factors with 3 and 5 levels the trialList will be a list of 3*5 = 15, each specifying
@@ -1351,12 +2322,18 @@ def createFactorialTrialList(factors):
 
         factors : a dictionary with names (keys) and levels (values) of the factors
 
+        lazy : if True a :class:`FactorialTrialList` is returned, which creates
+            each condition only when it is needed (useful for designs with very
+            many combinations). The order of the conditions is the same.
+
     Example::
 
         mytrials = createFactorialTrialList( factors={"text": ["red", "green", "blue"],
             "letterColor": ["red", "green"], "size": [0,1]})
     """
 
+    if lazy:
+        return FactorialTrialList(factors)
     # the first step is to place all the factorial combinations in a list of lists
     tempListOfLists=[[]]
     for key in factors:
@@ -1379,6 +2356,136 @@ def createFactorialTrialList(factors):
 
     return trialList
 
+class FactorialTrialList(object):
+    """A list of conditions combining all the levels of some factors (as from
+    :func:`createFactorialTrialList`) where each condition is only created
+    when it is needed, so that very large designs take no time or memory to
+    set up. It can be given to a :class:`TrialHandler` as its trialList.
+
+    Usage::
+
+        conditions = data.FactorialTrialList({'ori':range(0,360,5), 'sf':[1,2,4]})
+        len(conditions)  # 216
+        conditions[5]  # {'ori': 25, 'sf': 1}
+
+    The first factor changes fastest, as for createFactorialTrialList.
+    """
+    def __init__(self, factors):
+        self.factors = factors
+        self.names = factors.keys()
+        self.levels = [list(factors[name]) for name in self.names]
+        self._nLevels = [len(levels) for levels in self.levels]
+        self._len = int(numpy.prod(self._nLevels)) if self.names else 1
+    def __len__(self):
+        return self._len
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[ii] for ii in range(*index.indices(self._len))]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('FactorialTrialList index out of range')
+        condition = TrialType()
+        for name, levels, nLevels in zip(self.names, self.levels, self._nLevels):
+            index, levelN = divmod(index, nLevels)
+            condition[name] = levels[levelN]
+        return condition
+    def __iter__(self):
+        for index in range(self._len):
+            yield self[index]
+    def __repr__(self):
+        return 'FactorialTrialList(%r)' %(self.factors,)
+
+class _TrialSequence(object):
+    """The order of the trials of a :class:`TrialHandler` (the index of the
+    condition for each trial of each repeat) for the non-adaptive methods.
+
+    This acts like the (nTrialTypes x nReps) array of earlier versions (use
+    numpy.array(seq) to get that array), but with method='random' each
+    repeat is only shuffled when it's first needed, and sequential orders
+    aren't stored at all. The orders are the same (for a given seed or
+    global random state) as when the whole sequence was created in advance,
+    and numpy's global random state is left the same too.
+
+    Indexing a single [trialN, repN] is done without creating the array.
+    Other indexing, arithmetic, comparisons and the other ndarray attributes
+    and methods (e.g. .T, .flat, .tolist()) are those of numpy.array(seq).
+    """
+    def __init__(self, nTrialTypes, nReps, method, seed=None):
+        self.shape = (nTrialTypes, nReps)
+        self.method = method
+        self._reps = []  # the orders for the repeats created so far
+        self._all = None
+        nTotal = nTrialTypes*nReps
+        if seed is not None and method in ['random', 'fullRandom']:
+            numpy.random.seed(seed)  #as documented, this sets the global seed
+        if method == 'random':
+            #shuffle with a copy of the global random state and use up the numbers
+            #that shuffling every repeat now would have used from it
+            self._rng = numpy.random.RandomState()
+            self._rng.set_state(numpy.random.get_state())
+            for start in range(0, nTotal, 100000):
+                numpy.random.random(min(100000, nTotal-start))
+        elif method == 'fullRandom':
+            # indices*nReps, shuffle, unflatten
+            sequential = numpy.repeat(numpy.arange(nTrialTypes), nReps)
+            randomFlat = sequential[numpy.argsort(numpy.random.random(nTotal))]
+            self._all = numpy.reshape(randomFlat, self.shape)
+    def _getRep(self, repN):
+        """The order of the trial types for one repeat
+        """
+        if self._all is not None:
+            return self._all[:, repN]
+        elif self.method == 'random':
+            #the repeats must be created in order (for reproducible orders)
+            if repN < 0:
+                repN += self.shape[1]
+            while len(self._reps) <= repN:
+                self._reps.append(numpy.argsort(self._rng.random_sample(self.shape[0])))
+            return self._reps[repN]
+        else:
+            return numpy.arange(self.shape[0])
+    def __getitem__(self, index):
+        if type(index) is tuple and len(index) == 2:
+            trialN, repN = index
+            if isinstance(trialN, (int, long, numpy.integer)) and \
+                    isinstance(repN, (int, long, numpy.integer)):
+                if not -self.shape[1] <= repN < self.shape[1]:
+                    raise IndexError('repeat %i is out of range' %repN)
+                return int(self._getRep(repN)[trialN])
+        return numpy.asarray(self)[index]
+    def __array__(self, dtype=None):
+        arr = numpy.zeros(self.shape, dtype=int)
+        for repN in range(self.shape[1]):
+            arr[:, repN] = self._getRep(repN)
+        if dtype is not None:
+            arr = arr.astype(dtype)
+        return arr
+    def __len__(self):
+        return self.shape[0]
+    def __iter__(self):
+        return iter(numpy.asarray(self))
+    def __repr__(self):
+        return repr(numpy.asarray(self))
+    def __getattr__(self, name):
+        #e.g. .T, .flat, .tolist(), .ravel() of the full array
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(numpy.asarray(self), name)
+
+def _sequenceArrayMethod(name):
+    def method(self, *args):
+        return getattr(numpy.asarray(self), name)(*args)
+    method.__name__ = name
+    return method
+for _name in ['__add__', '__radd__', '__sub__', '__rsub__', '__mul__', '__rmul__',
+              '__div__', '__rdiv__', '__truediv__', '__rtruediv__',
+              '__floordiv__', '__rfloordiv__', '__mod__', '__rmod__',
+              '__pow__', '__rpow__', '__neg__', '__pos__', '__abs__',
+              '__lt__', '__le__', '__eq__', '__ne__', '__gt__', '__ge__',
+              '__contains__']:
+    setattr(_TrialSequence, _name, _sequenceArrayMethod(_name))
+
 class StairHandler(_BaseTrialHandler):
     """Class to handle smoothly the selection of the next trial
     and report current values etc.
@@ -1860,6 +2967,17 @@ class StairHandler(_BaseTrialHandler):
         if self.autoLog:
             logging.info('saved data to %s' %fileName)
 
+    def _getColumnData(self):
+        nTrials = len(self.data)
+        names = ['trialN', 'intensity', 'response']
+        columns = [range(nTrials), self.intensities[:nTrials], list(self.data)]
+        for name in sorted(self.otherData.keys()):
+            if name in names:
+                continue
+            vals = list(self.otherData[name][:nTrials])
+            names.append(name)
+            columns.append(vals + [None]*(nTrials-len(vals)))
+        return names, columns
     def saveAsPickle(self,fileName):
         """Basically just saves a copy of self (with data) to a pickle file.
 
@@ -2166,6 +3284,45 @@ class QuestHandler(StairHandler):
             tTest = self._quest.quantile()
         return self._quest.simulate(tTest, tActual)
 
+    def simulateRuns(self, nRuns, tActual, nTrials=None, seed=None):
+        """Simulate many complete runs of this staircase at once, continuing
+        from its current state, for an observer with threshold tActual (on the
+        same scale as for simulate()). Returns the final threshold estimates
+        (the mean of the posterior, as from mean()) of each run, as an array.
+
+        The runs are all updated together (see :class:`QuestBatch`) so this is
+        far faster than running many QuestHandlers trial by trial, e.g. to see
+        the spread of estimates for a given number of trials::
+
+            estimates = staircase.simulateRuns(10000, tActual=-1.0, nTrials=40)
+            print numpy.std(estimates)
+
+        `nTrials` defaults to the trials remaining for this staircase (and
+        must be given if the staircase has no nTrials; the stopInterval is not
+        used). `seed` makes the simulation repeatable.
+        """
+        if nTrials is None:
+            nTrials = self.nTrials - len(self.data)
+        rng = _getRandomState(seed)
+        batch = QuestBatch(self._quest, nRuns)
+        for trialN in range(nTrials):
+            # the next intensity for each run, as from calculateNextIntensity()
+            if self.method == 'mean':
+                tTest = batch.mean()
+            elif self.method == 'mode':
+                tTest = batch.mode()
+            else:
+                tTest = batch.quantile()
+            if self.maxVal is not None or self.minVal is not None:
+                intensities = self._scale2intensity(tTest)
+                if self.maxVal is not None:
+                    intensities = numpy.minimum(intensities, self.maxVal)
+                if self.minVal is not None:
+                    intensities = numpy.maximum(intensities, self.minVal)
+                tTest = self._intensity2scale(intensities)
+            batch.update(tTest, batch.simulate(tTest, tActual, rng=rng))
+        return self._scale2intensity(batch.mean())
+
     def next(self):
         """Advances to next trial and returns it.
         Updates attributes; `thisTrial`, `thisTrialN`, `thisIndex`, `finished`, `intensities`
@@ -2439,6 +3596,24 @@ class MultiStairHandler(_BaseTrialHandler):
         self.addResponse(result, intensity)
         if type(result) in [str, unicode]:
             raise TypeError, "MultiStairHandler.addData should only receive corr/incorr. Use .addOtherData('datName',val)"
+    def _getColumnData(self):
+        #the trials of each staircase in turn, labelled by staircase
+        names = ['label']
+        columns = {'label': []}
+        nRows = 0
+        for thisStair in self.staircases:
+            stairNames, stairColumns = thisStair._getColumnData()
+            nTrials = len(stairColumns[0])
+            columns['label'].extend([thisStair.condition['label']]*nTrials)
+            for name, column in zip(stairNames, stairColumns):
+                if name not in columns:
+                    names.append(name)
+                    columns[name] = [None]*nRows
+                columns[name].extend(column)
+            nRows += nTrials
+            for name in names:
+                columns[name].extend([None]*(nRows-len(columns[name])))
+        return names, [columns[name] for name in names]
     def saveAsPickle(self, fileName):
         """Saves a copy of self (with data) to a pickle file.
 
@@ -2552,15 +3727,134 @@ class MultiStairHandler(_BaseTrialHandler):
             thisStair.saveAsText(fileName='stdout', delim=delim,
                 matrixOnly=thisMatrixOnly)
 
+class _DataColumn(object):
+    """Storage for one data type of a :class:`DataHandler`, for positions
+    [trialTypeN, repN] (used by DataHandler rather than directly).
+
+    Numeric values are kept in a float array that grows (doubling) as later
+    repeats are needed, with a separate array of flags saying which entries
+    are valid. Non-numeric values (strings, lists, arrays) are kept in a dict
+    by position, so adding one never converts the rest of the data. The
+    numpy array that DataHandler gives for this data type is built by
+    asArray() when it's needed.
+    """
+    def __init__(self, shape=None, allValid=False):
+        if not shape:
+            shape = [0, 0]
+        self.shape = [int(shape[0]), int(shape[-1])]  # nTrialTypes, nReps
+        self.allValid = allValid  # entries not yet set are valid zeros
+        self.isNumeric = True  # until a non-numeric value is added
+        self.values = numpy.zeros([self.shape[0], min(self.shape[1], 8)], 'f')
+        self.valid = numpy.zeros(self.values.shape, bool)
+        self.valid[:] = allValid
+        self.sums = numpy.zeros(self.shape[0])  # of the numeric values in each row
+        self.objects = {}  # non-numeric values, by (row, col)
+
+    @classmethod
+    def fromArray(cls, arr):
+        """Create a column from a data array (as stored by older versions)
+        """
+        col = cls(arr.shape)
+        col.shape = list(arr.shape)
+        col.values = numpy.zeros(arr.shape, 'f')
+        if arr.dtype.kind == 'O':
+            col.valid = numpy.zeros(arr.shape, bool)
+            for row in range(arr.shape[0]):
+                for repN in range(arr.shape[1]):
+                    val = arr[row, repN]
+                    if type(val) in [float, int]:
+                        col.values[row, repN] = val
+                    elif not (isinstance(val, basestring) and val == '--'):
+                        col.objects[(row, repN)] = val
+                    col.valid[row, repN] = not (isinstance(val, basestring) and val == '--')
+            col.isNumeric = False
+        else:
+            col.values[:] = numpy.ma.getdata(arr)
+            col.valid = ~numpy.ma.getmaskarray(arr)
+        col.sums = numpy.where(col.valid, col.values, 0).sum(1)
+        return col
+
+    def _grow(self, row, repN):
+        """Make room for (at least) the given position
+        """
+        oldRows, oldCols = self.values.shape
+        nRows, nCols = oldRows, oldCols
+        if row >= oldRows:
+            nRows = max(row+1, oldRows*2)
+            self.sums = numpy.concatenate([self.sums, numpy.zeros(nRows-oldRows)])
+        if repN >= oldCols:
+            nCols = max(repN+1, oldCols*2)
+        values = numpy.zeros([nRows, nCols], 'f')
+        valid = numpy.zeros([nRows, nCols], bool)
+        valid[:] = self.allValid
+        values[:oldRows, :oldCols] = self.values
+        valid[:oldRows, :oldCols] = self.valid
+        self.values, self.valid = values, valid
+
+    def set(self, row, repN, value):
+        """Set the value at one position (amortised constant time)
+        """
+        if row >= self.values.shape[0] or repN >= self.values.shape[1]:
+            self._grow(row, repN)
+        self.shape = [max(self.shape[0], row+1), max(self.shape[1], repN+1)]
+        if (row, repN) in self.objects:
+            del self.objects[(row, repN)]
+        elif self.valid[row, repN]:
+            self.sums[row] -= self.values[row, repN]
+        if type(value) in [float, int]:
+            self.values[row, repN] = value
+            self.sums[row] += self.values[row, repN]
+        else:
+            self.objects[(row, repN)] = value
+            self.isNumeric = False
+        self.valid[row, repN] = True
+
+    def rowSum(self, row):
+        """The sum of the numeric values for one trial type
+        """
+        if row >= len(self.sums):
+            return 0
+        return self.sums[row]
+
+    def asArray(self):
+        """Returns the data as a numpy masked array of floats (with missing
+        entries masked) or, if there are non-numeric values, as an array
+        with dtype='O' (with missing entries "--")
+        """
+        nRows = min(self.shape[0], self.values.shape[0])
+        nCols = min(self.shape[1], self.values.shape[1])
+        valid = self.valid[:nRows, :nCols]
+        if self.isNumeric:
+            data = numpy.zeros(self.shape, 'f')
+            data[:nRows, :nCols] = self.values[:nRows, :nCols]
+            mask = numpy.ones(self.shape, bool)
+            mask[:] = not self.allValid
+            mask[:nRows, :nCols] = ~valid
+            return numpy.ma.array(data, mask=mask)
+        arr = numpy.empty(self.shape, 'O')
+        arr[:] = '--'
+        numericValid = valid.copy()
+        for row, repN in self.objects:
+            numericValid[row, repN] = False
+        stored = arr[:nRows, :nCols]  # a view
+        stored[numericValid] = self.values[:nRows, :nCols][numericValid].astype('O')
+        for (row, repN), val in self.objects.iteritems():
+            arr[row, repN] = val
+        return arr
+
 class DataHandler(dict):
     """For handling data (used by TrialHandler, principally, rather than
     by users directly)
 
     Numeric data are stored as numpy masked arrays where the mask is set True for missing entries.
     When any non-numeric data (string, list or array) get inserted using DataHandler.add(val) the array
-    is converted to a standard (not masked) numpy array with dtype='O' and where missing entries have
+    is provided as a standard (not masked) numpy array with dtype='O' and where missing entries have
     value="--"
 
+    Internally each data type is stored in a column that grows as needed (see
+    :class:`_DataColumn`) so that add() takes constant time, and the arrays
+    are created from that when they are next accessed.
+
     Attributes:
         - ['key']=data arrays containing values for that key
             (e.g. data['accuracy']=...)
@@ -2568,40 +3862,44 @@ class DataHandler(dict):
         - dataTypes=list of keys as strings
 
     """
+    _columns = None  # psydat files from before columns have only the arrays
+    _stale = frozenset()  # data types whose arrays need to be recreated
     def __init__(self, dataTypes=None, trials=None, dataShape=None):
         self.trials=trials
         self.dataTypes=[]#names will be added during addDataType
         self.isNumeric={}
+        self._columns={}
+        self._stale=set()
         #if given dataShape use it - otherwise guess!
         if dataShape: self.dataShape=dataShape
         elif self.trials:
-            self.dataShape=list(numpy.asarray(trials.trialList,'O').shape)
-            self.dataShape.append(trials.nReps)
+            self.dataShape=[len(trials.trialList), trials.nReps]
+        else:
+            self.dataShape=None
 
         #initialise arrays now if poss
         if dataTypes and self.dataShape:
             for thisType in dataTypes:
                 self.addDataType(thisType)
 
-    def addDataType(self, names, shape=None):
+    def addDataType(self, names, shape=None, allValid=False):
         """Add a new key to the data dictionary of
         particular shape if specified (otherwise the
         shape of the trial matrix in the trial handler.
-        Data are initialised to be zero everywhere.
+        Data are initialised to be missing everywhere (or, if allValid=True,
+        valid zeros everywhere, as for 'ran').
         Not needed by user: appropriate types will be added
         during initialisation and as each xtra type is needed.
         """
         if not shape: shape = self.dataShape
         if not isinstance(names,basestring):
             #recursively call this function until we have a string
-            for thisName in names: self.addDataType(thisName)
+            for thisName in names: self.addDataType(thisName, allValid=allValid)
         else:
-            #create the appropriate array in the dict
-            #initially use numpy masked array of floats with mask=True for missing vals
-            #convert to a numpy array with dtype='O' if non-numeric data given
-            #NB don't use masked array with dytpe='O' together -they don't unpickle
-            self[names]=numpy.ma.zeros(shape,'f')#masked array of floats
-            self[names].mask=True
+            #create a column to store the values (the array is created when needed)
+            self._getColumns()[names] = _DataColumn(shape, allValid=allValid)
+            self._stale.add(names)
+            dict.__setitem__(self, names, None)
             #add the name to the list
             self.dataTypes.append(names)
             self.isNumeric[names]=True#until we need otherwise
@@ -2613,35 +3911,86 @@ class DataHandler(dict):
             self.addDataType(thisType)
         if position==None:
             #'ran' is always the first thing to update
-            if thisType=='ran':
-                repN = sum(self['ran'][self.trials.thisIndex])
-            else:
-                repN = sum(self['ran'][self.trials.thisIndex])-1#because it has already been updated
+            repN = int(self._getColumn('ran').rowSum(self.trials.thisIndex))
+            if thisType!='ran':
+                repN -= 1#because it has already been updated
             #make a list where 1st digit is trial number
             position= [self.trials.thisIndex]
             position.append(repN)
-
-        #check whether data falls within bounds
-        posArr = numpy.asarray(position)
-        shapeArr = numpy.asarray(self.dataShape)
-        if not numpy.alltrue(posArr<shapeArr):
-            #array isn't big enough
-            logging.warning('need a bigger array for:'+thisType)
-            self[thisType]=extendArr(self[thisType],posArr)#not implemented yet!
-        #check for ndarrays with more than one value and for non-numeric data
-        if self.isNumeric[thisType] and \
-            ((type(value)==numpy.ndarray and len(value)>1) or (type(value) not in [float, int])):
-                self._convertToObjectArray(thisType)
-        #insert the value
-        self[thisType][position[0],position[1]]=value
-    def _convertToObjectArray(self, thisType):
-        """Convert this datatype from masked numeric array to unmasked object array
-        """
-        dat = self[thisType]
-        self[thisType] = numpy.array(dat.data, dtype='O')#create an array of Object type
-        #masked vals should be "--", others keep data
-        self[thisType] = numpy.where(dat.mask, '--',dat).astype('O')#we have to repeat forcing to 'O' or text gets truncated to 4chars
-        self.isNumeric[thisType]=False
+        column = self._getColumn(thisType)
+        column.set(position[0], position[1], value)
+        if not column.isNumeric:
+            self.isNumeric[thisType]=False
+        self._stale.add(thisType)
+
+    def _getColumns(self):
+        if self._columns is None:
+            #e.g. loaded from an older psydat file
+            self._columns = {}
+            self._stale = set()
+        return self._columns
+    def _getColumn(self, thisType):
+        columns = self._getColumns()
+        if thisType not in columns:
+            #data that were set (or unpickled) as an array
+            columns[thisType] = _DataColumn.fromArray(dict.__getitem__(self, thisType))
+        return columns[thisType]
+    def _updateArrays(self):
+        """Recreate the arrays for any data types that have changed
+        """
+        for thisType in list(self._stale):
+            dict.__setitem__(self, thisType, self._columns[thisType].asArray())
+        self._stale = set()
+
+    def __getitem__(self, thisType):
+        if thisType in self._stale:
+            dict.__setitem__(self, thisType, self._columns[thisType].asArray())
+            self._stale.discard(thisType)
+        return dict.__getitem__(self, thisType)
+    def __setitem__(self, thisType, value):
+        #an array set directly replaces the column (recreated from it if needed)
+        if self._columns:
+            self._columns.pop(thisType, None)
+            self._stale.discard(thisType)
+        dict.__setitem__(self, thisType, value)
+    def get(self, thisType, default=None):
+        if thisType in self:
+            return self[thisType]
+        return default
+    def values(self):
+        self._updateArrays()
+        return dict.values(self)
+    def items(self):
+        self._updateArrays()
+        return dict.items(self)
+    def itervalues(self):
+        self._updateArrays()
+        return dict.itervalues(self)
+    def iteritems(self):
+        self._updateArrays()
+        return dict.iteritems(self)
+    def copy(self):
+        self._updateArrays()
+        return dict.copy(self)
+    def __repr__(self):
+        self._updateArrays()
+        return dict.__repr__(self)
+    def __reduce_ex__(self, protocol):
+        #make sure the arrays are pickled (and copied) up to date
+        self._updateArrays()
+        return dict.__reduce_ex__(self, protocol)
+    def __getstate__(self):
+        #pickle only the plain arrays (as before columns were used) so that
+        #psydat files can still be opened by older versions of PsychoPy
+        state = self.__dict__.copy()
+        state.pop('_columns', None)
+        state.pop('_stale', None)
+        return state
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        #the columns are rebuilt from the arrays (by _getColumn) when needed
+        self._columns = {}
+        self._stale = set()
 
 class FitFunction:
     """Deprecated: - use the specific functions; FitWeibull, FitLogistic...
@@ -2706,6 +4055,62 @@ class _baseFunctionFit:
             params=self.params #so the user can set params for this particular inv
         xx = self._inverse(yy, *params)
         return xx
+    def bootstrapCI(self, n=1000, ci=95, nTrials=None, seed=None,
+                    chunkSize=500, nProcesses=1):
+        """Bootstrapped confidence intervals for the parameters of the fit.
+
+        If `nTrials` (the number of trials at each xx, e.g. as returned by
+        :func:`functionFromStaircase`) is given then new proportions are drawn
+        from binomial distributions around the fitted function (a parametric
+        bootstrap). Otherwise the (xx, yy) points are themselves resampled.
+        The resamples are drawn `chunkSize` at a time (each in a single
+        call) and the fit is repeated for each of them, in `nProcesses`
+        processes if that is >1.
+
+        Returns the lower and upper bounds (arrays with one value per
+        parameter). All the refitted parameters are stored in
+        self.bootstrapParams (with NaN for resamples that couldn't be fitted).
+
+        e.g.::
+
+            fit = data.FitWeibull(intensities, meanCorrect, expectedMin=0.5)
+            lower, upper = fit.bootstrapCI(n=10000, nTrials=nPoints, seed=1)
+        """
+        rng = _getRandomState(seed)
+        nPoints = len(self.xx)
+        sems = numpy.ones(nPoints)*self.sems
+        if nTrials is not None:
+            nTrials = numpy.asarray(nTrials, dtype=int)
+            pFit = numpy.clip(self.eval(self.xx), 0, 1)
+        def getChunks():
+            for start in range(0, n, chunkSize):
+                nThisChunk = min(chunkSize, n-start)
+                if nTrials is None:
+                    indices = rng.randint(0, nPoints, size=(nThisChunk, nPoints))
+                    xx, yy, theseSems = self.xx[indices], self.yy[indices], sems[indices]
+                else:
+                    yy = rng.binomial(nTrials, pFit, size=(nThisChunk, nPoints))/nTrials.astype(float)
+                    xx = numpy.tile(self.xx, (nThisChunk, 1))
+                    theseSems = numpy.tile(sems, (nThisChunk, 1))
+                yield (self.__class__, self.expectedMin, list(self.params), xx, yy, theseSems)
+        if nProcesses > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(nProcesses)
+            try:
+                chunks = pool.map(_refitResamples, getChunks())
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            chunks = [_refitResamples(chunk) for chunk in getChunks()]
+        global _chance
+        _chance = self.expectedMin  # in case the refits changed it
+        self.bootstrapParams = numpy.concatenate(chunks)
+        fitted = self.bootstrapParams[~numpy.isnan(self.bootstrapParams).any(axis=1)]
+        if not len(fitted):
+            raise RuntimeError("None of the bootstrapped resamples could be fitted")
+        lower, upper = numpy.percentile(fitted, [50-ci/2.0, 50+ci/2.0], axis=0)
+        return lower, upper
 
 class FitWeibull(_baseFunctionFit):
     """Fit a Weibull function (either 2AFC or YN)
@@ -2835,10 +4240,19 @@ class FitCumNormal(_baseFunctionFit):
 
 ########################## End psychopy.data classes ##########################
 
-def bootStraps(dat, n=1):
-    """Create a list of n bootstrapped resamples of the data
+def _getRandomState(seed=None):
+    """Returns numpy.random itself (so that the global seed applies) if seed
+    is None, or a numpy.random.RandomState (either given as seed, or created
+    from it)
+    """
+    if seed is None:
+        return numpy.random
+    if isinstance(seed, numpy.random.RandomState):
+        return seed
+    return numpy.random.RandomState(seed)
 
-    SLOW IMPLEMENTATION (Python for-loop)
+def bootStraps(dat, n=1, seed=None):
+    """Create a list of n bootstrapped resamples of the data
 
     Usage:
         ``out = bootStraps(dat, n=1)``
@@ -2848,6 +4262,9 @@ def bootStraps(dat, n=1):
             an NxM or 1xN array (each row is a different condition, each column is a different trial)
         n
             number of bootstrapped resamples to create
+        seed
+            an int (or a numpy.random.RandomState) to make the resamples
+            repeatable (by default the global numpy random state is used)
 
         out
             - dim[0]=conditions
@@ -2858,15 +4275,82 @@ def bootStraps(dat, n=1):
     if len(dat.shape)==1: #have presumably been given a series of data for one stimulus
         dat=numpy.array([dat])#adds a dimension (arraynow has shape (1,Ntrials))
 
-    nTrials = dat.shape[1]
-    #initialise a matrix to store output
-    resamples = numpy.zeros(dat.shape+(n,), dat.dtype)
-    for stimulusN in range(dat.shape[0]):
-        thisStim = dat[stimulusN,:]#fetch data for this stimulus
-        for sampleN in range(n):
-            indices = numpy.floor(nTrials*numpy.random.rand(nTrials)).astype('i')
-            resamples[stimulusN,:,sampleN] = numpy.take(thisStim, indices)
-    return resamples
+    nStims, nTrials = dat.shape
+    #draw the indices for all stimuli and resamples at once
+    indices = _getRandomState(seed).randint(0, nTrials, size=(nStims, nTrials, n))
+    return dat[numpy.arange(nStims)[:,None,None], indices]
+
+def _meanDifference(a, b):
+    return a.mean(axis=-1) - b.mean(axis=-1)
+
+def permutationTest(a, b, statistic=None, n=10000, tails=2, seed=None,
+                    chunkSize=1000):
+    """Test whether two samples differ, by comparing a statistic of the
+    two against its distribution when the values are randomly reassigned
+    (permuted) between the two groups
+
+    Usage:
+        ``p, observed = permutationTest(a, b, n=10000)``
+
+    Where:
+        a, b
+            1D arrays (or lists) of values for the two groups
+        statistic
+            a function of two 2D arrays (one row per permutation) returning
+            one value per row (default is the difference in means, a-b)
+        n
+            number of permutations
+        tails
+            2 (default) compares the absolute value of the statistic, 1 tests
+            whether the observed statistic is greater than expected by chance
+        seed
+            an int (or a numpy.random.RandomState) to make the test repeatable
+        chunkSize
+            the number of permutations to draw (in a single call) and
+            evaluate at a time, to limit the memory used
+
+        p
+            the proportion of permutations (including the observed one) for
+            which the statistic was at least as extreme as observed
+        observed
+            the statistic for the data as given
+    """
+    if statistic is None:
+        statistic = _meanDifference
+    a = numpy.asarray(a)
+    b = numpy.asarray(b)
+    pooled = numpy.concatenate([a, b])
+    nA = len(a)
+    observed = statistic(a[None,:], b[None,:])[0]
+    rng = _getRandomState(seed)
+    nExtreme = 0
+    for start in range(0, n, chunkSize):
+        nThisChunk = min(chunkSize, n-start)
+        #each row of random numbers sorts to a random permutation
+        perms = pooled[rng.rand(nThisChunk, len(pooled)).argsort(axis=1)]
+        null = statistic(perms[:, :nA], perms[:, nA:])
+        if tails == 2:
+            nExtreme += numpy.sum(numpy.abs(null) >= abs(observed))
+        else:
+            nExtreme += numpy.sum(null >= observed)
+    return (nExtreme+1.0)/(n+1), observed
+
+def _refitResamples(args):
+    """Fit a function to each of a set of resampled data sets (at module
+    level so that it can be run in a multiprocessing.Pool). Fits that fail
+    give NaN parameters
+    """
+    fitClass, expectedMin, guess, xx, yy, sems = args
+    global _chance
+    _chance = expectedMin
+    params = numpy.zeros([len(yy), len(guess)])
+    for sampleN in range(len(yy)):
+        try:
+            params[sampleN] = optimize.curve_fit(fitClass._eval, xx[sampleN], yy[sampleN],
+                                                 p0=guess, sigma=sems[sampleN])[0]
+        except (RuntimeError, ValueError, TypeError, ZeroDivisionError):
+            params[sampleN] = numpy.nan
+    return params
 
 def functionFromStaircase(intensities, responses, bins = 10):
     """Create a psychometric function by binning data from a staircase procedure.
@@ -2912,12 +4396,13 @@ def functionFromStaircase(intensities, responses, bins = 10):
     binnedResp=[]; binnedInten=[]; nPoints = []
     if bins=='unique':
         intensities = numpy.round(intensities, decimals=8)
-        uniqueIntens=numpy.unique(intensities)
-        for thisInten in uniqueIntens:
-            theseResps = responses[intensities==thisInten]
-            binnedInten.append(thisInten)
-            binnedResp.append(numpy.mean(theseResps))
-            nPoints.append(len(theseResps))
+        #sum the responses for all intensities at once
+        uniqueIntens, intenIndices = numpy.unique(intensities, return_inverse=True)
+        counts = numpy.bincount(intenIndices)
+        sums = numpy.bincount(intenIndices, weights=responses)
+        binnedInten = list(uniqueIntens)
+        binnedResp = list(sums/counts)
+        nPoints = counts.tolist()
     else:
         pointsPerBin = len(intensities)/float(bins)
         for binN in range(bins):
@@ -2930,6 +4415,210 @@ def functionFromStaircase(intensities, responses, bins = 10):
 
     return binnedInten, binnedResp, nPoints
 
+def _stackRagged(arrays, fill=numpy.nan):
+    """Stack a list of 1D arrays (maybe of different lengths) into a 2D array,
+    padding with `fill`. A 2D array is returned as it is
+    """
+    arr = numpy.asarray(arrays)
+    if arr.dtype != object and arr.ndim == 2:
+        return arr.astype(float)
+    out = numpy.empty([len(arrays), max([len(row) for row in arrays])])
+    out[:] = fill
+    for rowN, row in enumerate(arrays):
+        out[rowN, :len(row)] = row
+    return out
+
+def _batchSolve(A, b):
+    """Solve A x = b for each of a stack of small matrices (NaN if singular)
+    """
+    try:
+        return numpy.linalg.solve(A, b[..., None])[..., 0]
+    except (numpy.linalg.LinAlgError, ValueError):
+        #some are singular (or this numpy can't solve a stack) so one at a time
+        x = numpy.zeros(b.shape)
+        for setN in range(len(b)):
+            try:
+                x[setN] = numpy.linalg.solve(A[setN], b[setN])
+            except numpy.linalg.LinAlgError:
+                x[setN] = numpy.nan
+        return x
+
+def _batchFitChunk(args):
+    """Fit one function to a stack of data sets, by Levenberg-Marquardt with
+    all the data sets evaluated at once (at module level so that it can be run
+    in a multiprocessing.Pool). Data sets that don't converge are then fitted
+    with scipy.optimize.curve_fit, as are all of them if the function can't be
+    evaluated for a stack of parameters.
+    """
+    fitClass, xx, yy, sems, guess, expectedMin, maxIter, tol = args
+    global _chance
+    _chance = expectedMin
+    nSets, nParams = guess.shape
+    valid = numpy.isfinite(xx) & numpy.isfinite(yy) & numpy.isfinite(sems)
+    nPoints = valid.sum(axis=1)
+    xx = numpy.where(valid, xx, 1.0)  # any value that can be evaluated
+    yy = numpy.where(valid, yy, 0.0)
+    weights = numpy.where(valid, 1.0/numpy.where(valid, sems, 1.0), 0.0)
+
+    def evalAll(params):
+        #each param as a column, so that it applies to one row (data set) of xx
+        return fitClass._eval(xx, *[params[:, [paramN]] for paramN in range(nParams)])
+    def residuals(params):
+        return (yy-evalAll(params))*weights
+    def jacobian(params, model):
+        jac = numpy.zeros([nSets, xx.shape[1], nParams])
+        for paramN in range(nParams):
+            step = 1e-6*numpy.maximum(numpy.abs(params[:, paramN]), 1.0)
+            shifted = params.copy()
+            shifted[:, paramN] += step
+            jac[:, :, paramN] = (evalAll(shifted)-model)/step[:, None]*weights
+        return jac
+
+    params = guess.copy()
+    converged = numpy.zeros(nSets, bool)
+    try:
+        with numpy.errstate(all='ignore'):
+            model = evalAll(params)
+            ssq = numpy.sum(((yy-model)*weights)**2, axis=1)
+            damping = numpy.ones(nSets)*1e-3
+            for iteration in range(maxIter):
+                jac = jacobian(params, model)
+                JtJ = numpy.einsum('spi,spj->sij', jac, jac)
+                Jtr = numpy.einsum('spi,sp->si', jac, (yy-model)*weights)
+                diag = numpy.einsum('sii->si', JtJ)
+                damped = JtJ + damping[:, None, None]*(diag[:, :, None]*numpy.eye(nParams))
+                newParams = params + _batchSolve(damped, Jtr)
+                newModel = evalAll(newParams)
+                newSsq = numpy.sum(((yy-newModel)*weights)**2, axis=1)
+                better = numpy.isfinite(newSsq) & (newSsq <= ssq) & ~converged
+                done = better & (ssq-newSsq <= tol*numpy.maximum(ssq, 1e-12))
+                params[better] = newParams[better]
+                model[better] = newModel[better]
+                ssq[better] = newSsq[better]
+                damping = numpy.where(better, damping/10, damping*10)
+                converged |= done | (ssq < 1e-24)
+                if converged.all():
+                    break
+            #standard errors as from curve_fit (covariance scaled by the residual variance)
+            jac = jacobian(params, model)
+            JtJ = numpy.einsum('spi,spj->sij', jac, jac)
+            cov = numpy.array([_pinvOrNaN(thisJtJ) for thisJtJ in JtJ])
+            resVar = ssq/numpy.maximum(nPoints-nParams, 1)
+            se = numpy.sqrt(numpy.einsum('sii->si', cov)*resVar[:, None])
+    except (ValueError, TypeError):
+        #e.g. FitNakaRushton._eval needs single values for the params
+        converged[:] = False
+        se = numpy.zeros([nSets, nParams])*numpy.nan
+        ssq = numpy.zeros(nSets)*numpy.nan
+
+    #fall back to fitting the others one at a time
+    params[~converged] = guess[~converged]
+    for setN in numpy.flatnonzero(~converged):
+        isValid = valid[setN]
+        try:
+            fitParams, covar = optimize.curve_fit(fitClass._eval, xx[setN][isValid],
+                yy[setN][isValid], p0=guess[setN], sigma=1.0/weights[setN][isValid])
+        except (RuntimeError, ValueError, TypeError, ZeroDivisionError):
+            continue
+        params[setN] = fitParams
+        resid = (yy[setN][isValid]-fitClass._eval(xx[setN][isValid], *fitParams))*weights[setN][isValid]
+        ssq[setN] = numpy.sum(resid**2)
+        se[setN] = numpy.sqrt(numpy.diag(covar)) if numpy.ndim(covar) == 2 else numpy.nan
+        converged[setN] = True
+    return params, se, ssq, converged
+
+def _pinvOrNaN(matrix):
+    try:
+        return numpy.linalg.inv(matrix)
+    except numpy.linalg.LinAlgError:
+        return numpy.zeros(matrix.shape)*numpy.nan
+
+def batchFit(fitClass, xx, yy, nPoints=None, sems=None, guess=None,
+             expectedMin=0.5, nProcesses=1, maxIter=200, tol=1e-10):
+    """Fit the same function (e.g. :class:`FitWeibull`) to many data sets
+    (e.g. each subject and condition) at once.
+
+    The model and its error are evaluated for all the data sets together
+    (so this is much faster than creating a Fit object for each) and any data
+    sets for which this doesn't converge are fitted individually, as the Fit
+    classes do.
+
+    Usage::
+
+        binned = [functionFromStaircase(intensities, responses, 'unique')
+                  for intensities, responses in allStaircases]
+        results = batchFit(FitWeibull, *zip(*binned))
+        alphas = results['params'][:, 0]
+
+    :Parameters:
+
+        fitClass : a Fit class (e.g. FitWeibull, FitLogistic)
+
+        xx, yy : 2D arrays (one row per data set) or lists of 1D arrays (which
+            can have different lengths, e.g. from functionFromStaircase with
+            bins='unique'). NaN values are ignored.
+
+        nPoints : the number of responses for each value (as from
+            functionFromStaircase), used to weight the fits (the standard
+            error of a proportion goes as 1/sqrt(n)), unless sems are given
+
+        sems : the standard errors of each value (default 1.0, as for the
+            Fit classes)
+
+        guess : starting parameters, either one set for all the data sets or
+            a 2D array (one row per data set). Default is 1.0 for all params
+
+        expectedMin : as for the Fit classes (e.g. 0.5 for 2AFC)
+
+        nProcesses : if >1 the data sets are split between this many processes
+
+    Returns a numpy structured array with one entry per data set, with fields
+    'params' and 'se' (the fitted params and their standard errors), 'ssq'
+    (the weighted sum of squared errors) and 'converged' (False if no fit could
+    be found, in which case the params are the guess).
+    """
+    xx = _stackRagged(xx)
+    yy = _stackRagged(yy)
+    nSets = len(yy)
+    if sems is not None:
+        sems = _stackRagged(sems) if numpy.ndim(sems) else numpy.ones(yy.shape)*sems
+    elif nPoints is not None:
+        nPoints = _stackRagged(nPoints)
+        sems = 1.0/numpy.sqrt(numpy.where(nPoints > 0, nPoints, numpy.nan))
+    else:
+        sems = numpy.ones(yy.shape)
+    nParams = len(inspect.getargspec(fitClass._eval)[0]) - 1
+    if guess is None:
+        guess = numpy.ones(nParams)
+    guess = numpy.ones([nSets, nParams])*guess
+
+    chunks = numpy.array_split(numpy.arange(nSets), max(1, min(nProcesses, nSets)))
+    tasks = [(fitClass, xx[ii], yy[ii], sems[ii], guess[ii], expectedMin, maxIter, tol)
+             for ii in chunks]
+    if len(tasks) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(len(tasks))
+        try:
+            fitted = pool.map(_batchFitChunk, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        fitted = [_batchFitChunk(task) for task in tasks]
+    global _chance
+    _chance = expectedMin
+
+    results = numpy.zeros(nSets, dtype=[('params', float, (nParams,)),
+                                        ('se', float, (nParams,)),
+                                        ('ssq', float),
+                                        ('converged', bool)])
+    for ii, (params, se, ssq, converged) in zip(chunks, fitted):
+        results['params'][ii] = params
+        results['se'][ii] = se
+        results['ssq'][ii] = ssq
+        results['converged'][ii] = converged
+    return results
+
 def getDateStr(format="%Y_%b_%d_%H%M"):
     """Uses ``time.strftime()``_ to generate a string of the form
     2012_Apr_19_1531 for 19th April 3.31pm, 2012.
@@ -3009,3 +4698,10 @@ def _getExcelCellName(col, row):
     'C2'
     """
     return "%s%i" %(get_column_letter(col+1), row+1)#BEWARE - openpyxl uses indexing at 1, to fit with Excel
+
+if __name__ == '__main__':
+    #e.g. python -m psychopy.data merge path/to/data
+    if sys.argv[1:2] == ['merge']:
+        from psychopy.data import _mergeSessionsCommand
+        sys.exit(_mergeSessionsCommand(sys.argv[2:]))
+    print 'usage: python -m psychopy.data merge DIRECTORY [options]'
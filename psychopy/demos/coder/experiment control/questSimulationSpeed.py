@@ -0,0 +1,38 @@
+#!/usr/bin/env python2
+
+#Compares the time taken to simulate many runs of a QUEST staircase one at a
+#time (a QuestHandler per run, trial by trial) with QuestHandler.simulateRuns
+#(which updates all the runs together) and shows the spread of the threshold
+#estimates that a 40-trial QUEST would give.
+
+from psychopy import data, core
+import numpy
+
+nRuns = 200
+nTrials = 40
+tActual = -1.2  # the simulated observer's threshold (log10 contrast)
+
+def makeStairs():
+    return data.QuestHandler(startVal=0.1, startValSd=0.5, nTrials=nTrials,
+                             stepType='log', autoLog=False)
+
+timer = core.Clock()
+oneByOne = []
+for runN in range(nRuns):
+    stairs = makeStairs()
+    for intensity in stairs:
+        stairs.addResponse(stairs.simulate(tActual))
+    oneByOne.append(stairs.mean())
+tOneByOne = timer.getTime()
+
+timer.reset()
+together = makeStairs().simulateRuns(nRuns, tActual, seed=1)
+tTogether = timer.getTime()
+
+print '%i runs of %i trials' %(nRuns, nTrials)
+print 'one at a time:  %.2fs' %tOneByOne
+print 'simulateRuns:   %.2fs (%.0fx faster)' %(tTogether, tOneByOne/tTogether)
+for label, estimates in [('one at a time', oneByOne), ('simulateRuns', together)]:
+    logEstimates = numpy.log10(estimates)
+    print '%s: threshold estimate %.3f (sd %.3f, actual %.3f)' %(label,
+        numpy.mean(logEstimates), numpy.std(logEstimates), tActual)
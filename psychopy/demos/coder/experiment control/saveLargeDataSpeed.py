@@ -0,0 +1,64 @@
+#!/usr/bin/env python2
+
+#Times how long it takes to save a large (100,000 row) data set with
+#ExperimentHandler.saveAsWideText, as csv and as binary (.npz), compared with
+#the old method of writing the file one cell at a time.
+
+from psychopy import data, core
+from numpy import random
+import codecs, os, tempfile
+
+nRows = 100000
+outDir = tempfile.mkdtemp(prefix='psychopy-saveSpeed')
+
+exp = data.ExperimentHandler(name='saveSpeed', savePickle=False,
+                saveWideText=False, extraInfo={'participant':'jwp'},
+                autoLog=False)
+for rowN in range(nRows):
+    exp.addData('rt', random.random())
+    exp.addData('resp', random.choice(['left', 'right']))
+    exp.addData('corr', int(random.random()>0.5))
+    if rowN % 10 == 0:
+        exp.addData('comment', 'a note, with a comma')
+    exp.nextEntry()
+
+def saveCellByCell(exp, fileName, delim=','):
+    """the way saveAsWideText used to write its file (for comparison)"""
+    f = codecs.open(fileName, 'w', encoding='utf-8')
+    names = exp._getAllParamNames()
+    names.extend(exp.dataNames)
+    names.extend(exp._getExtraInfo()[0])
+    for heading in names:
+        f.write(u'%s%s' %(heading,delim))
+    f.write('\n')
+    for entry in exp.entries:
+        for name in names:
+            if name in entry.keys():
+                if ',' in unicode(entry[name]) or '\n' in unicode(entry[name]):
+                    f.write(u'"%s"%s' %(entry[name],delim))
+                else:
+                    f.write(u'%s%s' %(entry[name],delim))
+            else:
+                f.write(delim)
+        f.write('\n')
+    f.close()
+
+timer = core.Clock()
+saveCellByCell(exp, os.path.join(outDir, 'cellByCell.csv'))
+tCells = timer.getTime()
+
+timer.reset()
+exp.saveAsWideText(os.path.join(outDir, 'columns.csv'))
+tColumns = timer.getTime()
+
+timer.reset()
+exp.saveAsWideText(os.path.join(outDir, 'columns.npz'))
+tNpz = timer.getTime()
+
+print '%i rows saved to %s' %(nRows, outDir)
+print 'cell by cell (old):  %.2fs' %tCells
+print 'by column, csv:      %.2fs (%.1fx faster)' %(tColumns, tCells/tColumns)
+print 'by column, npz:      %.2fs (%.1fx faster)' %(tNpz, tCells/tNpz)
+same = open(os.path.join(outDir, 'cellByCell.csv')).read() == \
+    open(os.path.join(outDir, 'columns.csv')).read()
+print 'csv files identical:', same
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the round trip latency and throughput of requests sent to the ioHub
+Process by UDP (the default) and by the stream transport (a Unix domain socket,
+or a TCP loopback connection on Windows), started with
+launchHubServer(stream_transport=True).
+
+Each request is a PING that the ioHub Process sends back with its payload, so
+the time measured is that of the transport and not of the work done for a
+request. Results are printed to stdout.
+"""
+
+from psychopy.iohub import launchHubServer, Computer
+
+getTime=Computer.getTime
+
+REPEATS=200
+PAYLOAD_SIZES=(16,8000,30*1024,1024*1024)
+# gevent's DatagramServer reads each request with recvfrom(8192), so by UDP
+# the payload and the rest of the packed PING must fit in 8 KiB
+UDP_MAX_PAYLOAD=8*1024-128
+PIPELINE_LENGTH=10
+
+def timePings(io,payload,repeats):
+    """
+    Returns the mean time (in msec) of a PING round trip with the given
+    payload.
+    """
+    stime=getTime()
+    for i in xrange(repeats):
+        io._sendToHubServer(('PING',getTime(),i,payload))
+    return (getTime()-stime)*1000.0/repeats
+
+def timePipelinedPings(io,repeats):
+    """
+    Returns the mean time (in msec) per PING when PIPELINE_LENGTH pings are
+    sent before their replies are read.
+    """
+    stime=getTime()
+    for i in xrange(repeats//PIPELINE_LENGTH):
+        io._sendManyToHubServer([('PING',getTime(),n,'x') for n in xrange(PIPELINE_LENGTH)])
+    return (getTime()-stime)*1000.0/(repeats//PIPELINE_LENGTH*PIPELINE_LENGTH)
+
+def runTransport(label,**kwargs):
+    io=launchHubServer(**kwargs)
+    try:
+        # warm up both processes before timing anything
+        timePings(io,'x',20)
+        print
+        print label
+        for size in PAYLOAD_SIZES:
+            if io.stream_client is None and size > UDP_MAX_PAYLOAD:
+                # a request must fit in one datagram read by the server
+                print "  payload %7d bytes: too large to send by UDP"%(size)
+                continue
+            payload='x'*size
+            msec=timePings(io,payload,REPEATS)
+            print "  payload %7d bytes: %7.3f msec per round trip, %8.2f MB/sec"%(size,msec,2*size/(msec*1000.0))
+        print "  pipelined (%d requests per write): %7.3f msec per request"%(PIPELINE_LENGTH,timePipelinedPings(io,REPEATS))
+    finally:
+        io.quit()
+
+if __name__ == '__main__':
+    runTransport('UDP')
+    runTransport('Stream transport',stream_transport=True)
@@ -13,11 +13,13 @@ Distributed under the terms of the GNU General Public License (GPL version 3 or
 
 import os,sys
 import time
+import select
 import subprocess
 from collections import deque
 import json
 import signal
 from weakref import proxy
+from operator import itemgetter
 
 from psychopy import  core as core, gui
 import psychopy.logging as psycho_logging
@@ -35,13 +37,65 @@ from . import print2err,printExceptionDetailsToStdErr,ioHubError,ioHubServerErro
 from .devices import Computer, DeviceEvent,import_device
 from .devices.experiment import MessageEvent,LogEvent
 from .constants import DeviceConstants,EventConstants
-from .net import UDPClientConnection
+from .net import UDPClientConnection, SharedEventBuffer, eventListsToArrays, unpackEventArrays, mergeEventArrays
+from .net import EVENT_QUERY_ARGS, eventQuery, queryEvents, filteredEventTypes
+from .net import StreamClientConnection, streamTransportAddress
 from . import _DATA_STORE_AVAILABLE
 
 currentSec= Computer.currentSec
 
 _currentSessionInfo=None
 
+class RPCFuture(object):
+    """
+    The result of a request that was sent to the ioHub Process without
+    waiting for its reply (see ioHubConnection.callAsync()). The request
+    is handled by the ioHub Process while the experiment script continues;
+    replies are matched to their requests by request id, so they can be
+    received in any order.
+
+    done() returns True once the reply has been received, without blocking,
+    and result() returns the result of the request, waiting for the reply
+    if necessary. If the request failed on the ioHub Process, result()
+    raises the error.
+    """
+    def __init__(self,hubClient,request_id,convertReply=None):
+        self.hubClient=hubClient
+        self.request_id=request_id
+        self._convertReply=convertReply
+        self._reply=None
+        self._done=False
+
+    def _setReply(self,reply):
+        self._reply=reply
+        self._done=True
+
+    def done(self):
+        """
+        Returns True if the reply to the request has been received.
+        """
+        if not self._done:
+            self.hubClient._receiveAsyncReplies()
+        return self._done
+
+    def result(self,timeout=None):
+        """
+        Returns the result of the request, waiting up to timeout sec.msec
+        (or, if timeout is None, for as long as it takes) for the reply.
+
+        Raises an ioHubConnectionException if the timeout expires first.
+        """
+        if not self._done:
+            self.hubClient._receiveAsyncReplies(self,timeout)
+        if not self._done:
+            raise ioHubConnectionException("No reply was received for async request %d within the timeout."%(self.request_id))
+        errorReply=self.hubClient._isErrorReply(self._reply)
+        if errorReply:
+            raise errorReply
+        if self._convertReply:
+            return self._convertReply(self._reply)
+        return self._reply
+
 
 
 #
@@ -56,17 +110,40 @@ class DeviceRPC(object):
     _log_text_index=LogEvent.CLASS_ATTRIBUTE_NAMES.index('text')
     _log_level_index=LogEvent.CLASS_ATTRIBUTE_NAMES.index('log_level')
     
-    def __init__(self,sendToHub,device_class,method_name):
+    def __init__(self,sendToHub,device_class,method_name,sendToHubAsync=None):
         self.device_class=device_class
         self.method_name=method_name
         self.sendToHub=sendToHub
+        self.sendToHubAsync=sendToHubAsync
+
+    def _request(self,args,kwargs):
+        if self.method_name == 'getEvents':
+            # sets can not be sent to the ioHub, so the query is normalised
+            query=eventQuery(**dict([(a,kwargs.pop(a)) for a in EVENT_QUERY_ARGS if a in kwargs]))
+            if query:
+                kwargs.update(query)
+        return ('EXP_DEVICE','DEV_RPC',self.device_class,self.method_name,args,kwargs)
 
     def __call__(self, *args,**kwargs):
-        r = self.sendToHub(('EXP_DEVICE','DEV_RPC',self.device_class,self.method_name,args,kwargs))
+        request=self._request(args,kwargs)
+        return self._convertReply(self.sendToHub(request),kwargs)
+
+    def callAsync(self,*args,**kwargs):
+        """
+        Calls the device method without waiting for it to return; returns an
+        RPCFuture that gives the method's result.
+        """
+        request=self._request(args,kwargs)
+        return self.sendToHubAsync(request,lambda r: self._convertReply(r,kwargs))
+
+    def _convertReply(self,r,kwargs):
         r=r[1:]
         if len(r)==1:
             r=r[0]
 
+        if self.method_name == 'getEvents' and kwargs.get('asType') == 'numpy':
+            return unpackEventArrays(r)
+
         if r and self.method_name == 'getEvents':
             asType='namedtuple'
             if 'asType' in kwargs:
@@ -138,7 +215,7 @@ class ioHubDeviceView(object):
             if name in self._preRemoteMethodCallFunctions:
                 f,ka=self._preRemoteMethodCallFunctions[name]
                 f(ka)
-            r = DeviceRPC(self.hubClient._sendToHubServer,self.device_class,name)
+            r = DeviceRPC(self.hubClient._sendToHubServer,self.device_class,name,self.hubClient._sendToHubServerAsync)
             if name in self._postRemoteMethodCallFunctions:
                 f,ka=self._postRemoteMethodCallFunctions[name]
                 f(ka)
@@ -164,6 +241,29 @@ class ioHubDeviceView(object):
         """
         return self.name
 
+    def callAsync(self,method_name,*args,**kwargs):
+        """
+        Calls one of the device's methods without waiting for the ioHub
+        Process to return its result, so that a long running method (for
+        example an eye tracker's runSetupProcedure) does not block the
+        experiment script. For example::
+
+            calibration=tracker.callAsync('runSetupProcedure')
+            while not calibration.done():
+                win.flip()
+            result=calibration.result()
+
+        Args:
+            method_name (str): the name of the device method to call.
+            Any other arguments are passed to the method.
+
+        Returns:
+            RPCFuture: gives the method's return value when it is available.
+        """
+        if method_name not in self._methods:
+            raise AttributeError(self,method_name)
+        return getattr(self,method_name).callAsync(*args,**kwargs)
+
     def getIOHubDeviceClass(self):
         """
         Gets the ioHub Server Device class given associated with the ioHubDeviceView.
@@ -336,6 +436,27 @@ class ioHubConnection(object):
         # udp port setup
         self.udp_client = None
 
+        # the Unix domain socket / TCP connection that requests are sent over,
+        # if the stream_transport is enabled (else they are sent by UDP)
+        self.stream_client = None
+
+        # the RPCFutures of async requests that have not been replied to yet,
+        # by request id, and the number of these that can be sent before
+        # callAsync() waits for one to be replied to.
+        self._async_requests = dict()
+        self._last_async_request_id = 0
+        self._max_async_requests = 16
+
+        # the shared memory that streamed events are read from, if the
+        # shared_memory_events transport is enabled (else they are sent by UDP)
+        self._shared_events = None
+        # True when events may be waiting in the ioHub Process's UDP event
+        # buffer even though none have been added since the last getEvents()
+        self._udp_events_left = False
+        # the most events that did not match a getEvents() query that are
+        # kept in allEvents (the size of the ioHub Process's eventBuffer)
+        self._max_kept_events = 2048
+
         # the dynamically generated object that contains an attribute for
         # each device registed for monitoring with the ioHub server so
         # that devices can be accessed experiment process side by device name.
@@ -452,7 +573,7 @@ class ioHubConnection(object):
         
         return self._iohub_server_config        
         
-    def getEvents(self,device_label=None,as_type ='namedtuple'):
+    def getEvents(self,device_label=None,as_type ='namedtuple',event_types=None,start_time=None,end_time=None,filters=None,latest_only=False,max_count=None):
         """
         Retrieve any events that have been collected by the ioHub Process from 
         monitored devices since the last call to getEvents() or clearEvents().
@@ -475,18 +596,47 @@ class ioHubConnection(object):
 		* 'astuple': Each event is converted to a namedtuple object. Event attributes are accessed using natural naming style (dot name style), or by the index of the event attribute for the event type. The namedtuple class definition is created once for each Event type at the start of the experiment, so memory overhead is almost the same as the event value list, and conversion from the event list to the namedtuple is very fast. This is the default, and normally most useful, event representation type.
 		* 'dict': Each event converted to a dict object, keys equaling the event attribute names, values being, well the attribute values for the event.
 		* 'object': Each event is converted into an instance of the ioHub DeviceEvent subclass based on the event's type. This conversion process can take a bit of time if the number of events returned is large, and currently there is no real benefit converting events into DeviceEvent Class instances vs. the default namedtuple object type. Therefore this option should be used rarely.
+		* 'numpy': A dict is returned with a structured numpy array for each type of event, keyed by event type id (e.g. EventConstants.KEYBOARD_PRESS). The array fields are those of the event class's NUMPY_DTYPE (float fields are float64) and the events are in time order. The ioHub Process packs each array in one go and no Python object is created for each event, so this is the fastest way to get, and to work with, many events (e.g. eye tracker samples).
+
+        The remaining arguments give a query that the ioHub Process evaluates 
+        before the events are sent, so that when getEvents() is called every 
+        frame only the events the experiment acts on are transferred. Events 
+        that do not match the query stay in the event buffer for a later call; 
+        matching events that are not returned because of latest_only or 
+        max_count are discarded. For example, to get only presses of the 
+        space or return keys::
+
+            kb_events=io.getEvents(event_types=EventConstants.KEYBOARD_PRESS,filters={'key':['space','return']})
                 
         Args:
             device_label (str): Indicates what device to retrieve events for. If None ( the default ) returns device events from all devices.            
             
 			as_type (str): Indicates how events should be represented when they are returned to the user. Default: 'namedtuple'.
 
+            event_types (int or list): The event type id(s) of the events to return, e.g. EventConstants.KEYBOARD_PRESS. Default: all event types.
+
+            start_time (float): Only return events with an ioHub time >= start_time. Default: None.
+
+            end_time (float): Only return events with an ioHub time <= end_time. Default: None.
+
+            filters (dict): Event attribute name: value pairs that an event must match to be returned. A list, tuple or set value matches an event if the attribute value is in it, e.g. {'key':set(['a','b'])}. Events without the attribute do not match. Default: None.
+
+            latest_only (bool): If True, only the most recent matching event of each event type is returned. Default: False.
+
+            max_count (int): Return at most this many events (the most recent ones that match). Default: None.
+
         Returns:
             tuple: A tuple of event objects, where the event object type is defined by the 'as_type' parameter.
         """
 
+        query=eventQuery(event_types,start_time,end_time,filters,latest_only,max_count)
+        if as_type == 'numpy':
+            return self._getEventArrays(device_label,query)
+
         r=None
-        if device_label is None:
+        if device_label is None and query:
+            r=self._getQueriedEvents(query)
+        elif device_label is None:
             events=self._getEvents()
             if events is None:
                 r=self.allEvents    
@@ -496,7 +646,7 @@ class ioHubConnection(object):
             self.allEvents=[]
         else:
             d=self.deviceByLabel[device_label]
-            r=d.getEvents()
+            r=d.getEvents(**(query or {}))
   
         if r:
             if as_type == 'list':
@@ -543,6 +693,9 @@ class ioHubConnection(object):
         """
         if device_label is None or device_label.lower() == 'all':
             self._sendToHubServer(('RPC','clearEventBuffer'))
+            if self._shared_events:
+                self._shared_events.clearEvents()
+            self._udp_events_left=False
             self.allEvents=[]
             if device_label and device_label.lower() == 'all':
                 [self.deviceByLabel[label].clearEvents() for label in self.deviceByLabel]
@@ -635,7 +788,10 @@ class ioHubConnection(object):
         Returns:
             bool: True
         """
-        self._sendToHubServer(('EXP_DEVICE','EVENT_TX',[MessageEvent._createAsList(text,category=category,msg_offset=offset,sec_time=sec_time),]))
+        event=MessageEvent._createAsList(text,category=category,msg_offset=offset,sec_time=sec_time)
+        if self._shared_events and self._shared_events.message_ring.put(event,overwrite=False):
+            return True
+        self._sendToHubServer(('EXP_DEVICE','EVENT_TX',[event,]))
         return True
                 
     def initializeConditionVariableTable(self, condition_variable_provider):
@@ -713,7 +869,7 @@ class ioHubConnection(object):
 
         self.initializeConditionVariableTable(ConditionVariableDescription)
 
-    def addRowToConditionVariableTable(self,data):
+    def addRowToConditionVariableTable(self,data,blocking=True):
         """
         Add a row to the condition variable table for the current
         experiment (created by calling the initializeConditionVariableTable() method)
@@ -724,6 +880,8 @@ class ioHubConnection(object):
         
         Args:
             data: A Condition Variable Set object, as received from the ExperimentVariableProvider.getNextConditionSet() method. ANy changes to the values of the condition variables within the object are reflected in the data saved to the ioDataStore.
+
+            blocking (bool): If False, the row is sent without waiting for the ioHub Process to save it, and an RPCFuture is returned.
                 
         Returns:
             None
@@ -731,7 +889,10 @@ class ioHubConnection(object):
         for i,d in enumerate(data):
             if isinstance(d,unicode):
                 data[i]=d.encode('utf-8')
-        r=self._sendToHubServer(('RPC','addRowToConditionVariableTable',(self.experimentID,self.experimentSessionID,data)))
+        request=('RPC','addRowToConditionVariableTable',(self.experimentID,self.experimentSessionID,data))
+        if not blocking:
+            return self._sendToHubServerAsync(request,itemgetter(2))
+        r=self._sendToHubServer(request)
         return r[2]
 
     def addTrialHandlerRecord(self,cv_row):
@@ -870,19 +1031,61 @@ class ioHubConnection(object):
             printExceptionDetailsToStdErr()
             raise ioHubError("Error in _addDeviceToMonitor: device_class: ",device_class," . device_config: ",device_config)    
 
-    def flushDataStoreFile(self):
+    def flushDataStoreFile(self,blocking=True):
         """
         Manually tell the ioDataStore to flush any events it has buffered in memory to disk."
 
         Args:
-            None
+            blocking (bool): If False, the flush is requested without waiting for it to finish, and an RPCFuture is returned.
         
         Returns:
             None
         """
+        if not blocking:
+            return self._sendToHubServerAsync(('RPC','flushIODataStoreFile'),itemgetter(2))
         r=self._sendToHubServer(('RPC','flushIODataStoreFile'))
         print "flushIODataStoreFile: ",r[2]
         return r[2]
+
+    def callAsync(self,method_name,*args,**kwargs):
+        """
+        Sends a request to the ioHub Process without waiting for the result,
+        so that long running requests (for example flushing the ioDataStore, 
+        or an eye tracker's setup procedure) do not stall the experiment's 
+        frames. The request is handled by the ioHub Process while the 
+        experiment script continues, and an RPCFuture is returned right away; 
+        its done() method says if the result has been received, and result() 
+        returns it (waiting for it if necessary).
+
+        Several requests can be waiting for their results at the same time, 
+        and they can complete in any order. Up to max_in_flight requests
+        (see the async_rpc setting of the ioHub config, default 16) can be 
+        waiting; once that many are, callAsync() waits for one to complete.
+
+        Args:
+            method_name (str): either 'device_name.method_name', to call a method of one of the ioHub devices, or the name of an ioHub Process RPC method, such as 'flushIODataStoreFile'.
+            Any other arguments are passed to the method.
+
+        Returns:
+            RPCFuture: gives the method's return value when it is available.
+
+        For example::
+
+            flushed=io.callAsync('flushIODataStoreFile')
+            samples=io.callAsync('tracker.getEvents',asType='numpy')
+            # ... draw a frame ...
+            if flushed.done():
+                print 'flushed: ',flushed.result()
+        """
+        if '.' in method_name:
+            device_label,method_name=method_name.split('.',1)
+            return self.deviceByLabel[device_label].callAsync(method_name,*args,**kwargs)
+        request=['RPC',method_name]
+        if args or kwargs:
+            request.append(list(args))
+        if kwargs:
+            request.append(kwargs)
+        return self._sendToHubServerAsync(tuple(request),itemgetter(2))
         
     def shutdown(self):
         """
@@ -1072,6 +1275,11 @@ class ioHubConnection(object):
         except:
             printExceptionDetailsToStdErr()
 
+
+        if ioHubConfig.get('stream_transport',{}).get('enable',False):
+            self._connectStreamTransport(ioHubConfig)
+        self._max_async_requests=max(1,ioHubConfig.get('async_rpc',{}).get('max_in_flight',16))
+        self._max_kept_events=ioHubConfig.get('global_event_buffer',2048)
         
         if experiment_info:
             #print 'Sending experiment_info: {0}'.format(experiment_info)
@@ -1093,8 +1301,48 @@ class ioHubConnection(object):
             self._createDeviceList(ioHubConfig['monitor_devices'])
         except Exception as e:
             print "Errror in _createDeviceList: ",str(e)  
+
+        if ioHubConfig.get('shared_memory_events',{}).get('enable',False):
+            self._attachSharedEventBuffer()
         #print 'Created Experiment Process Device List'
                     
+    def _connectStreamTransport(self,ioHubConfig):
+        """
+        Connect to the stream (Unix domain socket, or TCP loopback) transport
+        of the ioHub Process, which is then used for all requests instead of
+        UDP. If that fails requests continue to be sent by UDP.
+        """
+        try:
+            family,address=streamTransportAddress(ioHubConfig)
+            self.stream_client=StreamClientConnection(family,address)
+        except Exception:
+            print2err("Could not connect to the ioHub stream transport; requests will be sent by UDP.")
+            printExceptionDetailsToStdErr()
+            self.stream_client=None
+
+    def _attachSharedEventBuffer(self):
+        """
+        Attach to the shared memory that the ioHub Process writes streamed
+        events to, so that getEvents() can read them without a UDP round trip.
+        If that fails events continue to be received by UDP.
+        """
+        try:
+            layout=self._sendToHubServer(('RPC','getSharedEventBufferLayout'))[2]
+            if layout:
+                self._shared_events=SharedEventBuffer(layout)
+                # the ioHub Process only starts putting events in shared
+                # memory once told that this process reads them; any sent
+                # before that are in its UDP event buffer
+                if not self._sendToHubServer(('RPC','sharedEventBufferAttached'))[2]:
+                    raise ioHubError("The ioHub Process has no shared memory event buffer.")
+                self._udp_events_left=True
+        except Exception:
+            if self._shared_events:
+                self._shared_events.close()
+            print2err("Could not attach to the ioHub shared memory event buffer; events will be received by UDP.")
+            printExceptionDetailsToStdErr()
+            self._shared_events=None
+
     def _get_maxsize(self, maxsize):
         """
         Used by _startServer pipe reader code.
@@ -1209,22 +1457,9 @@ class ioHubConnection(object):
         the PsychoPy Process to the ioHub Process, and then wait for the reply
         from the ioHub Process before returning.
 
-        The ioHubConnection currently blocks until the request is fulfilled and
-        and a response is received from the ioHub server.
-
-        TODO: An aysnc. version could be added if desired. 
-
-        Instead of using callbacks, I prefer the idea of the client sending a
-        request and getting a request ticket # back from the ioHub server
-        right away, indicating that the job has been submitted for processing.
-        The ioHubConnection can then ask the ioHub Server for the status of the
-        job ticket based on ticket number.
-        
-        When the ticket number result is ready, it is sent back as the reply to
-        the status request. This **aysnc. mode will be necessary** when the 
-        worker process is added to the ioHub framework to handle long running 
-        job requests from the PsychoPy process; for example to load an image
-        into a shared memory space, perform long running computations, etc.
+        The ioHubConnection blocks until the request is fulfilled and
+        and a response is received from the ioHub server. To send a request
+        without waiting for the reply use _sendToHubServerAsync().
 
         Args:
             messageList (tuple): ioHub Server Message to send.
@@ -1232,11 +1467,13 @@ class ioHubConnection(object):
         Return (object): the message response from the ioHub Server process.
         """
 
+        client=self.stream_client or self.udp_client
+
         # send request to host, return is # bytes sent.
-        bytes_sent=self.udp_client.sendTo(ioHubMessage)
+        bytes_sent=client.sendTo(ioHubMessage)
 
         # wait for response from ioHub server, return is result ( decoded already ), and Hub address (ip4,port).
-        result,address=self.udp_client.receive()
+        result,address=self._receiveFromHubServer(client)
 
         # store result received in an address based dictionary (incase we ever support multiple ioHub Servers)
         ioHubConnection._addResponseToHistory(result,bytes_sent,address)
@@ -1249,6 +1486,104 @@ class ioHubConnection(object):
         #Otherwise return the result
         return result
 
+    def _receiveFromHubServer(self,client):
+        """
+        Returns the next reply from the ioHub Process that is not the reply
+        to an async request; async replies received first are given to
+        their RPCFutures.
+        """
+        result,address=client.receive()
+        while result and result[0] == 'ASYNC_RESULT':
+            self._setAsyncReply(result)
+            result,address=client.receive()
+        return result,address
+
+    def _sendToHubServerAsync(self,ioHubMessage,convertReply=None):
+        """
+        Sends a message to the ioHub Process without waiting for the reply.
+        The message is sent as ('ASYNC', request_id, message); the ioHub 
+        Process handles it in its own greenlet and replies with 
+        ('ASYNC_RESULT', request_id, reply) once it is done.
+
+        If max_in_flight (see the async_rpc config setting) requests are 
+        already waiting for a reply, this waits until one of them is replied to.
+
+        Args:
+            ioHubMessage (tuple): ioHub Server Message to send.
+            convertReply (callable): given the reply, returns the result of the request. 
+
+        Return (RPCFuture): gives the result of the request.
+        """
+        while len(self._async_requests) >= self._max_async_requests:
+            self._receiveAsyncReplies(timeout=None)
+
+        self._last_async_request_id+=1
+        future=RPCFuture(self,self._last_async_request_id,convertReply)
+        self._async_requests[future.request_id]=future
+        client=self.stream_client or self.udp_client
+        client.sendTo(('ASYNC',future.request_id,ioHubMessage))
+        return future
+
+    def _setAsyncReply(self,result):
+        future=self._async_requests.pop(result[1],None)
+        if future:
+            future._setReply(result[2])
+
+    def _receiveAsyncReplies(self,future=None,timeout=0):
+        """
+        Receives the replies to async requests that have arrived. If future
+        is given, waits up to timeout sec.msec (None for no limit) for its 
+        reply; otherwise, if timeout is not 0, waits for any one reply.
+
+        This is only called when no synchronous request is waiting for its
+        reply, so any reply received is the reply to an async request.
+        """
+        client=self.stream_client or self.udp_client
+        end_time=None
+        if timeout is not None:
+            end_time=Computer.getTime()+timeout
+        while self._async_requests:
+            if future is not None and future._done:
+                break
+            wait=None
+            if end_time is not None:
+                wait=max(0.0,end_time-Computer.getTime())
+            if not select.select([client.sock],[],[],wait)[0]:
+                break
+            result,address=client.receive()
+            if result and result[0] == 'ASYNC_RESULT':
+                self._setAsyncReply(result)
+            else:
+                print2err("Warning: unexpected reply from the ioHub Process ignored: ",result)
+            if future is None and timeout != 0:
+                break
+
+    def _sendManyToHubServer(self,ioHubMessages):
+        """
+        Sends several messages to the ioHub Process and returns the list of
+        their responses. When the stream transport is used, all the messages
+        are sent before the first reply is read (the requests are pipelined),
+        so there is one round trip instead of one for each message; with UDP
+        the messages are sent one at a time.
+
+        If any response is an error, the error is raised once all of the 
+        responses have been received.
+        """
+        if self.stream_client is None:
+            return [self._sendToHubServer(m) for m in ioHubMessages]
+
+        bytes_sent=self.stream_client.sendMany(ioHubMessages)
+        results=[]
+        for m in ioHubMessages:
+            result,address=self._receiveFromHubServer(self.stream_client)
+            ioHubConnection._addResponseToHistory(result,bytes_sent,address)
+            results.append(result)
+        for result in results:
+            errorReply=self._isErrorReply(result)
+            if errorReply:
+                raise errorReply
+        return results
+
     @classmethod
     def _addResponseToHistory(cls,result,bytes_sent,address):
         """
@@ -1318,19 +1653,86 @@ class ioHubConnection(object):
         self._sessionMetaData=sessionInfoDict
         return sessionInfoDict['session_id']
         
-    def _getEvents(self):
+    def _getEvents(self,query=None):
         """
         Sends a request to the ioHub Server for any new device events from the global server event buffer.
         The events are returned and the global ioHub server event buffer is cleared.
 
+        If a query (see net.eventQuery) is given, the ioHub Server only returns
+        (and clears) the events that the query selects. Events read from shared
+        memory are only limited to the event types that the query can match
+        (its event_types, or those with the attributes its filters name), so
+        the rest of the query must still be applied to them (see
+        _getQueriedEvents).
+
         Args: None
         Return(tuple): list of events, or empty list if no events have occurred since last call
               to getEvents() or clearEvents(). Each event in the list is a tuple containing the ordered
               attributes of the event constructor.
         """
-        r = self._sendToHubServer(('GET_EVENTS',))
+        request=('GET_EVENTS',)
+        if query:
+            request=('GET_EVENTS','list',query)
+        if self._shared_events:
+            event_types=None
+            ring_types=None
+            if query:
+                event_types=ring_types=query.get('event_types')
+                if event_types is None and query.get('filters'):
+                    # leave events that the filters can't match in their rings
+                    ring_types=filteredEventTypes(self._shared_events.rings.keys(),query['filters'])
+            events=self._shared_events.getEvents(ring_types)
+            if self._shared_events.hasUDPEvents():
+                self._udp_events_left=True
+            if self._udp_events_left and not (event_types and self._shared_events.hasEventTypes(event_types)):
+                # events of types that the ioHub Process couldn't put in shared memory
+                r = self._sendToHubServer(request)
+                self._udp_events_left=len(r)>2 and r[2]>0
+                if r[1]:
+                    events.extend(r[1])
+                    events.sort(key=itemgetter(DeviceEvent.EVENT_HUB_TIME_INDEX))
+            return events or None
+        r = self._sendToHubServer(request)
         return r[1]
 
+    def _getQueriedEvents(self,query):
+        """
+        Returns the events, including any kept by wait(), that the query selects
+        (see net.queryEvents). Events that do not match the query are kept in 
+        allEvents for a later getEvents() call; like the ioHub Process's
+        eventBuffer, it only keeps the most recent of them.
+        """
+        events=list(self.allEvents)
+        events.extend(self._getEvents(query) or [])
+        selected,unmatched=queryEvents(events,**query)
+        self.allEvents=deque(unmatched,maxlen=self._max_kept_events)
+        return selected
+
+    def _getEventArrays(self,device_label=None,query=None):
+        """
+        Same as _getEvents but returning a dict of structured numpy arrays, one
+        for each event type (see getEvents(as_type='numpy')), and including any
+        events kept by wait().
+        """
+        if device_label is not None:
+            return self.deviceByLabel[device_label].getEvents(asType='numpy',**(query or {}))
+        if query and (self.allEvents or self._shared_events):
+            # the query has to be applied by this process to some of the events
+            return eventListsToArrays(self._getQueriedEvents(query))
+        if query:
+            return unpackEventArrays(self._sendToHubServer(('GET_EVENTS','numpy',query))[1])
+        arrays=[]
+        if self.allEvents:
+            arrays.append(eventListsToArrays(self.allEvents))
+            self.allEvents=[]
+        if self._shared_events:
+            arrays.append(self._shared_events.getEventArrays())
+            if self._shared_events.hasUDPEvents() or self._udp_events_left:
+                self._udp_events_left=False
+                arrays.append(unpackEventArrays(self._sendToHubServer(('GET_EVENTS','numpy'))[1]))
+        else:
+            arrays.append(unpackEventArrays(self._sendToHubServer(('GET_EVENTS','numpy'))[1]))
+        return mergeEventArrays(arrays)
 
     @staticmethod
     def _eventListToObject(eventValueList):
@@ -1388,6 +1790,12 @@ class ioHubConnection(object):
                 TimeoutError=psutil.TimeoutExpired
                 
             try:
+                if self._shared_events:
+                    self._shared_events.close()
+                    self._shared_events=None
+                if self.stream_client:
+                    self.stream_client.close()
+                    self.stream_client=None
                 self.udp_client.sendTo(('STOP_IOHUB_SERVER',))
                 self.udp_client.close()
                 if Computer.ioHubServerProcess:
@@ -1466,6 +1874,8 @@ def launchHubServer(**kwargs):
     * session_code: A unique session code for the current run of the experiment.
     * psychopy_monitor_name: The name of the PsychoPy Monitor settings file that should be used to define physical characteristics of the ioHub Display device being created.
     * iohub_config_name: A string providing the absolute path and file name of an iohub_config yaml file to load and use for configuring monitored devices. Any other device name kwargs are ignored.    
+    * shared_memory_events: True, or a dict of shared_memory_events settings (e.g. dict(slot_count=4096)), to have the ioHub Process pass events to getEvents() and receive sendMessageEvent() messages through shared memory instead of by UDP. UDP is still used for all other requests.
+    * stream_transport: True, or a dict of stream_transport settings (e.g. dict(socket_path='/tmp/my_iohub.sock') or dict(unix_socket=False, tcp_port=9035)), to send requests to the ioHub Process over a Unix domain socket (or a TCP loopback connection where Unix domain sockets are not available) instead of by UDP. Replies of any size are then received in one piece, and several requests can be sent before their replies are read.
     * Any valid ioHub Device class names: Each class name would be given as a kwarg label, and the value of the kwarg must be a dict object containing the Device Configuration Settings that need to be changed from ioHub Device type defaults. 
     
     Device class name kwarg value dictionaries must be properly formatted and contain valid
@@ -1615,6 +2025,18 @@ def launchHubServer(**kwargs):
             datastore_name = None
 
 
+    shared_memory_events=kwargs.pop('shared_memory_events',None)
+    if shared_memory_events is True:
+        shared_memory_events=dict(enable=True)
+    elif shared_memory_events:
+        shared_memory_events=dict(shared_memory_events,enable=True)
+
+    stream_transport=kwargs.pop('stream_transport',None)
+    if stream_transport is True:
+        stream_transport=dict(enable=True)
+    elif stream_transport:
+        stream_transport=dict(stream_transport,enable=True)
+
     monitor_devices_config=None
     if kwargs.get('iohub_config_name'):        
         from psychopy.iohub import load, Loader    
@@ -1680,6 +2102,12 @@ def launchHubServer(**kwargs):
         ioConfig['data_store']=dict(enable=True,filename=datastore_name,experiment_info=dict(code=experiment_code),
                                             session_info=dict(code=session_code))
     
+    if shared_memory_events:
+        ioConfig['shared_memory_events']=shared_memory_events
+
+    if stream_transport:
+        ioConfig['stream_transport']=stream_transport
+
     #print "IOHUB CONFIG: ",ioConfig
     # Start the ioHub Server
     return ioHubConnection(ioConfig)
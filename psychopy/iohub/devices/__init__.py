@@ -903,7 +903,9 @@ class Device(ioObject):
             
             clearEvents (int): Can be used to indicate if the events being returned should also be removed from the device event buffer. True (the defualt) indicates to remove events being returned. False results in events being left in the device event buffer. 
         
-            asType (str): Optional kwarg giving the object type to return events as. Valid values are 'namedtuple' (the default), 'dict', 'list', or 'object'.
+            asType (str): Optional kwarg giving the object type to return events as. Valid values are 'namedtuple' (the default), 'dict', 'list', 'object' or 'numpy' (a dict of structured arrays, one for each event type, keyed by event type id).
+
+            event_types, start_time, end_time, filters, latest_only, max_count: Optional kwargs giving a query that is evaluated by the ioHub Process, so that only the events that are needed are sent to the experiment. See ioHubConnection.getEvents() for details. Events that do not match the query are left in the device event buffer.
 
         Returns:   
             (list): New events that the ioHub has received since the last getEvents() or clearEvents() call to the device. Events are ordered by the ioHub time of each event, older event at index 0. The event object type is determined by the asType parameter passed to the method. By default a namedtuple object is returned for each event. 
@@ -920,8 +922,25 @@ class Device(ioObject):
                 eventTypeID=kwargs.get('event_type',None)    
             clearEvents=kwargs.get('clearEvents',True)
 
+        from psychopy.iohub.net import EVENT_QUERY_ARGS, queryEvents, packEventArrays
+        query=dict([(a,kwargs[a]) for a in EVENT_QUERY_ARGS if kwargs.get(a) is not None])
+
         currentEvents=[]
-        if eventTypeID:
+        if query:
+            eventTypes=query.pop('event_types',None)
+            if eventTypeID:
+                eventTypes=[eventTypeID,]
+            if eventTypes is None:
+                eventTypes=self._iohub_event_buffer.keys()
+            [currentEvents.extend(self._iohub_event_buffer.get(t,[])) for t in eventTypes]
+            currentEvents,unmatched=queryEvents(currentEvents,**query)
+            if clearEvents is True:
+                for t in eventTypes:
+                    if t in self._iohub_event_buffer:
+                        self._iohub_event_buffer[t]=[]
+                for e in unmatched:
+                    self._iohub_event_buffer[e[DeviceEvent.EVENT_TYPE_ID_INDEX]].append(e)
+        elif eventTypeID:
             currentEvents=list(self._iohub_event_buffer.get(eventTypeID,[]))
             if clearEvents is True and len(currentEvents)>0:
                 self._iohub_event_buffer[eventTypeID]=[]
@@ -930,7 +949,10 @@ class Device(ioObject):
             if clearEvents is True and len(currentEvents)>0:
                 self.clearEvents()
 
-        if len(currentEvents)>0:
+        if kwargs.get('asType') == 'numpy':
+            return packEventArrays(currentEvents)
+
+        if len(currentEvents)>0 and not query:
             currentEvents=sorted(currentEvents, key=itemgetter(DeviceEvent.EVENT_HUB_TIME_INDEX))
         return currentEvents
 
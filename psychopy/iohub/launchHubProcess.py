@@ -43,6 +43,8 @@ def run(rootScriptPathDir,configFilePath):
     try:
         s.log('Receiving datagrams on :9000')
         s.udpService.start()
+        if s.streamService:
+            s.streamService.start()
 
         if hasattr(gevent,'run'):
             for m in s.deviceMonitors:
@@ -13,9 +13,14 @@ Distributed under the terms of the GNU General Public License (GPL version 3 or
 from gevent import socket,sleep,Greenlet
 import msgpack
 import struct
+import mmap
+import os
+import tempfile
+from operator import itemgetter
+import numpy as N
 from weakref import proxy
 from psychopy.iohub.util import NumPyRingBuffer as RingBuffer
-from psychopy.iohub import Computer, print2err, printExceptionDetailsToStdErr
+from psychopy.iohub import Computer, DeviceEvent, EventConstants, print2err, printExceptionDetailsToStdErr
 getTime=Computer.getTime
 
 MAX_PACKET_SIZE=64*1024
@@ -92,6 +97,104 @@ class UDPClientConnection(SocketConnection):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MAX_PACKET_SIZE)
 
+##### STREAM TRANSPORT ######
+
+# each message sent over a stream connection is a msgpack packet preceded
+# by its length, so there is no limit on the size of a message and messages
+# can not be lost or mixed up.
+STREAM_HEADER=struct.Struct('<I')
+
+def streamTransportAddress(config):
+    """
+    Returns (socket family, address) of the stream transport of the ioHub
+    Process using the given ioHub config: a Unix domain socket where
+    available (by default iohub_<udp_port>.sock in the temp directory),
+    otherwise a TCP socket on the loopback interface.
+    """
+    settings=config.get('stream_transport') or {}
+    if hasattr(socket,'AF_UNIX') and settings.get('unix_socket',True):
+        path=settings.get('socket_path') or os.path.join(tempfile.gettempdir(),'iohub_%d.sock'%config.get('udp_port',9000))
+        return socket.AF_UNIX,path
+    return socket.AF_INET,('127.0.0.1',settings.get('tcp_port',9035))
+
+def createStreamSocket(family):
+    sock=socket.socket(family,socket.SOCK_STREAM)
+    if family == socket.AF_INET:
+        # requests are small and each one is waited for, so send them at once
+        sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+    return sock
+
+def receiveStreamMessage(sock,unpackb):
+    """
+    Reads one length prefixed message from a stream socket and returns it
+    decoded, or None if the connection was closed.
+    """
+    header=_receiveBytes(sock,STREAM_HEADER.size)
+    if header is None:
+        return None
+    data=_receiveBytes(sock,STREAM_HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return unpackb(data)
+
+def _receiveBytes(sock,byte_count):
+    chunks=[]
+    while byte_count > 0:
+        chunk=sock.recv(min(byte_count,MAX_PACKET_SIZE))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        byte_count-=len(chunk)
+    return ''.join(chunks)
+
+class StreamClientConnection(object):
+    """
+    A connection to the stream transport of the ioHub Process, with the same
+    sendTo() and receive() methods as UDPClientConnection. Replies are
+    received in the order that requests were sent, so several requests can
+    be sent before their replies are read (see sendMany()).
+    """
+    def __init__(self,family,address,connect_timeout=5.0):
+        self._address=address
+        self.sock=createStreamSocket(family)
+        self.sock.settimeout(connect_timeout)
+        self.sock.connect(address)
+        # as with UDP, wait for as long as a request takes
+        self.sock.settimeout(None)
+        self.packer=msgpack.Packer()
+        self.pack=self.packer.pack
+
+    def _unpack(self,data):
+        return msgpack.unpackb(data,use_list=True)
+
+    def sendTo(self,data,address=None):
+        d=self.pack(data)
+        self.sock.sendall(STREAM_HEADER.pack(len(d))+d)
+        return len(d)
+
+    def sendMany(self,messages):
+        """
+        Sends several messages in one write; their replies must then be read
+        with receive(), one for each message.
+        """
+        packets=[]
+        for m in messages:
+            d=self.pack(m)
+            packets.append(STREAM_HEADER.pack(len(d)))
+            packets.append(d)
+        data=''.join(packets)
+        self.sock.sendall(data)
+        return len(data)
+
+    def receive(self):
+        result=receiveStreamMessage(self.sock,self._unpack)
+        if result is None:
+            raise socket.error("The ioHub Process closed the stream connection.")
+        return result,self._address
+
+    def close(self):
+        self.sock.close()
+
 ##### TIME SYNC CLASS ######
  
 class ioHubTimeSyncConnection(UDPClientConnection):
@@ -301,4 +404,448 @@ class TimeSyncState(object):
         Converts a remote computer time (sec.msec format) to the corresponding local
         time, using the current offset and drift measures.       
         """
-        return (remote_time-self.getOffset())/self.getDrift()
\ No newline at end of file
+        return (remote_time-self.getOffset())/self.getDrift()
+
+##### EVENT ARRAYS ######
+
+def eventArrayDType(numpy_dtype):
+    """
+    Returns the dtype used for arrays of events of one type (see
+    eventListsToArrays) and for the shared memory slots of an event type:
+    the NUMPY_DTYPE of the event class with any float32 fields, including
+    those of nested events such as KeyboardCharEvent.press_event, widened to
+    float64, so that event times keep the precision that they have when the
+    events are sent as lists.
+    """
+    return N.dtype(_widenedDescr(numpy_dtype.descr))
+
+def _widenedDescr(descr):
+    fields=[]
+    for field in descr:
+        field=list(field)
+        if isinstance(field[1],list):
+            field[1]=_widenedDescr(field[1])
+        elif N.dtype(field[1]) == N.float32:
+            field[1]=N.float64
+        fields.append(tuple(field))
+    return fields
+
+def _descrFields(descr):
+    # msgpack sends the tuples of a dtype descr, at every level, as lists
+    fields=[]
+    for field in descr:
+        field_type=field[1]
+        if isinstance(field_type,(list,tuple)):
+            field_type=_descrFields(field_type)
+        else:
+            field_type=str(field_type)
+        if len(field) == 3:
+            fields.append((str(field[0]),field_type,tuple(field[2])))
+        else:
+            fields.append((str(field[0]),field_type))
+    return fields
+
+def _dtypeFromDescr(descr):
+    return N.dtype(_descrFields(descr))
+
+_event_array_dtypes=dict()
+def _getEventArrayDType(event_type_id):
+    dtype=_event_array_dtypes.get(event_type_id)
+    if dtype is None:
+        dtype=eventArrayDType(EventConstants.getClass(event_type_id).NUMPY_DTYPE)
+        _event_array_dtypes[event_type_id]=dtype
+    return dtype
+
+def _encodeEventValues(event):
+    # string fields of event arrays are byte strings, as msgpack sends them,
+    # and nested events (e.g. KeyboardCharEvent.press_event) must be tuples
+    values=[]
+    for v in event:
+        if isinstance(v,unicode):
+            v=v.encode('utf-8')
+        elif isinstance(v,(list,tuple)):
+            v=_encodeEventValues(v)
+        values.append(v)
+    return tuple(values)
+
+def eventListsToArrays(events):
+    """
+    Convert a list of events (each a list or tuple of the event's attribute
+    values) to a dict of structured numpy arrays, one for each event type,
+    with the event type id as the key. Each array is sorted by event time.
+    """
+    event_rows=dict()
+    for event in events:
+        event_rows.setdefault(event[DeviceEvent.EVENT_TYPE_ID_INDEX],[]).append(_encodeEventValues(event))
+    arrays=dict()
+    for event_type,rows in event_rows.iteritems():
+        arr=N.array(rows,_getEventArrayDType(event_type))
+        arrays[event_type]=arr[N.argsort(arr['time'],kind='mergesort')]
+    return arrays
+
+def packEventArrays(events):
+    """
+    Convert a list of events to one structured array per event type (see
+    eventListsToArrays, so in event time order) packed as [event_type_id,
+    dtype descr, array bytes], ready to be sent with msgpack and decoded by
+    unpackEventArrays.
+    """
+    return [[event_type,arr.dtype.descr,arr.tostring()] for event_type,arr in eventListsToArrays(events).iteritems()]
+
+_unpacked_dtypes=dict()
+def unpackEventArrays(packed):
+    """
+    Decode the result of packEventArrays to a dict of structured numpy arrays
+    (one per event type, keyed by event type id), without creating a Python
+    object for each event.
+    """
+    arrays=dict()
+    for event_type,descr,data in packed or []:
+        dtype=_unpacked_dtypes.get(event_type)
+        if dtype is None:
+            dtype=_unpacked_dtypes[event_type]=_dtypeFromDescr(descr)
+        arrays[event_type]=N.frombuffer(data,dtype)
+    return arrays
+
+def mergeEventArrays(array_dicts):
+    """
+    Merge dicts of event arrays (as returned by unpackEventArrays), joining
+    the arrays of each event type and keeping them in event time order.
+    """
+    merged=dict()
+    for arrays in array_dicts:
+        for event_type,arr in arrays.iteritems():
+            if len(arr) == 0:
+                continue
+            if event_type in merged:
+                arr=N.concatenate((merged[event_type],arr))
+                arr=arr[N.argsort(arr['time'],kind='mergesort')]
+            merged[event_type]=arr
+    return merged
+
+##### EVENT QUERIES ######
+
+EVENT_QUERY_ARGS=('event_types','start_time','end_time','filters','latest_only','max_count')
+
+def _isValueSet(value):
+    return isinstance(value,(list,tuple,set,frozenset))
+
+def eventQuery(event_types=None,start_time=None,end_time=None,filters=None,latest_only=False,max_count=None):
+    """
+    Returns a getEvents query, evaluated by queryEvents, as a dict that can
+    be sent with msgpack (sets are sent as lists), or None if none of the
+    arguments restricts the events that are returned:
+
+    * event_types: an event type id, or a list of them, of the events to return.
+    * start_time, end_time: only events with an ioHub time in this window (inclusive) are returned.
+    * filters: a dict of event attribute name: value. An event is returned only if it has every attribute and, for each one, the value is equal to the given value or, if a list, tuple or set is given, in it.
+    * latest_only: if True, only the most recent matching event of each event type is returned.
+    * max_count: at most the max_count most recent matching events are returned.
+    """
+    query=dict()
+    if event_types is not None:
+        if not _isValueSet(event_types):
+            event_types=[event_types,]
+        query['event_types']=[int(t) for t in event_types]
+    if start_time is not None:
+        query['start_time']=start_time
+    if end_time is not None:
+        query['end_time']=end_time
+    if filters:
+        query['filters']=dict([(name,list(value) if _isValueSet(value) else value) for name,value in filters.iteritems()])
+    if latest_only:
+        query['latest_only']=True
+    if max_count is not None:
+        query['max_count']=int(max_count)
+    return query or None
+
+_event_attribute_indexes=dict()
+def _getEventAttributeIndex(event_type_id,name):
+    key=(event_type_id,name)
+    if key not in _event_attribute_indexes:
+        index=None
+        eclass=EventConstants.getClass(event_type_id)
+        if eclass is not None and name in eclass.CLASS_ATTRIBUTE_NAMES:
+            index=eclass.CLASS_ATTRIBUTE_NAMES.index(name)
+        _event_attribute_indexes[key]=index
+    return _event_attribute_indexes[key]
+
+def filteredEventTypes(event_types,filters):
+    """
+    Returns those of the event_types whose events have all of the attributes
+    named in a query's filters, i.e. the event types that the query can match.
+    """
+    return [t for t in event_types if all([_getEventAttributeIndex(t,name) is not None for name in filters])]
+
+def _valueTest(value):
+    if _isValueSet(value):
+        try:
+            return frozenset(value).__contains__
+        except TypeError:
+            return lambda v: v in value
+    return lambda v: v == value
+
+def _eventMatcher(event_types,start_time,end_time,filters):
+    if event_types is None and start_time is None and end_time is None and not filters:
+        return None
+    type_set=None
+    if event_types is not None:
+        type_set=frozenset(event_types)
+    tests=[(name,_valueTest(value)) for name,value in (filters or {}).iteritems()]
+    type_index=DeviceEvent.EVENT_TYPE_ID_INDEX
+    time_index=DeviceEvent.EVENT_HUB_TIME_INDEX
+
+    def match(event):
+        event_type=event[type_index]
+        if type_set is not None and event_type not in type_set:
+            return False
+        if start_time is not None and event[time_index] < start_time:
+            return False
+        if end_time is not None and event[time_index] > end_time:
+            return False
+        for name,test in tests:
+            index=_getEventAttributeIndex(event_type,name)
+            if index is None or not test(event[index]):
+                return False
+        return True
+    return match
+
+def queryEvents(events,event_types=None,start_time=None,end_time=None,filters=None,latest_only=False,max_count=None):
+    """
+    Evaluates a getEvents query (see eventQuery) on a sequence of events, each
+    a list of event attribute values.
+
+    Returns (selected, unmatched): the events that the query returns, sorted by
+    event time, and the events that do not match the query, in their original
+    order. Matching events that are not selected because of latest_only or
+    max_count are in neither list, so that they are discarded from the event
+    buffer the events were taken from.
+    """
+    match=_eventMatcher(event_types,start_time,end_time,filters)
+    if match is None:
+        matched=list(events)
+        unmatched=[]
+    else:
+        matched=[]
+        unmatched=[]
+        for event in events:
+            if match(event):
+                matched.append(event)
+            else:
+                unmatched.append(event)
+    matched.sort(key=itemgetter(DeviceEvent.EVENT_HUB_TIME_INDEX))
+    if latest_only and matched:
+        latest=dict()
+        for event in matched:
+            latest[event[DeviceEvent.EVENT_TYPE_ID_INDEX]]=event
+        matched=sorted(latest.values(),key=itemgetter(DeviceEvent.EVENT_HUB_TIME_INDEX))
+    if max_count is not None and len(matched) > max_count:
+        matched=matched[len(matched)-max_count:] if max_count > 0 else []
+    return matched,unmatched
+
+##### SHARED MEMORY EVENT TRANSPORT ######
+
+class SharedEventRing(object):
+    """
+    A ring buffer of events of one type, held in shared memory, that one
+    process writes events to and one other process reads them from, without
+    either process waiting for the other or using a lock.
+
+    Each slot holds one event, stored using the event class's NUMPY_DTYPE
+    (see eventArrayDType). The writer copies an event into the next slot and
+    then increments the write count; the reader copies the slots between its
+    read count and the write count and then updates the read count. The two
+    counts are on separate cache lines so that each is only written by one
+    process.
+
+    If the reader falls more than slot_count events behind, put() either
+    overwrites the oldest events (which the reader then counts in lost_count)
+    or, if overwrite is False, returns False so that the caller can send the
+    event another way.
+    """
+    HEADER_SIZE=128
+    def __init__(self,shared_buffer,offset,dtype,slot_count):
+        self.dtype=dtype
+        self.slot_count=slot_count
+        counts=N.ndarray((self.HEADER_SIZE//8,),N.uint64,shared_buffer,offset)
+        self._write_count=counts[0:1]
+        self._read_count=counts[8:9]
+        self.slots=N.ndarray((slot_count,),dtype,shared_buffer,offset+self.HEADER_SIZE)
+        self.lost_count=0
+
+    @classmethod
+    def getByteSize(cls,dtype,slot_count):
+        size=cls.HEADER_SIZE+dtype.itemsize*slot_count
+        return size+(-size)%64
+
+    def put(self,event,overwrite=True):
+        write_count=int(self._write_count[0])
+        if not overwrite and write_count-int(self._read_count[0]) >= self.slot_count:
+            return False
+        self.slots[write_count%self.slot_count]=_encodeEventValues(event)
+        self._write_count[0]=write_count+1
+        return True
+
+    def get(self):
+        """
+        Returns a (copied) array of the events written since the last call.
+        """
+        write_count=int(self._write_count[0])
+        read_count=int(self._read_count[0])
+        if write_count-read_count > self.slot_count:
+            self.lost_count+=write_count-self.slot_count-read_count
+            read_count=write_count-self.slot_count
+        if write_count == read_count:
+            return self.slots[:0].copy()
+        events=self.slots.take(N.arange(read_count,write_count)%self.slot_count)
+        # drop any events the writer started overwriting while they were copied
+        overwritten=int(self._write_count[0])+1-self.slot_count-read_count
+        if overwritten > 0:
+            self.lost_count+=overwritten
+            events=events[overwritten:]
+        self._read_count[0]=write_count
+        return events
+
+    def clear(self):
+        self._read_count[0]=self._write_count[0]
+
+    def __len__(self):
+        return min(int(self._write_count[0])-int(self._read_count[0]),self.slot_count)
+
+class SharedEventBuffer(object):
+    """
+    The shared memory (a memory-mapped file) used to pass events between the
+    ioHub Process and the PsychoPy Process without a UDP round trip.
+
+    It holds a SharedEventRing for each event type that the ioHub Process
+    streams to the Global Event Buffer, written by the ioHub Process and read
+    by ioHubConnection.getEvents(), and one for MessageEvents sent by
+    ioHubConnection.sendMessageEvent() to the ioHub Process. The ioHub
+    Process creates the buffer and gives its layout to the PsychoPy Process
+    with getLayout(), which attaches to it with SharedEventBuffer(layout).
+
+    The header holds a count of the events that the ioHub Process had to put
+    in its (UDP) Global Event Buffer instead, e.g. those of devices added
+    after it started, so that the PsychoPy Process only asks for those when
+    there are some.
+    """
+    HEADER_SIZE=128
+    def __init__(self,layout,create=False):
+        self.file_path=layout['file_path']
+        self._layout=layout
+        size=self.HEADER_SIZE
+        ring_offsets=[]
+        for event_type,descr,slot_count in layout['rings']:
+            ring_offsets.append(size)
+            size+=SharedEventRing.getByteSize(_dtypeFromDescr(descr),slot_count)
+        if create:
+            f=open(self.file_path,'w+b')
+            f.truncate(size)
+        else:
+            f=open(self.file_path,'r+b')
+        try:
+            self._mmap=mmap.mmap(f.fileno(),size)
+        finally:
+            f.close()
+        self._udp_event_count=N.ndarray((1,),N.uint64,self._mmap,0)
+        self._last_udp_event_count=int(self._udp_event_count[0])
+        rings=[]
+        for (event_type,descr,slot_count),offset in zip(layout['rings'],ring_offsets):
+            rings.append(SharedEventRing(self._mmap,offset,_dtypeFromDescr(descr),slot_count))
+        # the last ring is for messages sent to the ioHub Process
+        self.event_rings=rings[:-1]
+        self.rings=dict(zip(layout['event_types'],self.event_rings))
+        self.message_ring=rings[-1]
+
+    @classmethod
+    def create(cls,event_classes,message_class,slot_count):
+        """
+        Create the buffer (in the ioHub Process), with a ring of slot_count
+        events for each of event_classes and one for message_class.
+        """
+        file_path=os.path.join(tempfile.gettempdir(),'iohub_events_%d.shm'%(os.getpid()))
+        rings=[]
+        for event_class in list(event_classes)+[message_class]:
+            rings.append((event_class.EVENT_TYPE_ID,eventArrayDType(event_class.NUMPY_DTYPE).descr,slot_count))
+        layout=dict(file_path=file_path,rings=rings,
+                    event_types=[event_class.EVENT_TYPE_ID for event_class in event_classes])
+        return cls(layout,create=True)
+
+    def getLayout(self):
+        return self._layout
+
+    def addUDPEvent(self):
+        """
+        Called by the ioHub Process when it puts an event in its Global Event Buffer.
+        """
+        self._udp_event_count[0]+=1
+
+    def hasUDPEvents(self):
+        """
+        Whether the ioHub Process has put events in its Global Event Buffer
+        since this was last called (by the PsychoPy Process).
+        """
+        udp_event_count=int(self._udp_event_count[0])
+        if udp_event_count != self._last_udp_event_count:
+            self._last_udp_event_count=udp_event_count
+            return True
+        return False
+
+    def _getRings(self,event_types=None):
+        if event_types is None:
+            return self.rings.items()
+        return [(t,self.rings[t]) for t in event_types if t in self.rings]
+
+    def hasEventTypes(self,event_types):
+        """
+        Returns True if events of all of the event_types are sent in shared
+        memory (so that none of them are waiting in the UDP event buffer).
+        """
+        return all([t in self.rings for t in event_types])
+
+    def getEvents(self,event_types=None):
+        """
+        Returns the events written to the event rings (of the given event
+        types, or all of them) since the last call, as lists of event attribute
+        values sorted by event time.
+        """
+        events=[]
+        for event_type,ring in self._getRings(event_types):
+            if len(ring):
+                events.extend([list(e) for e in ring.get().tolist()])
+        if events:
+            events.sort(key=itemgetter(DeviceEvent.EVENT_HUB_TIME_INDEX))
+        return events
+
+    def getEventArrays(self,event_types=None):
+        """
+        Returns the events written to the event rings (of the given event
+        types, or all of them) since the last call, as a dict of structured
+        arrays (one per event type, keyed by event type id).
+        """
+        arrays=dict()
+        for event_type,ring in self._getRings(event_types):
+            if len(ring):
+                arrays[event_type]=ring.get()
+        return arrays
+
+    def clearEvents(self):
+        for ring in self.event_rings:
+            ring.clear()
+
+    def getLostEventCount(self):
+        return sum([ring.lost_count for ring in self.event_rings])
+
+    def close(self,remove=False):
+        if self._mmap is not None:
+            self.rings=dict()
+            self.event_rings=[]
+            self.message_ring=None
+            self._udp_event_count=None
+            try:
+                self._mmap.close()
+            except Exception:
+                pass  # arrays that use it may still exist
+            self._mmap=None
+        if remove and os.path.exists(self.file_path):
+            os.remove(self.file_path)
@@ -10,7 +10,12 @@ Distributed under the terms of the GNU General Public License (GPL version 3 or
 """
 
 import gevent
-from gevent.server import DatagramServer
+from gevent.server import DatagramServer, StreamServer
+from gevent import socket
+try:
+    from gevent.lock import Semaphore
+except ImportError:
+    from gevent.coros import Semaphore
 from gevent import Greenlet
 import os,sys
 from operator import itemgetter
@@ -18,7 +23,8 @@ from collections import deque
 import psychopy.iohub
 from psychopy.iohub import OrderedDict,print2err, printExceptionDetailsToStdErr, ioHubError, createErrorResult,convertCamelToSnake, DeviceConstants,EventConstants,Computer, DeviceEvent, import_device, IO_HUB_DIRECTORY, load, dump, Loader, Dumper
 from psychopy.iohub.devices.deviceConfigValidation import validateDeviceConfiguration
-from psychopy.iohub.net import MAX_PACKET_SIZE
+from psychopy.iohub.net import MAX_PACKET_SIZE, SharedEventBuffer, packEventArrays, queryEvents
+from psychopy.iohub.net import STREAM_HEADER, streamTransportAddress, createStreamSocket, receiveStreamMessage
 currentSec= Computer.currentSec
 
 import json
@@ -45,6 +51,13 @@ class udpServer(DatagramServer):
         
         self.feed(request)
         request = self.unpack()   
+        return self.handleRequest(request,replyTo)
+
+    def handleRequest(self,request,replyTo):
+        """
+        Handles a decoded request, received by UDP or from a stream connection
+        (see streamServer), sending the reply to replyTo.
+        """
         request_type= request.pop(0)
         if request_type == 'SYNC_REQ':
             self.sendResponse(['SYNC_REPLY',currentSec()],replyTo)  
@@ -54,20 +67,26 @@ class udpServer(DatagramServer):
                 msg_id=request.pop(0)
                 payload=request.pop(0)
                 ctime=currentSec()
-                self.sendResponse(["PING_BACK",ctime,msg_id,payload,replyTo],replyTo)
+                self.sendResponse(["PING_BACK",ctime,msg_id,payload,getattr(replyTo,'address',replyTo)],replyTo)
                 return True
         elif request_type == 'GET_EVENTS':
-            return self.handleGetEvents(replyTo)
+            return self.handleGetEvents(replyTo,*request)
+        elif request_type == 'ASYNC':
+            # the client does not wait for the reply, which is sent with the
+            # request id whenever the request has been handled.
+            request_id=request.pop(0)
+            gevent.spawn(self.handleAsyncRequest,request.pop(0),AsyncReplyTo(replyTo,request_id))
+            return True
         elif request_type == 'EXP_DEVICE':
             return self.handleExperimentDeviceRequest(request,replyTo)
         elif request_type == 'RPC':
             callable_name=request.pop(0)
             args=None
             kwargs=None
-            if len(request)==1:
+            if len(request)>0:
                 args=request.pop(0)
-            if len(request)==1:
-                kwargs=request.pop(0)    
+            if len(request)>0:
+                kwargs=request.pop(0)
             
             result=None
             try:
@@ -82,14 +101,7 @@ class udpServer(DatagramServer):
             if result and callable(result):
                 funcPtr=result
                 try:
-                    if args is None and kwargs is None:
-                        result = funcPtr()
-                    elif args and kwargs:
-                        result = funcPtr(*args,**kwargs)
-                    elif args and not kwargs:
-                        result = funcPtr(*args)
-                    elif not args and kwargs:
-                        result = funcPtr(**kwargs)
+                    result = funcPtr(*(args or ()),**(kwargs or {}))
                     edata=('RPC_RESULT',callable_name,result)
                     self.sendResponse(edata,replyTo)
                     return True
@@ -121,16 +133,29 @@ class udpServer(DatagramServer):
                                 replyTo)
             return False
             
-    def handleGetEvents(self,replyTo):
+    def handleGetEvents(self,replyTo,as_type='list',query=None):
         try:
-            currentEvents=list(self.iohub.eventBuffer)
-            self.iohub.eventBuffer.clear()
-
-            if len(currentEvents)>0:
-                currentEvents=sorted(currentEvents, key=itemgetter(DeviceEvent.EVENT_HUB_TIME_INDEX))
-                self.sendResponse(('GET_EVENTS_RESULT',currentEvents),replyTo)
+            if query:
+                # only the events the query selects are sent; events that do
+                # not match it are left in the buffer, and their number is
+                # added to the reply.
+                currentEvents,unmatched=queryEvents(self.iohub.eventBuffer,**query)
+                self.iohub.eventBuffer.clear()
+                self.iohub.eventBuffer.extend(unmatched)
+                result=['GET_EVENTS_RESULT',None,len(unmatched)]
             else:
-                self.sendResponse(('GET_EVENTS_RESULT', None),replyTo)
+                currentEvents=list(self.iohub.eventBuffer)
+                self.iohub.eventBuffer.clear()
+                result=['GET_EVENTS_RESULT',None]
+
+            if len(currentEvents)>0 and as_type == 'numpy':
+                # one array per event type, decoded by the client without per event objects
+                result[1]=packEventArrays(currentEvents)
+            elif len(currentEvents)>0:
+                if not query:
+                    currentEvents=sorted(currentEvents, key=itemgetter(DeviceEvent.EVENT_HUB_TIME_INDEX))
+                result[1]=currentEvents
+            self.sendResponse(tuple(result),replyTo)
             return True
         except Exception,e:
             self.sendResponse(createErrorResult('IOHUB_GET_EVENTS_ERROR',
@@ -139,6 +164,17 @@ class udpServer(DatagramServer):
                                 replyTo)
             return False
 
+    def handleAsyncRequest(self,request,replyTo):
+        try:
+            return self.handleRequest(request,replyTo)
+        except Exception,e:
+            self.sendResponse(createErrorResult('IOHUB_ASYNC_REQUEST_ERROR',
+                                    msg="An error occurred while the ioHub Server was handling an async request",
+                                    request_id=replyTo.request_id,
+                                    exception=str(e)),
+                                replyTo)
+            return False
+
     def handleExperimentDeviceRequest(self,request,replyTo):
         request_type= request.pop(0)
         if request_type == 'EVENT_TX':
@@ -271,6 +307,11 @@ class udpServer(DatagramServer):
             return False
             
     def sendResponse(self,data,address):
+        if isinstance(address,AsyncReplyTo):
+            data=('ASYNC_RESULT',address.request_id,data)
+            address=address.replyTo
+        if isinstance(address,StreamConnection):
+            return address.sendResponse(data)
         packet_data=None
         try:
             max_size=MAX_PACKET_SIZE/2-20
@@ -376,6 +417,14 @@ class udpServer(DatagramServer):
     def clearEventBuffer(self):
         return self.iohub.clearEventBuffer()
 
+    def getSharedEventBufferLayout(self):
+        if self.iohub.sharedEventBuffer:
+            return self.iohub.sharedEventBuffer.getLayout()
+        return None
+
+    def sharedEventBufferAttached(self):
+        return self.iohub.startSharedEventRings()
+
     def enableHighPriority(self,disable_gc=True):
         Computer.enableHighPriority(disable_gc)
 
@@ -399,12 +448,104 @@ class udpServer(DatagramServer):
             self.disableHighPriority()
             self.iohub.shutdown()
             self._running=False
+            if self.iohub.streamService:
+                self.iohub.streamService.stop()
             self.stop()
         except:
             print2err("Error in ioSever.shutdown():")
             printExceptionDetailsToStdErr()
             sys.exit(1)
 
+class AsyncReplyTo(object):
+    """
+    The reply address of an 'ASYNC' request: the reply is sent to replyTo as
+    ('ASYNC_RESULT', request_id, reply), so that the client can match replies
+    that arrive out of order to their requests.
+    """
+    def __init__(self,replyTo,request_id):
+        self.replyTo=replyTo
+        self.request_id=request_id
+        self.address=getattr(replyTo,'address',replyTo)
+
+class StreamConnection(object):
+    """
+    The reply address of requests received from a stream connection; replies
+    are sent length prefixed (see net.STREAM_HEADER), in request order, or
+    for async requests in the order they are completed.
+    """
+    def __init__(self,sock,address,pack):
+        self.sock=sock
+        self.address=address
+        self.pack=pack
+        # replies of async requests are sent from their own greenlets
+        self._send_lock=Semaphore()
+
+    def sendResponse(self,data):
+        try:
+            packet_data=self.pack(data)
+        except:
+            print2err('Error trying to send data to experiment process:')
+            printExceptionDetailsToStdErr()
+            packet_data=self.pack(createErrorResult('IOHUB_SERVER_RESPONSE_ERROR',
+                                   msg="The ioHub Server Failed to send the intended response."))
+        with self._send_lock:
+            self.sock.sendall(STREAM_HEADER.pack(len(packet_data))+packet_data)
+
+class streamServer(StreamServer):
+    """
+    Receives requests from a Unix domain socket, or TCP loopback, stream
+    connection and hands them to the udpServer, so that the same requests
+    can be sent by either transport. Each connection is handled by its own
+    greenlet, so the requests of one connection are handled, and replied
+    to, in the order they are received.
+    """
+    def __init__(self,rpcServer,family,address):
+        self.rpcServer=rpcServer
+        self.socket_path=None
+        # the listener is bound here, rather than when the server is started,
+        # so that the ioServer can fall back to UDP if that fails
+        listener=socket.socket(family,socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            listener.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        else:
+            self.socket_path=address
+            if os.path.exists(address):
+                # left by an ioHub Process that did not exit cleanly
+                os.remove(address)
+        try:
+            listener.bind(address)
+            listener.listen(16)
+        except socket.error:
+            listener.close()
+            raise
+        StreamServer.__init__(self,listener)
+
+    def handle(self,sock,address):
+        if sock.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        replyTo=StreamConnection(sock,address or self.socket_path,self.rpcServer.pack)
+        try:
+            while self.rpcServer._running:
+                request=receiveStreamMessage(sock,self._unpack)
+                if request is None:
+                    break
+                self.rpcServer.handleRequest(request,replyTo)
+        except socket.error:
+            pass
+        finally:
+            sock.close()
+
+    def _unpack(self,data):
+        return msgpack.unpackb(data,use_list=True)
+
+    def close(self):
+        StreamServer.close(self)
+        if self.socket_path and os.path.exists(self.socket_path):
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+
 class DeviceMonitor(Greenlet):
     def __init__(self, device,sleep_interval):
         Greenlet.__init__(self)
@@ -447,12 +588,26 @@ class ioServer(object):
         self.filterLookupByName={}  
         self._hookDevice=None
         ioServer.eventBuffer=deque(maxlen=config.get('global_event_buffer',2048))
+        self.sharedEventBuffer=None
+        self._sharedEventRings=dict()
+        self._streamedEventIDs=[]
 
         self._running=True
         
         # start UDP service
         self.udpService=udpServer(self,':%d'%config.get('udp_port',9000))
 
+        # start the stream (Unix domain socket / TCP) service, if enabled
+        self.streamService=None
+        try:
+            if config.get('stream_transport',{}).get('enable',False):
+                family,address=streamTransportAddress(config)
+                self.streamService=streamServer(self.udpService,family,address)
+        except Exception, e:
+            print2err("Error starting the stream transport; requests will be received by UDP ....")
+            printExceptionDetailsToStdErr()
+            self.streamService=None
+
         try:
             # initial dataStore setup
             if 'data_store' in config and psychopy.iohub._DATA_STORE_AVAILABLE:
@@ -507,6 +662,15 @@ class ioServer(object):
             printExceptionDetailsToStdErr()
             raise e
 
+        # shared memory transport of streamed events to the experiment process
+        try:
+            shared_config=config.get('shared_memory_events',{})
+            if shared_config.get('enable',False):
+                self.createSharedEventBuffer(shared_config.get('slot_count',1024))
+        except Exception, e:
+            print2err("Error creating the shared memory event buffer; events will be sent by UDP ....")
+            printExceptionDetailsToStdErr()
+
         # initial time offset
         #print2err("-- ioServer Init Complete -- ")
         
@@ -798,6 +962,7 @@ class ioServer(object):
                 deviceInstance._addEventListener(self,monitoringEventIDs)
                 #ioHub.print2err("ioServer event stream listener added: device=%s eventIDs=%s"%(device_class_name,eventIDs))
                 self.log("Standard event stream listener added for ioServer for event ids %s"%(str(monitoringEventIDs),))
+                self._streamedEventIDs.extend(monitoringEventIDs)
                 # add listener for device event queue
                 deviceInstance._addEventListener(deviceInstance,monitoringEventIDs)
                 #  ioHub.print2err("%s event stream listener added: eventIDs=%s"%(device_class_name,eventIDs))
@@ -836,12 +1001,42 @@ class ioServer(object):
             pytablesfile.flush()
             pytablesfile.close()
             
+    def createSharedEventBuffer(self,slot_count):
+        from psychopy.iohub.devices.experiment import MessageEvent
+        event_classes=[]
+        for event_id in self._streamedEventIDs:
+            event_class=EventConstants.getClass(event_id)
+            if event_class is not None and event_class not in event_classes:
+                event_classes.append(event_class)
+        self.sharedEventBuffer=SharedEventBuffer.create(event_classes,MessageEvent,slot_count)
+        self.log("Shared memory event buffer created for event ids %s"%(str(self.sharedEventBuffer.rings.keys()),))
+
+    def startSharedEventRings(self):
+        # events are only put in the rings once the experiment process has
+        # attached to the buffer; until then they stay in the eventBuffer
+        if self.sharedEventBuffer:
+            self._sharedEventRings=dict(self.sharedEventBuffer.rings)
+            return True
+        return False
+
+    def closeSharedEventBuffer(self):
+        if self.sharedEventBuffer:
+            self._sharedEventRings=dict()
+            self.sharedEventBuffer.close(remove=True)
+            self.sharedEventBuffer=None
+
     def processDeviceEvents(self,sleep_interval):
         while self._running:
             self._processDeviceEventIteration()
             gevent.sleep(sleep_interval)
 
     def _processDeviceEventIteration(self):
+        if self.sharedEventBuffer:
+            messages=self.sharedEventBuffer.message_ring.get()
+            experiment=ioServer.deviceDict.get('Experiment')
+            if len(messages) and experiment:
+                for eventAsTuple in messages.tolist():
+                    experiment._nativeEventCallback(eventAsTuple)
         for device in self.devices:
             try:
                 events=device._getNativeEventBuffer()
@@ -860,7 +1055,13 @@ class ioServer(object):
                 print2err("--------------------------------------")
 
     def _handleEvent(self,event):
-        self.eventBuffer.append(event)
+        ring=self._sharedEventRings.get(event[DeviceEvent.EVENT_TYPE_ID_INDEX])
+        if ring is not None:
+            ring.put(event)
+        else:
+            self.eventBuffer.append(event)
+            if self.sharedEventBuffer:
+                self.sharedEventBuffer.addUDPEvent()
 
     def clearEventBuffer(self):
         l= len(self.eventBuffer)
@@ -884,6 +1085,10 @@ class ioServer(object):
                 self.closeDataStoreFile()
             except:
                 pass
+            try:
+                self.closeSharedEventBuffer()
+            except:
+                pass
             while len(self.devices) > 0:
                 d=self.devices.pop(0)
                 try:
@@ -25,11 +25,12 @@ messages, (which PsychoPy doesn't use) using the commands::
 # Distributed under the terms of the GNU General Public License (GPL).
 
 #Much of the code below is based conceptually, if not syntactically, on the
-#python logging module but it's simpler (no threading) and maintaining a stack
-#of log entries for later writing (don't want files written while drawing)
+#python logging module but it's simpler and maintains a stack of log entries
+#for later writing (don't want files written while drawing). Optionally that
+#writing can be done by a background thread (see startWriter)
 
 from os import path
-import sys, codecs, weakref
+import sys, codecs, weakref, threading
 import clock
 
 _packagePath = path.split(__file__)[0]
@@ -103,7 +104,8 @@ def setDefaultClock(clock):
     global defaultClock
     defaultClock = clock
 
-class _LogEntry:
+class _LogEntry(object):
+    __slots__ = ('t', 't_ms', 'level', 'levelname', 'message', 'obj')
     def __init__(self, level, message, t=None, obj=None):
         self.t=t
         self.t_ms=t*1000
@@ -111,6 +113,35 @@ class _LogEntry:
         self.levelname = getLevel(level)
         self.message=message
         self.obj=obj
+    def asDict(self):
+        """The attributes of the entry (for string formatting)"""
+        return {'t':self.t, 't_ms':self.t_ms, 'level':self.level,
+                'levelname':self.levelname, 'message':self.message,
+                'obj':self.obj}
+
+class _LogHistory(object):
+    """Keeps the most recent `maxEntries` flushed entries in a preallocated
+    ring (so memory use is bounded however long the session).
+    Iterating gives the entries oldest first.
+    """
+    def __init__(self, maxEntries):
+        self.maxEntries = maxEntries
+        self._entries = [None]*maxEntries
+        self._nAdded = 0
+    def __len__(self):
+        return min(self._nAdded, self.maxEntries)
+    def __iter__(self):
+        first = max(0, self._nAdded-self.maxEntries)
+        for ii in xrange(first, self._nAdded):
+            yield self._entries[ii % self.maxEntries]
+    def __getitem__(self, index):
+        return list(self)[index]
+    def extend(self, entries):
+        if not self.maxEntries:
+            return  # history is disabled
+        for entry in entries:
+            self._entries[self._nAdded % self.maxEntries] = entry
+            self._nAdded += 1
 
 class LogFile:
     """A text stream to receive inputs from the logging system
@@ -178,6 +209,9 @@ class _Logger:
         self.toFlush=[]
         self.format=format
         self.lowestTarget=50
+        self._flushLock = threading.Lock()
+        self._writer = None
+        self._stopWriter = threading.Event()
     def __del__(self):
         self.flush()
         # unicode logged to coder output window can cause logger failure, with
@@ -215,21 +249,69 @@ class _Logger:
     def flush(self):
         """Process all current messages to each target
         """
-        #loop through targets then entries in toFlush
-        #so that stream.flush can be called just once
-        formatted={}#keep a dict of formatted messages - so only do the formatting once
-        for target in self.targets:
-            for thisEntry in self.toFlush:
-                if thisEntry.level>=target.level:
-                    if not thisEntry in formatted:
-                        #convert the entry into a formatted string
-                        formatted[thisEntry]= self.format %thisEntry.__dict__
-                    target.write(formatted[thisEntry]+'\n')
-            if hasattr(target.stream, 'flush'):
-                target.stream.flush()
-        #finished processing entries - move them to self.flushed
-        self.flushed.extend(self.toFlush)
-        self.toFlush=[]#a new empty list
+        self._flushLock.acquire()
+        try:
+            #take the entries logged so far (others may be added meanwhile by
+            #other threads; they stay in toFlush for the next flush)
+            nEntries = len(self.toFlush)
+            if not nEntries:
+                return
+            entries = self.toFlush[:nEntries]
+            del self.toFlush[:nEntries]
+            #loop through targets then entries
+            #so that stream.flush can be called just once
+            formatted={}#keep a dict of formatted messages - so only do the formatting once
+            for target in self.targets:
+                for thisEntry in entries:
+                    if thisEntry.level>=target.level:
+                        if not thisEntry in formatted:
+                            #convert the entry into a formatted string
+                            formatted[thisEntry]= self.format %thisEntry.asDict()
+                        target.write(formatted[thisEntry]+'\n')
+                if hasattr(target.stream, 'flush'):
+                    target.stream.flush()
+            #finished processing entries - move them to self.flushed
+            self.flushed.extend(entries)
+        finally:
+            self._flushLock.release()
+    def setHistory(self, maxEntries=None):
+        """Set how many flushed entries are kept (in self.flushed).
+        None keeps all of them (the default), 0 keeps none and any other
+        number keeps that many of the most recent entries.
+        """
+        if maxEntries is None:
+            self.flushed = list(self.flushed)
+        else:
+            history = _LogHistory(maxEntries)
+            history.extend(self.flushed)
+            self.flushed = history
+    def startWriter(self, interval=0.5):
+        """Start a background thread that flushes (formats and writes)
+        entries to the targets every `interval` seconds, so that the thread
+        that logs them (e.g. drawing frames) doesn't have to.
+        """
+        if self._writer is not None:
+            self.stopWriter()
+        self._stopWriter.clear()
+        self._writer = threading.Thread(target=self._runWriter, args=(interval,))
+        self._writer.daemon = True
+        self._writer.start()
+    def stopWriter(self):
+        """Stop the background writer thread (after a final flush)
+        """
+        if self._writer is None:
+            return
+        self._stopWriter.set()
+        self._writer.join()
+        self._writer = None
+        self.flush()
+    def _runWriter(self, interval):
+        while not self._stopWriter.isSet():
+            self._stopWriter.wait(interval)
+            try:
+                self.flush()
+            except Exception:
+                pass  # e.g. a target was closed; don't kill the thread
 
 root = _Logger()
 console = LogFile()
@@ -239,6 +321,26 @@ def flush(logger=root):
     """
     logger.flush()
 
+def setHistory(maxEntries=None, logger=root):
+    """Limit the number of flushed messages kept in memory (to the most recent
+    `maxEntries`), or 0 to keep none. None (the default) keeps them all, which
+    for long sessions with messages on every frame can use a lot of memory.
+    """
+    logger.setHistory(maxEntries)
+
+def startWriter(interval=0.5, logger=root):
+    """Flush messages to the targets from a background thread every
+    `interval` secs, rather than when flush() is called, so that formatting and
+    writing the log doesn't compete with drawing. See also stopWriter()
+    """
+    logger.startWriter(interval)
+
+def stopWriter(logger=root):
+    """Stop the background writer started by startWriter(), writing any
+    remaining messages
+    """
+    logger.stopWriter()
+
 def critical(msg, t=None, obj=None):
     """log.critical(message)
     Send the message to any receiver of logging info (e.g. a LogFile) of level `log.CRITICAL` or higher
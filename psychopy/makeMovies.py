@@ -11,6 +11,7 @@ very heavily based on his code).
 """
 from psychopy import logging
 import string, time, tempfile, os, glob, random
+import threading, Queue, subprocess, shutil
 try:
     from PIL import Image, ImageChops
     from PIL.GifImagePlugin import getheader, getdata #part of PIL
@@ -30,20 +31,30 @@ import numpy
 # --------------------------------------------------------------------
 # straightforward delta encoding
 
-def makeAnimatedGIF(filename, images):
+def makeAnimatedGIF(filename, images, streaming=False):
     """Convert list of image frames to a GIF animation file
-    using simple delta coding"""
+    using simple delta coding
+
+    If streaming is True the palette is built up one frame at a time (see
+    makePaletteStreaming) and each frame is converted to it with
+    quantizeToPalette just before it is written, which is much faster and
+    needs far less memory for long or large movies."""
 
     frames = 0
     previous=None
     fp = open(filename, 'wb')
     if images[0].mode in ['RGB','RGBA']:
         #first make an optimised palette
-        optimPalette=makePalette(images, verbose=True)
+        if streaming:
+            optimPalette=makePaletteStreaming(images, verbose=True)
+        else:
+            optimPalette=makePalette(images, verbose=True)
 
     for n, im in enumerate(images):
         print 'converting frame %i of %i to GIF' %(n+1,len(images))
-        if im.mode=='RGB':
+        if streaming and im.mode in ['RGB','RGBA']:
+            im = quantizeToPalette(im, optimPalette)
+        elif im.mode=='RGB':
             im = rgb2palette(im, palette=optimPalette, verbose=False)
         if not previous:
             # global header
@@ -171,6 +182,58 @@ def makePalette(images, verbose=False):
             palette [i*3 + 2] = b
     return palette
 
+def _packRGB(pixels):
+    """Pack the RGB of an array of pixels (..., 3 or 4) into one int each"""
+    pixels = pixels.reshape([-1, pixels.shape[-1]])[:, :3].astype(numpy.uint32)
+    return (pixels[:,0]<<16) | (pixels[:,1]<<8) | pixels[:,2]
+
+def makePaletteStreaming(images, verbose=False):
+    """Like makePalette, but the color histogram is accumulated (as counts of
+    the unique colors) one image at a time rather than from a list of every
+    pixel in every image. If there are more than 256 colors the adaptive
+    palette of the first image is used.
+    """
+    if verbose:    print 'optimising palette ...'
+    codes = numpy.zeros(0, numpy.uint32)
+    counts = numpy.zeros(0)
+    for im in images:
+        frameCodes, inverse = numpy.unique(_packRGB(numpy.asarray(im)), return_inverse=True)
+        codes, inverse2 = numpy.unique(numpy.concatenate([codes, frameCodes]),
+                                       return_inverse=True)
+        counts = numpy.bincount(inverse2, weights=numpy.concatenate(
+            [counts, numpy.bincount(inverse)]))
+        if len(codes) > 256:
+            if verbose:    print '               ... too many colors'
+            adaptive = images[0].convert('RGB').convert('P', palette=Image.ADAPTIVE, colors=256)
+            return adaptive.getpalette()[:768]
+    if verbose:    print '               ... OK'
+    palette = []                        # will be [0, 0, 0, ... 255, 255, 255]
+    for i in xrange (256):
+        palette.append (i); palette.append (i); palette.append (i)
+    #most common colors first (as for makePalette)
+    order = numpy.lexsort((codes, counts))[::-1]
+    for i, code in enumerate(codes[order]):
+        palette [i*3:i*3 + 3] = [int(code>>16) & 255, int(code>>8) & 255, int(code) & 255]
+    return palette
+
+def quantizeToPalette(im, palette):
+    """Convert an RGB(A) image to a palettised ('P') image, using the nearest
+    palette entry for each color. A vectorised alternative to rgb2palette
+    that handles colors missing from the palette.
+    """
+    pixels = numpy.asarray(im)
+    codes, inverse = numpy.unique(_packRGB(pixels), return_inverse=True)
+    rgb = numpy.column_stack([(codes>>16) & 255, (codes>>8) & 255, codes & 255]).astype(int)
+    numPalette = numpy.reshape(numpy.asarray(palette[:768], int), [256,3])
+    indices = numpy.zeros(len(codes), numpy.uint8)
+    chunk = 4096  # colors at a time, to limit the size of the distance matrix
+    for start in range(0, len(codes), chunk):
+        diffs = rgb[start:start+chunk, None, :] - numPalette[None, :, :]
+        indices[start:start+chunk] = (diffs**2).sum(2).argmin(1)
+    imP = Image.fromstring('P', im.size, indices[inverse].tostring())
+    imP.putpalette(palette)
+    return imP
+
 def rgb2palette (imgRgb, palette=None, verbose=False):     # image could be a "RGBA"
     """
     Converts an RGB image to a palettised version (for saving as gif).
@@ -288,6 +351,186 @@ def makeMPEG(filename, images, codec='mpeg1video', codecParams = None, verbose=F
     fw.close()
 
 
+class FrameWriter(object):
+    """Writes frames to disk on background threads, as they are captured,
+    so that frames don't need to be kept in memory (see
+    Window.startMovieCapture() and Window.saveMovieFrames()).
+
+    Frames are either PIL images (as stored by Window.getMovieFrame()) or
+    numpy arrays of uint8 (height x width x 3 or 4, with the rows starting
+    at the bottom, as read from OpenGL). If `fileName` has a movie extension
+    (one of `movieExts`, e.g. 'stim.mp4') raw frames are piped to the
+    `encoder` command (ffmpeg by default), which needs to be installed.
+    Otherwise (e.g. 'frame.png', or any other format PIL can save) the frames
+    are saved as frame0001.png, frame0002.png... (with `nDigits` digits) by a
+    pool of `nThreads` threads.
+
+    At most `maxQueue` frames wait to be written; if the writers can't keep
+    up write() will block rather than using ever more memory.
+    """
+    movieExts = ['.mp4', '.mov', '.avi', '.mkv', '.m4v', '.webm', '.wmv', '.flv']
+
+    def __init__(self, fileName, size, fps=30, encoder='ffmpeg', maxQueue=60,
+                 nThreads=2, nDigits=4):
+        self.fileName = fileName
+        self.size = (int(size[0]), int(size[1]))
+        self.fps = fps
+        self.nFrames = 0  # frames written so far
+        self._fileRoot, self._fileExt = os.path.splitext(fileName)
+        self._nameFormat = "%s%%0%ii%s" %(self._fileRoot, nDigits, self._fileExt)
+        self._nQueued = 0
+        self._lock = threading.Lock()
+        self._pipe = None
+        if self._fileExt.lower() not in self.movieExts:
+            Image.init()  # so that all the formats PIL can save are known
+            if self._fileExt.lower() not in Image.EXTENSION:
+                raise IOError("Unknown image format for %s" %fileName)
+        else:
+            nThreads = 1  # frames must reach the encoder in order
+            cmd = [encoder, '-y', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+                   '-s', '%ix%i' %self.size, '-r', str(fps), '-i', '-',
+                   '-vf', 'vflip', '-an', fileName]
+            try:
+                self._pipe = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                              stdout=open(os.devnull, 'w'),
+                                              stderr=subprocess.STDOUT)
+            except OSError:
+                raise IOError("Could not run '%s' to write %s. Install ffmpeg "
+                              "or save frames as images (e.g. .png)" %(encoder, fileName))
+        self._queue = Queue.Queue(maxsize=maxQueue)
+        self._threads = []
+        for ii in range(nThreads):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def write(self, frame):
+        """Queue a frame (PIL image or numpy array) to be written. Returns
+        the frame number (starting at 1)
+        """
+        self._nQueued += 1
+        self._queue.put((self._nQueued, frame))
+        return self._nQueued
+
+    def getFileName(self, frameN):
+        """The name of the image file that frame number `frameN` is saved as
+        """
+        return self._nameFormat %frameN
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            frameN, frame = item
+            try:
+                self._writeFrame(frameN, frame)
+            except Exception, err:
+                logging.error("Failed to write movie frame %i: %s" %(frameN, err))
+            self._lock.acquire()
+            self.nFrames += 1
+            self._lock.release()
+
+    def _writeFrame(self, frameN, frame):
+        if self._pipe is not None:
+            if isinstance(frame, numpy.ndarray):
+                if frame.shape[2] == 3:  # the encoder was told to expect rgba
+                    frame = numpy.dstack([frame, numpy.zeros(frame.shape[:2], numpy.uint8)+255])
+            else:  # PIL images are stored top row first
+                frame = numpy.asarray(frame.convert('RGBA'))[::-1]
+            self._pipe.stdin.write(frame.tostring())
+        else:
+            if isinstance(frame, numpy.ndarray):
+                frame = Image.fromarray(numpy.ascontiguousarray(frame[::-1, :, :3]), 'RGB')
+            frame.save(self.getFileName(frameN))
+
+    def close(self):
+        """Write any frames still waiting and then stop (waits until done)
+        """
+        if not self._threads:
+            return
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._pipe is not None:
+            self._pipe.stdin.close()
+            self._pipe.wait()
+            self._pipe = None
+        logging.info('wrote %i frames to %s' %(self.nFrames, self.fileName))
+
+
+class FrameSpool(object):
+    """A list of frames (PIL images), as captured by Window.getMovieFrame(),
+    that are kept in temporary files rather than in memory.
+
+    Frames are written to uncompressed .bmp files by a FrameWriter as they
+    are appended, and read back one at a time when they are indexed or
+    iterated over, so memory use doesn't grow with the number of frames.
+    clear() deletes the files.
+    """
+    def __init__(self, frames=(), maxQueue=30):
+        self._maxQueue = maxQueue
+        self._dir = None
+        self._fileNames = []
+        self._writer = None
+        self._nWriters = 0
+        for frame in frames:
+            self.append(frame)
+
+    def append(self, frame):
+        if self._writer is None:
+            if self._dir is None:
+                self._dir = tempfile.mkdtemp(prefix='psychopy-frames')
+            #each writer numbers its frames from 1, so give each its own names
+            self._nWriters += 1
+            fileName = os.path.join(self._dir, 'part%i_.bmp' %self._nWriters)
+            self._writer = FrameWriter(fileName, frame.size,
+                                       maxQueue=self._maxQueue, nDigits=6)
+        frameN = self._writer.write(frame)
+        self._fileNames.append(self._writer.getFileName(frameN))
+
+    def _flush(self):
+        """Wait until all the appended frames are on disk
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _load(self, fileName):
+        im = Image.open(fileName)
+        im.load()
+        return im
+
+    def __len__(self):
+        return len(self._fileNames)
+
+    def __getitem__(self, index):
+        self._flush()
+        if isinstance(index, slice):
+            return [self._load(fileName) for fileName in self._fileNames[index]]
+        return self._load(self._fileNames[index])
+
+    def __iter__(self):
+        self._flush()
+        for fileName in list(self._fileNames):
+            yield self._load(fileName)
+
+    def clear(self):
+        """Forget all the frames and delete their files
+        """
+        self._flush()
+        self._fileNames = []
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+
+    def __del__(self):
+        self.clear()
+
+
 qtCodecQuality= {
   'lossless':   0x00000400,
   'max':        0x000003FF,
@@ -1,5 +1,6 @@
 import sys, os, copy
-from psychopy import visual, monitors, filters, prefs
+from psychopy import visual, monitors, filters, prefs, makeMovies
+from psychopy.visual import _offscreen
 from psychopy.tools.coordinatetools import pol2cart
 from psychopy.tests import utils
 import numpy
@@ -29,9 +30,32 @@ class Test_Window:
             stim.setPhase(0.3,'+')
             self.win.flip()
             self.win.getMovieFrame()
+        #the frames are kept in temporary files, not in memory
+        assert isinstance(self.win.movieFrames, makeMovies.FrameSpool)
+        assert self.win.movieFrames[-1].size == tuple(self.win.size)
+        self.win.saveMovieFrames(os.path.join(self.temp_dir, 'junkFrames.gif'),
+                                 clearFrames=False)
+        assert len(self.win.movieFrames) == 3
+        #any format PIL can save is still saved as images
+        self.win.saveMovieFrames(os.path.join(self.temp_dir, 'junkFrames.ppm'),
+                                 clearFrames=False)
+        assert os.path.isfile(os.path.join(self.temp_dir, 'junkFrames3.ppm'))
         self.win.saveMovieFrames(os.path.join(self.temp_dir, 'junkFrames.png'))
-        self.win.saveMovieFrames(os.path.join(self.temp_dir, 'junkFrames.gif'))
+        assert len(self.win.movieFrames) == 0
+        assert os.path.isfile(os.path.join(self.temp_dir, 'junkFrames3.png'))
         region = self.win._getRegionOfFrame()
+    def test_asyncMovieCapture(self):
+        stim = visual.GratingStim(self.win, dkl=[0,0,1], autoLog=False)
+        stim.setAutoDraw(True)
+        self.win.startMovieCapture(os.path.join(self.temp_dir, 'junkAsync.png'))
+        for frameN in range(5):
+            stim.setPhase(0.3,'+')
+            self.win.flip()
+            self.win.getMovieFrame()
+        assert self.win.stopMovieCapture() == 5
+        stim.setAutoDraw(False)
+        assert len(self.win.movieFrames) == 0
+        assert os.path.isfile(os.path.join(self.temp_dir, 'junkAsync0005.png'))
     def test_multiFlip(self):
         self.win.setRecordFrameIntervals(False) #does a reset
         self.win.setRecordFrameIntervals(True)
@@ -44,6 +68,78 @@ class Test_Window:
             assert val==2
         self.win.callOnFlip(assertThisIs2, 2)
         self.win.flip()
+    def test_textureCache(self):
+        win = visual.Window([128,128], pos=[50,50], allowGUI=False,
+                            textureCacheMB=16, autoLog=False)
+        fileName = os.path.join(utils.TESTS_DATA_PATH, 'testimage.jpg')
+        image = visual.ImageStim(win, fileName, mask='circle', autoLog=False)
+        misses = win.textureCache.misses
+        image.setImage(fileName)  # same file so should just rebind
+        image.setMask('circle')
+        assert win.textureCache.misses == misses
+        assert win.textureCache.hits >= 2
+        #a preloaded copy is dropped when the texture comes from the cache
+        image.preload(fileName)
+        image.setImage(fileName)
+        assert len(win.imagePreloader) == 0
+        image.draw()
+        image.clearTextures()
+        win.textureCache.clear()
+        assert len(win.textureCache) == 0
+        win.close()
+    def test_preloadImages(self):
+        fileName = os.path.join(utils.TESTS_DATA_PATH, 'testimage.jpg')
+        image = visual.ImageStim(self.win, autoLog=False)
+        image.preload(fileName)
+        assert len(self.win.imagePreloader) == 1
+        image.setImage(fileName)  # uses (and discards) the preloaded data
+        assert len(self.win.imagePreloader) == 0
+        assert image._origSize is not None
+        image.draw()
+    def test_frameProfile(self):
+        stim = visual.GratingStim(self.win, name='grating', autoLog=False)
+        stim.setAutoDraw(True)
+        self.win.setRecordFrameProfile(True, nFrames=5)
+        for frameN in range(8):
+            self.win.flip()
+        stim.setAutoDraw(False)
+        self.win.setRecordFrameProfile(False)
+        profile = self.win.frameProfiler.getProfile()
+        assert list(profile['frameN']) == range(3,8)
+        assert profile['stimNames'][-1] == ('grating',)
+        assert (profile['swap'] >= 0).all()
+        fileName = os.path.join(self.temp_dir, 'junkFrameProfile.csv')
+        self.win.saveFrameProfile(fileName)
+        lines = open(fileName).readlines()
+        assert len(lines) == 6  # header and 5 frames
+        assert lines[0].startswith('frameN,t,interval,draw')
+        assert len(self.win.frameProfiler) == 0
+
+def test_frameProfilerQueryBlocks(monkeypatch):
+    """With maxStims autoDraw stimuli each frame uses a whole block of GPU
+    timer queries (without a GL context, by recording the query ids used)
+    """
+    from psychopy.visual import helpers
+    used = []
+    monkeypatch.setattr(helpers.GL, 'glQueryCounter',
+                        lambda queryID, target: used.append(queryID), raising=False)
+    profiler = helpers.FrameProfiler(nFrames=10, maxStims=4, gpuTimers=False)
+    nBlocks = profiler.gpuLag+1
+    blockSize = profiler._queryBlockSize
+    profiler.useGPU = True
+    profiler._queryIDs = range(blockSize*nBlocks)
+    profiler._nQueries = [0]*nBlocks
+    monkeypatch.setattr(profiler, '_readQueries', lambda frameN: None)
+    for frameN in range(nBlocks+1):
+        del used[:]
+        profiler.beginFrame()
+        for stimN in range(profiler.maxStims):
+            profiler.endStim(object())
+        profiler.endPhase('draw')
+        profiler.endPhase('blit')
+        profiler.endFrame(frameN*0.01)
+        block = frameN % nBlocks
+        assert used == range(block*blockSize, (block+1)*blockSize)
 
 class _baseVisualTest:
     #this class allows others to be created that inherit all the tests for
@@ -131,8 +227,8 @@ class _baseVisualTest:
     #    utils.compareScreenshot('gabor1_%s.png' %(contextName), win)
     def test_text(self):
         win = self.win
-        if self.win.winType=='pygame':
-            pytest.skip("Text is different on pygame")
+        if self.win.winType in ['pygame', 'offscreen']:
+            pytest.skip("Text is different on pygame (also used for offscreen)")
         #set font
         fontFile = os.path.join(prefs.paths['resources'], 'DejaVuSerif.ttf')
         #using init
@@ -163,7 +259,7 @@ class _baseVisualTest:
     @pytest.mark.needs_sound
     def test_mov(self):
         win = self.win
-        if self.win.winType=='pygame':
+        if self.win.winType!='pyglet':
             pytest.skip("movies only available for pyglet backend")
         win.flip()
         #construct full path to the movie file
@@ -304,6 +400,22 @@ class _baseVisualTest:
             "dots._signalDots failed to change after dots.setCoherence()"
         assert not numpy.alltrue(prevVerticesPix==dots.verticesPix), \
             "dots.verticesPix failed to change after dots.setPos()"
+    def test_dots_element_array(self):
+        win = self.win
+        if not win._haveShaders or utils._under_xvfb:
+            pytest.skip("ElementArray requires shaders, which aren't available")
+        N = 200
+        elements = visual.ElementArrayStim(win, nElements=N, sizes=0.05*self.scaleFactor,
+            elementTex='sin', elementMask='gauss', autoLog=False)
+        elements.setColors(numpy.random.uniform(-1, 1, [N, 3]), log=False)
+        elements.setOpacities(numpy.random.uniform(0, 1, N), log=False)
+        dots = visual.DotStim(win, nDots=N, fieldSize=1*self.scaleFactor,
+            speed=0.01*self.scaleFactor, element=elements, autoLog=False)
+        dots.draw()
+        win.flip()
+        assert numpy.allclose(elements.xys, dots._verticesBase)
+        with pytest.raises(ValueError):
+            visual.DotStim(win, nDots=N+1, element=elements, autoLog=False)
     def test_element_array(self):
         win = self.win
         if not win._haveShaders or utils._under_xvfb:
@@ -322,6 +434,36 @@ class _baseVisualTest:
         spiral.draw()
         utils.compareScreenshot('elarray1_%s.png' %(self.contextName), win)
         win.flip()
+        #the same array from vertex buffer objects should look identical
+        spiral = visual.ElementArrayStim(win, nElements=N,sizes=0.5*self.scaleFactor,
+            sfs=3.0, xys=xys, oris=-thetas, useVBO=True, autoLog=False)
+        spiral.draw()
+        utils.compareScreenshot('elarray1_%s.png' %(self.contextName), win)
+        win.flip()
+    def test_element_array_indices(self):
+        win = self.win
+        if not win._haveShaders or utils._under_xvfb:
+            pytest.skip("ElementArray requires shaders, which aren't available")
+        N=10
+        partial = visual.ElementArrayStim(win, nElements=N, sizes=0.2*self.scaleFactor,
+            xys=numpy.zeros([N,2]), oris=0, autoLog=False)
+        partial.draw()
+        #change a subset of elements, which should only update those
+        partial.setOris(45, indices=[2,5])
+        partial.setSizes([0.1*self.scaleFactor,0.3*self.scaleFactor], indices=[2,5])
+        partial.setXYs(0.1*self.scaleFactor, operation='+', indices=[5])
+        partial.setOpacities(0.5, indices=[3])
+        assert partial._dirtyElements['vertices'] == set([2,5])
+        partial.draw()
+        assert not partial._dirtyElements['vertices']
+        #compare to the same stimulus updated in full
+        full = visual.ElementArrayStim(win, nElements=N, sizes=partial.sizes,
+            xys=partial.xys, oris=partial.oris, opacities=partial.opacities, autoLog=False)
+        full.draw()
+        assert numpy.allclose(partial.verticesPix, full.verticesPix)
+        assert numpy.allclose(partial._RGBAs, full._RGBAs)
+        assert numpy.allclose(partial._texCoords, full._texCoords)
+        win.flip()
     def test_aperture(self):
         win = self.win
         if not win.allowStencil:
@@ -338,8 +480,8 @@ class _baseVisualTest:
         utils.compareScreenshot('aperture1_%s.png' %(self.contextName), win)
         #aperture should automatically disable on exit
     def test_rating_scale(self):
-        if self.win.winType=='pygame':
-            pytest.skip("RatingScale not available on pygame")
+        if self.win.winType in ['pygame', 'offscreen']:
+            pytest.skip("RatingScale not available on pygame (or offscreen)")
         # try to avoid text; avoid default / 'triangle' because it does not display on win XP
         win = self.win
         win.flip()
@@ -353,6 +495,8 @@ class _baseVisualTest:
     def test_refresh_rate(self):
         if self.win.winType=='pygame':
             pytest.skip("getMsPerFrame seems to crash the testing of pygame")
+        if self.win.winType=='offscreen':
+            pytest.skip("offscreen windows have no refresh rate")
         #make sure that we're successfully syncing to the frame rate
         msPFavg, msPFstd, msPFmed = visual.getMsPerFrame(self.win,nFrames=60, showVisual=True)
         utils.skip_under_xvfb()             # skip late so we smoke test the code
@@ -440,6 +584,14 @@ class TestPygletDegFlatPos(_baseVisualTest):
             units='degFlatPos', autoLog=False)
         self.contextName='degFlatPos'
         self.scaleFactor=4#applied to size/pos values
+class TestOffscreenNorm(_baseVisualTest):
+    @classmethod
+    def setup_class(self):
+        if not _offscreen.haveOSMesa:
+            pytest.skip("offscreen windows need the OSMesa library")
+        self.win = visual.Window([128,128], winType='offscreen', allowStencil=True, autoLog=False)
+        self.contextName='norm'
+        self.scaleFactor=1#applied to size/pos values
 class TestPygameNorm(_baseVisualTest):
     @classmethod
     def setup_class(self):
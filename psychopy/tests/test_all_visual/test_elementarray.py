@@ -0,0 +1,36 @@
+from psychopy import visual
+import numpy
+
+"""Tests of ElementArrayStim calculations that need no window (or GL context)
+"""
+
+def _elementArray(nElements, **attribs):
+    #bypass __init__, which needs a window
+    stim = visual.ElementArrayStim.__new__(visual.ElementArrayStim)
+    stim.__dict__.update(nElements=nElements, units='pix', win=None,
+        useVBO=False, fieldPos=numpy.array([0.0, 0.0]), fieldDepth=0,
+        depths=0, sizes=numpy.ones([nElements, 2])*10,
+        oris=numpy.zeros(nElements), xys=numpy.zeros([nElements, 2]),
+        _dirtyElements={'vertices': set(), 'colors': set(), 'texCoords': set()})
+    stim.__dict__.update(attribs)
+    return stim
+
+def test_updateVertices_defaultDepths():
+    N = 10
+    stim = _elementArray(N, fieldDepth=2)
+    stim._updateVertices()
+    assert stim.verticesPix.shape == (N, 4, 3)
+    assert (stim.verticesPix[:,:,2] == 2).all()
+    #and for a subset of the elements
+    stim.__dict__['fieldDepth'] = 3
+    stim._updateVertices(indices=numpy.array([1, 4]))
+    assert (stim.verticesPix[[1, 4],:,2] == 3).all()
+    assert (stim.verticesPix[0,:,2] == 2).all()
+
+def test_updateVertices_perElementDepths():
+    N = 5
+    stim = _elementArray(N, depths=numpy.arange(N))
+    stim._updateVertices()
+    assert (stim.verticesPix[:,:,2] == numpy.arange(N)[:,None]).all()
+    stim._updateVertices(indices=numpy.array([3]))
+    assert (stim.verticesPix[3,:,2] == 3).all()
@@ -1,5 +1,7 @@
 from psychopy import data, logging
+from psychopy.tools.filetools import fromFile
 from numpy import random
+import numpy
 import os, glob, shutil
 logging.console.setLevel(logging.DEBUG)
 
@@ -61,5 +63,147 @@ def test_ExperimentHandler():
     #    print e
     #print 'done'
 
+def test_streamData():
+    fileRoot = os.path.join(tmpFile, 'streamed')
+    exp = data.ExperimentHandler(name='testExp', savePickle=False,
+                    saveWideText=False, dataFileName=fileRoot,
+                    streamData=True)
+    exp.addData('rt', 0.5)
+    exp.nextEntry()
+    exp.addData('rt', 0.6)
+    exp.addData('resp', 'a, b')  # a new name, partway through
+    exp.nextEntry()
+    assert exp.entries == []
+    exp.saveAsWideText(fileRoot+'.csv')
+    lines = open(fileRoot+'.csv').read().splitlines()
+    assert lines == ['rt,resp,', '0.5,,', '0.6,"a, b",']
+    assert os.path.exists(fileRoot+'_stream.csv')
+    del exp  # data were saved so the stream files go
+    assert not os.path.exists(fileRoot+'_stream.csv')
+
+def test_streamDataQuotes():
+    fileRoot = os.path.join(tmpFile, 'streamedQuotes')
+    exp = data.ExperimentHandler(name='testExp', savePickle=False,
+                    saveWideText=False, dataFileName=fileRoot,
+                    streamData=True, autoLog=False)
+    exp.addData('resp', 'He said "hi", ok')
+    exp.addData('word', '"x"')
+    exp.nextEntry()
+    assert exp._stream.getColumns(['resp', 'word']) == \
+        [[u'He said "hi", ok'], [u'"x"']]
+    exp.saveAsWideText(fileRoot+'.csv')
+    lines = open(fileRoot+'.csv').read().splitlines()
+    #as saved without streaming
+    assert lines == ['resp,word,', '"He said "hi", ok","x",']
+
+def test_streamDataAddedAfterSave():
+    fileRoot = os.path.join(tmpFile, 'streamedLate')
+    exp = data.ExperimentHandler(name='testExp', savePickle=False,
+                    dataFileName=fileRoot, streamData=True, autoLog=False)
+    exp.addData('rt', 0.5)
+    exp.nextEntry()
+    exp.saveAsWideText(fileRoot+'_mid.npz')
+    exp.addData('rt', 0.6)
+    exp.nextEntry()
+    del exp  # the second entry is only in the stream file, so it's kept
+    lines = open(fileRoot+'_stream.csv').read().splitlines()
+    assert lines == ['0.5,', '0.6,']
+
+def test_streamDataAbort():
+    fileRoot = os.path.join(tmpFile, 'streamedAbort')
+    exp = data.ExperimentHandler(name='testExp', savePickle=False,
+                    dataFileName=fileRoot, streamData=True, autoLog=False)
+    exp.addData('rt', 0.5)
+    exp.nextEntry()
+    exp.abort()
+    del exp
+    assert os.path.exists(fileRoot+'_stream.csv')
+    assert not os.path.exists(fileRoot+'.csv')
+
+def test_saveAsColumns():
+    fileRoot = os.path.join(tmpFile, 'columns')
+    exp = data.ExperimentHandler(name='testExp', savePickle=False,
+                    saveWideText=False, extraInfo={'participant':'jwp'},
+                    autoLog=False)
+    for rowN in range(5):
+        exp.addData('rt', rowN*0.1)
+        exp.addData('corr', rowN%2)
+        if rowN == 3:
+            exp.addData('note', u'caf\xe9')
+        exp.nextEntry()
+    fileName = exp.saveAsColumns(fileRoot)
+    assert fileName == fileRoot+'.psycol'
+    dat = data.ColumnDataFile(fileName)
+    assert dat.nRows == 5
+    assert dat.info['extraInfo'] == {'participant':'jwp'}
+    assert isinstance(dat['rt'], numpy.memmap)
+    assert numpy.allclose(dat['rt'], [0, 0.1, 0.2, 0.3, 0.4])
+    assert dat['corr'].dtype.kind == 'i'
+    assert list(dat['note']) == [u'', u'', u'', u'caf\xe9', u'']
+    assert list(dat['participant']) == [u'jwp']*5
+    #append another session, trial by trial with missing values
+    writer = data.ColumnDataWriter(fileName, appendFile=True, rowsPerBlock=2)
+    writer.addRow({'rt': 0.5})
+    writer.addRow({'rt': 0.6, 'corr': 1})
+    writer.addRow({'extra': 'x'})
+    writer.close()
+    dat = fromFile(fileName)
+    assert dat.nRows == 8
+    assert numpy.allclose(dat['rt'][:7], [0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6])
+    assert numpy.isnan(dat['corr'][5]) and dat['corr'][6] == 1
+    assert list(dat['extra']) == [u'']*7+[u'x']
+    #a crash while writing a block leaves the earlier rows readable
+    f = open(fileName, 'ab')
+    f.write('ROWS\x10')
+    f.close()
+    assert data.ColumnDataFile(fileName).nRows == 8
+
+def test_convertPsydat():
+    fileRoot = os.path.join(tmpFile, 'legacy')
+    conds = data.createFactorialTrialList({'ori':[0, 90]})
+    trials = data.TrialHandler(conds, nReps=2, method='sequential', autoLog=False)
+    for trial in trials:
+        trials.addData('resp', trial.ori/90)
+    trials.saveAsPickle(fileRoot)
+    newFileName = data.convertPsydat(fileRoot+'.psydat')
+    assert newFileName == fileRoot+'.psycol'
+    dat = data.ColumnDataFile(newFileName)
+    assert dat.info['handler'] == 'TrialHandler'
+    assert list(dat['ori']) == [0, 90, 0, 90]
+    assert list(dat['resp']) == [0, 1, 0, 1]
+
+def test_mergeSessions():
+    folder = os.path.join(tmpFile, 'sessions')
+    os.mkdir(folder)
+    def runSession(participant, fileType='psydat'):
+        exp = data.ExperimentHandler(name='testExp', savePickle=False,
+                        saveWideText=False, autoLog=False,
+                        extraInfo={'participant':participant, 'session':1})
+        for rowN in range(3):
+            exp.addData('rt', 0.5+rowN)
+            exp.nextEntry()
+        fileRoot = os.path.join(folder, participant)
+        if fileType == 'csv':
+            exp.saveAsWideText(fileRoot+'.csv')
+        else:
+            exp.saveAsPickle(fileRoot)
+    runSession('a')
+    runSession('b', 'csv')
+    dat = data.mergeSessions(folder, pattern=['*.psydat', '*.csv'])
+    assert dat.nRows == 6
+    assert sorted(set(dat['participant'])) == ['a', 'b']
+    assert numpy.allclose(dat['rt'], [0.5, 1.5, 2.5]*2)
+    assert list(dat['sessionFile']) == ['a.psydat']*3 + ['b.csv']*3
+    #a new session is added to the cache
+    runSession('c')
+    dat = data.mergeSessions(folder, pattern=['*.psydat', '*.csv'], nProcesses=2)
+    assert dat.nRows == 9
+    assert list(dat['participant'][6:]) == ['c']*3
+    #and the cache is rebuilt if a session is removed
+    os.remove(os.path.join(folder, 'a.psydat'))
+    dat = data.mergeSessions(folder, pattern=['*.psydat', '*.csv'])
+    assert sorted(set(dat['participant'])) == ['b', 'c']
+    assert dat.nRows == 6
+
 if __name__=='__main__':
     test_ExperimentHandler()
@@ -4,6 +4,7 @@ from os.path import join as pjoin
 import shutil
 from pytest import raises
 from tempfile import mkdtemp
+import numpy
 from numpy.random import random
 
 from psychopy import data
@@ -144,6 +145,97 @@ class TestTrialHandler:
         trials.saveAsWideText(pjoin(self.temp_dir, 'testRandom.csv'), delim=',', appendFile=False)#this omits values
         utils.compareTextFiles(pjoin(self.temp_dir, 'testRandom.csv'), pjoin(fixturesPath,'corrRandom.csv'))
 
+    def test_wideText_binary(self):
+        conditions = [{'trialType':trialType} for trialType in range(5)]
+        trials = data.TrialHandler(trialList=conditions, seed=100, nReps=3,
+                                   method='random', autoLog=False)
+        for thisTrial in trials:
+            trials.addData('resp', 'resp'+str(thisTrial['trialType']))
+        trials.saveAsWideText(pjoin(self.temp_dir, 'testWide.csv'), delim=',', appendFile=False)
+        trials.saveAsWideText(pjoin(self.temp_dir, 'testWide.npz'))
+        rows = open(pjoin(self.temp_dir, 'testWide.csv')).read().splitlines()
+        saved = numpy.load(pjoin(self.temp_dir, 'testWide.npz'))
+        assert list(saved['TrialNumber']) == range(1, 16)
+        assert [row.split(',')[1] for row in rows[1:]] == [str(val) for val in saved['trialType']]
+        assert [row.split(',')[-1] for row in rows[1:]] == list(saved['resp'])
+
+    def test_lazySequence(self):
+        #the orders match those from shuffling every rep in advance (as before)
+        for method in ['random', 'fullRandom', 'sequential']:
+            trials = data.TrialHandler(trialList=range(6), nReps=4, method=method,
+                                       seed=12, autoLog=False)
+            afterTrials = numpy.random.random()
+            if method == 'random':
+                numpy.random.seed(12)
+                expected = numpy.transpose([numpy.argsort(numpy.random.random(6))
+                                            for repN in range(4)])
+            elif method == 'fullRandom':
+                numpy.random.seed(12)
+                flat = numpy.repeat(numpy.arange(6), 4)
+                expected = flat[numpy.argsort(numpy.random.random(24))].reshape(6, 4)
+            else:
+                expected = numpy.repeat(numpy.arange(6)[:,None], 4, 1)
+            if method != 'sequential':
+                assert afterTrials == numpy.random.random()  # global state as before
+            assert numpy.all(numpy.array(trials.sequenceIndices) == expected)
+            order = [trials.thisIndex for trial in trials]
+            assert order == list(expected.transpose().flat)
+
+    def test_sequenceAsArray(self):
+        import cPickle
+        trials = data.TrialHandler(trialList=range(3), nReps=2, method='random',
+                                   seed=3, autoLog=False)
+        seq = trials.sequenceIndices
+        expected = numpy.array(seq)
+        assert seq.shape == (3, 2)
+        assert seq.tolist() == expected.tolist()
+        assert list(seq.flat) == list(expected.flat)
+        assert numpy.all(seq.T == expected.T)
+        assert numpy.all(seq+1 == expected+1)
+        assert numpy.all(2*seq == expected*2)
+        #psydat files keep the array, as before
+        pickled = cPickle.dumps(trials)
+        assert '_TrialSequence' not in pickled
+        assert numpy.all(cPickle.loads(pickled).sequenceIndices == expected)
+        assert isinstance(trials.sequenceIndices, data._TrialSequence)
+
+    def test_lazyFactorial(self):
+        factors = {'ori':range(0, 360, 45), 'sf':[1, 2, 4], 'col':['r', 'g']}
+        lazy = data.createFactorialTrialList(factors, lazy=True)
+        full = data.createFactorialTrialList(factors)
+        assert len(lazy) == len(full) == 48
+        assert list(lazy) == full and lazy[-1] == full[-1]
+        trials = data.TrialHandler(trialList=lazy, nReps=1, method='sequential',
+                                   autoLog=False)
+        assert [trial for trial in trials] == full
+
+class TestDataHandler:
+    def test_growAndMixedTypes(self):
+        dat = data.DataHandler(dataShape=[2, 3])
+        dat.add('rt', 0.5, position=[0, 0])
+        dat.add('rt', 0.25, position=[1, 10])  # beyond the original shape
+        assert dat['rt'].shape == (2, 11)
+        assert dat['rt'][1, 10] == 0.25
+        assert dat['rt'].mask.sum() == 2*11-2
+        dat.add('rt', 'slow', position=[0, 1])  # non-numeric, in its own storage
+        assert dat.isNumeric['rt'] == False
+        assert dat['rt'].dtype == object
+        assert list(dat['rt'][0, :3]) == [0.5, 'slow', '--']
+        assert dat['rt'][1, 10] == 0.25
+
+    def test_pickle(self):
+        import cPickle
+        dat = data.DataHandler(dataShape=[2, 3])
+        dat.add('resp', 'left', position=[1, 2])
+        for protocol in [0, 2]:
+            pickled = cPickle.dumps(dat, protocol)
+            assert '_DataColumn' not in pickled  # readable by older versions
+            loaded = cPickle.loads(pickled)
+            assert loaded['resp'][1, 2] == 'left'
+            loaded.add('resp', 'right', position=[0, 0])
+            assert loaded['resp'][0, 0] == 'right'
+            assert loaded['resp'][1, 2] == 'left'
+
 class TestMultiStairs:
     def setup_class(self):
         self.temp_dir = mkdtemp(prefix='psychopy-tests-testdata')
@@ -3,6 +3,7 @@ import os, shutil
 import numpy
 
 from openpyxl.reader.excel import load_workbook
+import psychopy
 from psychopy import data
 from psychopy.tests import utils
 from tempfile import mkdtemp
@@ -52,6 +53,30 @@ def test_TrialTypeImport():
                 print header, trialCSV[header], trialXLSX[header]
             assert trialXLSX[header] == trialCSV[header]
 
+def test_csvConditions(monkeypatch):
+    tmpDir = mkdtemp(prefix='psychopy-tests-testdata')
+    #keep the conditions cache out of the real prefs folder
+    monkeypatch.setitem(psychopy.prefs.paths, 'userPrefsDir', tmpDir)
+    fileName = os.path.join(tmpDir, 'conds.csv')
+    f = open(fileName, 'wb')
+    f.write('ori,pos,label,ok\n')
+    f.write('45,"[1, 2]","a, b",True\n')
+    f.write('90,(3),__import__,False\n')
+    f.close()
+    conds, names = data.importConditions(fileName, returnFieldNames=True)
+    assert names == ['ori', 'pos', 'label', 'ok']
+    assert conds[0] == {'ori':45, 'pos':[1, 2], 'label':u'a, b', 'ok':True}
+    assert conds[1]['pos'] == u'(3)' and conds[1]['label'] == u'__import__'
+    #nothing is cached unless asked for
+    cacheFileName = data._getConditionsCacheFileName(fileName)
+    assert cacheFileName.startswith(tmpDir)
+    assert not os.path.exists(cacheFileName)
+    #the second import comes from the cache
+    cached = data.importConditions(fileName, useCache=True)
+    assert os.path.isfile(cacheFileName)
+    assert data.importConditions(fileName, useCache=True) == cached == conds
+    shutil.rmtree(tmpDir)
+
 if __name__=='__main__':
     t=TestXLSX()
     t.setup_class()
@@ -86,6 +86,40 @@ def test_logistic():
     if PLOTTING:
         plotFit(modResps, thresh, 'Logistic (thresh=%.2f, params=%s)' %(fit.inverse(0.75), fit.params))
 
+def test_bootstrapCI():
+    fit = data.FitCumNormal(contrasts, responses, display=0, expectedMin=0.5)
+    nTrials = [40]*len(contrasts)
+    lower, upper = fit.bootstrapCI(n=200, nTrials=nTrials, seed=1)
+    assert numpy.all(lower <= fit.params) and numpy.all(fit.params <= upper)
+    assert fit.bootstrapParams.shape == (200, 2)
+    #the same seed gives the same resamples
+    lower2, upper2 = fit.bootstrapCI(n=200, nTrials=nTrials, seed=1, chunkSize=64)
+    assert numpy.allclose(lower, lower2) and numpy.allclose(upper, upper2)
+
+def test_resampling():
+    dat = numpy.array([[1,2,3,4],[5,6,7,8]])
+    resamples = data.bootStraps(dat, n=50, seed=1)
+    assert resamples.shape == (2,4,50)
+    assert set(resamples[0].flat) <= set(dat[0]) and set(resamples[1].flat) <= set(dat[1])
+    assert numpy.all(resamples == data.bootStraps(dat, n=50, seed=1))
+    p, diff = data.permutationTest([1,2,3,4,5], [11,12,13,14,15], n=2000, seed=1)
+    assert diff == -10 and p < 0.05
+    p, diff = data.permutationTest([1,2,3,4,5], [1,2,3,4,5], n=2000, seed=1)
+    assert p == 1.0
+
+def test_batchFit():
+    #three data sets: the cum norm data with different thresholds, one shorter
+    xx = [contrasts, contrasts+0.1, contrasts[:7]]
+    yy = [responses, responses, responses[:7]]
+    results = data.batchFit(data.FitCumNormal, xx, yy, expectedMin=0.5)
+    assert results['converged'].all()
+    assert numpy.allclose(results['params'], [[thresh, sd], [thresh+0.1, sd], [thresh, sd]],
+                          atol=1e-4)
+    single = data.FitWeibull(contrasts, responses, display=0, expectedMin=0.5)
+    results = data.batchFit(data.FitWeibull, [contrasts]*3, [responses]*3,
+                            guess=single.params*1.2)
+    assert numpy.allclose(results['params'], single.params, rtol=1e-3)
+
 def teardown():
     if PLOTTING:
         pylab.show()
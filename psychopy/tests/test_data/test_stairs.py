@@ -75,3 +75,42 @@ def makeBasicResponseCycles():
         for nWrong in range(4):
             responsesToMake.append(0)
     return responsesToMake
+
+def test_questBatch():
+    from psychopy.contrib.quest import QuestObject, QuestBatch
+    quest = QuestObject(-1.0, 0.5, 0.82, 3.5, 0.01, 0.5)
+    batch = QuestBatch(quest, 3)
+    intensities = [-1.0, -0.8, -1.2, -1.3, -0.9, 5.0]
+    responses = [1, 1, 0, 0, 1, 1]
+    for intensity, response in zip(intensities, responses):
+        quest.update(intensity, response)
+        batch.update([intensity]*3, [response]*3)
+    #the batch (and a pdf recomputed from the trials) match the trial-by-trial pdf
+    assert np.allclose(batch.mean(), quest.mean())
+    assert np.allclose(batch.sd(), quest.sd())
+    assert np.allclose(batch.mode(), quest.mode()[0])
+    assert np.allclose(batch.quantile(), quest.quantile(), atol=quest.grain)
+    pdf = quest.pdf.copy()
+    quest.recompute()
+    assert np.allclose(quest.pdf/quest.pdf.sum(), pdf/pdf.sum())
+
+def test_questRecomputeLongHistory():
+    from psychopy.contrib.quest import QuestObject
+    quest = QuestObject(-1.0, 0.5, 0.82, 3.5, 0.01, 0.5)
+    quest.normalizePdf = True
+    rng = np.random.RandomState(1)
+    for trialN in range(2000):
+        quest.update(quest.quantile(), int(rng.rand() < 0.82))
+    #the likelihood of this many trials underflows unless it is scaled
+    pdf = quest.pdf.copy()
+    quest.recompute()
+    assert np.isfinite(quest.pdf).all()
+    assert np.allclose(quest.pdf, pdf)
+    assert np.allclose(quest.mean(), quest.tGuess+np.sum(pdf*quest.x))
+
+def test_questSimulateRuns():
+    stairs = data.QuestHandler(0.1, 0.5, nTrials=30, stepType='lin', autoLog=False)
+    estimates = stairs.simulateRuns(500, tActual=0.3, seed=1)
+    assert estimates.shape == (500,)
+    assert abs(np.median(estimates)-0.3) < 0.1
+    assert np.allclose(estimates, stairs.simulateRuns(500, tActual=0.3, seed=1))
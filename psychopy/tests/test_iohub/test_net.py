@@ -0,0 +1,133 @@
+import msgpack
+import numpy as np
+
+from psychopy.iohub import EventConstants
+from psychopy.iohub.net import SharedEventBuffer, eventArrayDType, \
+    packEventArrays, unpackEventArrays, eventQuery, queryEvents, \
+    filteredEventTypes
+from psychopy.iohub.devices.keyboard import KeyboardPressEvent, KeyboardCharEvent
+from psychopy.iohub.devices.experiment import MessageEvent
+
+
+def _eventValues(event_class, **values):
+    values.setdefault('type', event_class.EVENT_TYPE_ID)
+    return [values.get(name, 0) for name in event_class.CLASS_ATTRIBUTE_NAMES]
+
+def _charEvent(event_id, time, key):
+    press = _eventValues(KeyboardPressEvent, event_id=event_id, time=time,
+                         key=key)
+    return _eventValues(KeyboardCharEvent, event_id=event_id + 1,
+                        time=time + 0.1, key=key, press_event=press,
+                        duration=0.1)
+
+
+class TestSharedEventBuffer:
+    def setup(self):
+        self.writer = SharedEventBuffer.create([KeyboardCharEvent],
+                                               MessageEvent, 8)
+
+    def teardown(self):
+        self.writer.close(remove=True)
+
+    def test_nestedFloatsWidened(self):
+        dtype = eventArrayDType(KeyboardCharEvent.NUMPY_DTYPE)
+        assert dtype['time'] == np.float64
+        assert dtype['press_event']['time'] == np.float64
+
+    def test_charEventThroughMsgpackLayout(self):
+        # the layout reaches the experiment process through msgpack, which
+        # turns the tuples of the nested press_event descr into lists
+        layout = msgpack.unpackb(msgpack.packb(self.writer.getLayout()))
+        reader = SharedEventBuffer(layout)
+        try:
+            event = _charEvent(5, 1234.567891, u'a')
+            ring = self.writer.rings[EventConstants.KEYBOARD_CHAR]
+            assert ring.put(event)
+            events = reader.getEvents()
+            assert len(events) == 1
+            char = events[0]
+            names = KeyboardCharEvent.CLASS_ATTRIBUTE_NAMES
+            press = char[names.index('press_event')]
+            press_names = KeyboardPressEvent.CLASS_ATTRIBUTE_NAMES
+            assert char[names.index('time')] == 1234.567891 + 0.1
+            assert press[press_names.index('time')] == 1234.567891
+            assert press[press_names.index('key')] == 'a'
+            assert press[press_names.index('event_id')] == 5
+        finally:
+            reader.close()
+
+
+def test_eventArraysThroughMsgpack():
+    events = [_charEvent(7, 12.5, u'b'), _charEvent(3, 10.25, u'a'),
+              _eventValues(MessageEvent, event_id=9, time=11.0,
+                           text=u'hello', category=u'')]
+    packed = msgpack.unpackb(msgpack.packb(packEventArrays(events)))
+    arrays = unpackEventArrays(packed)
+    assert sorted(arrays.keys()) == sorted([EventConstants.KEYBOARD_CHAR,
+                                            EventConstants.MESSAGE])
+    chars = arrays[EventConstants.KEYBOARD_CHAR]
+    # each array is in event time order
+    assert list(chars['time']) == [10.25 + 0.1, 12.5 + 0.1]
+    assert list(chars['press_event']['time']) == [10.25, 12.5]
+    assert list(chars['press_event']['key']) == ['a', 'b']
+    assert list(chars['press_event']['event_id']) == [3, 7]
+    assert arrays[EventConstants.MESSAGE]['text'][0] == 'hello'
+
+
+class TestEventQueries:
+    def setup(self):
+        self.a = _eventValues(KeyboardPressEvent, event_id=1, time=1.0, key='a')
+        self.msg = _eventValues(MessageEvent, event_id=2, time=1.5, text='m')
+        self.b = _eventValues(KeyboardPressEvent, event_id=3, time=2.0, key='b')
+        self.c = _eventValues(KeyboardPressEvent, event_id=4, time=3.0, key='c')
+        self.events = [self.c, self.a, self.msg, self.b]
+        self.press = EventConstants.KEYBOARD_PRESS
+
+    def test_eventQuery(self):
+        assert eventQuery() is None
+        assert eventQuery(filters={}) is None
+        query = eventQuery(event_types=self.press, start_time=1.0,
+                           filters={'key': set(['a'])}, latest_only=True,
+                           max_count=2.0)
+        assert query == dict(event_types=[self.press], start_time=1.0,
+                             filters={'key': ['a']}, latest_only=True,
+                             max_count=2)
+
+    def test_noQuery(self):
+        selected, unmatched = queryEvents(self.events)
+        assert selected == [self.a, self.msg, self.b, self.c]
+        assert unmatched == []
+
+    def test_typesAndTimeWindow(self):
+        selected, unmatched = queryEvents(self.events, event_types=[self.press],
+                                          start_time=1.5, end_time=2.0)
+        assert selected == [self.b]
+        assert unmatched == [self.c, self.a, self.msg]
+
+    def test_filters(self):
+        selected, unmatched = queryEvents(self.events,
+                                          filters={'key': ['a', 'c']})
+        assert selected == [self.a, self.c]
+        # the message has no key attribute, so doesn't match
+        assert unmatched == [self.msg, self.b]
+        selected, unmatched = queryEvents(self.events, filters={'key': 'b'})
+        assert selected == [self.b]
+
+    def test_latestOnlyAndMaxCount(self):
+        selected, unmatched = queryEvents(self.events, latest_only=True)
+        assert selected == [self.msg, self.c]
+        assert unmatched == []
+        selected, unmatched = queryEvents(self.events,
+                                          event_types=[self.press], max_count=2)
+        assert selected == [self.b, self.c]
+        assert unmatched == [self.msg]
+        selected, unmatched = queryEvents(self.events, max_count=0)
+        assert selected == []
+
+    def test_filteredEventTypes(self):
+        event_types = [self.press, EventConstants.MESSAGE,
+                       EventConstants.KEYBOARD_CHAR]
+        assert filteredEventTypes(event_types, {'key': 'a'}) == \
+            [self.press, EventConstants.KEYBOARD_CHAR]
+        assert filteredEventTypes(event_types, {'text': 'm', 'key': 'a'}) == []
+        assert filteredEventTypes(event_types, {}) == event_types
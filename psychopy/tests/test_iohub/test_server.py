@@ -0,0 +1,40 @@
+from psychopy.iohub.server import udpServer
+
+
+class _RecordingServer(udpServer):
+    """A udpServer that keeps its replies instead of sending them."""
+    def __init__(self):
+        self._running = True
+        self.replies = []
+
+    def sendResponse(self, data, address):
+        self.replies.append(data)
+
+    def addValues(self, a=0, b=0, scale=1):
+        return (a + b) * scale
+
+
+class TestRPCRequests:
+    def setup(self):
+        self.server = _RecordingServer()
+
+    def _call(self, *request):
+        assert self.server.handleRequest(['RPC', 'addValues'] + list(request),
+                                         None)
+        return self.server.replies[-1]
+
+    def test_noArguments(self):
+        assert self._call() == ('RPC_RESULT', 'addValues', 0)
+
+    def test_args(self):
+        assert self._call([1, 2]) == ('RPC_RESULT', 'addValues', 3)
+
+    def test_argsAndKwargs(self):
+        # as sent by ioHubConnection.callAsync('addValues', 1, 2, scale=3)
+        assert self._call([1, 2], {'scale': 3}) == \
+            ('RPC_RESULT', 'addValues', 9)
+
+    def test_kwargsOnly(self):
+        assert self._call([], {'b': 2, 'scale': 4}) == \
+            ('RPC_RESULT', 'addValues', 8)
+        assert self._call([], {}) == ('RPC_RESULT', 'addValues', 0)
@@ -0,0 +1,46 @@
+import StringIO
+import time
+
+from psychopy import logging
+
+
+class TestLogging:
+    def setup(self):
+        self.logger = logging._Logger()
+        self.stream = StringIO.StringIO()
+        self.target = logging.LogFile(self.stream, level=logging.INFO,
+                                      logger=self.logger)
+
+    def test_flush(self):
+        logging.info('not for this logger')
+        self.logger.log('hello', level=logging.EXP)
+        self.logger.log('too quiet', level=logging.DEBUG)
+        self.logger.flush()
+        assert 'hello' in self.stream.getvalue()
+        assert 'too quiet' not in self.stream.getvalue()
+        assert len(self.logger.toFlush) == 0
+        assert len(self.logger.flushed) == 1
+
+    def test_boundedHistory(self):
+        self.logger.setHistory(3)
+        for n in range(10):
+            self.logger.log('msg%i' % n, level=logging.INFO)
+        self.logger.flush()
+        assert [entry.message for entry in self.logger.flushed] == \
+            ['msg7', 'msg8', 'msg9']
+        assert self.stream.getvalue().count('msg') == 10
+        self.logger.setHistory(0)  # keep nothing
+        self.logger.log('another', level=logging.INFO)
+        self.logger.flush()
+        assert len(self.logger.flushed) == 0
+
+    def test_writerThread(self):
+        self.logger.startWriter(interval=0.01)
+        for n in range(100):
+            self.logger.log('msg%i' % n, level=logging.INFO)
+        time.sleep(0.1)
+        assert 'msg99' in self.stream.getvalue()
+        self.logger.log('last', level=logging.INFO)
+        self.logger.stopWriter()  # does a final flush
+        assert self.stream.getvalue().count('msg') == 100
+        assert 'last' in self.stream.getvalue()
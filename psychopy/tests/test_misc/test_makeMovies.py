@@ -0,0 +1,43 @@
+import os, shutil
+from tempfile import mkdtemp
+import pytest
+
+from psychopy import makeMovies
+from psychopy.makeMovies import Image
+
+
+class TestFrameWriting:
+    def setup(self):
+        self.temp_dir = mkdtemp(prefix='psychopy-tests-makeMovies')
+        self.frames = [Image.new('RGB', (16, 8), (n*50, 0, 0)) for n in range(3)]
+
+    def teardown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_frameSpool(self):
+        spool = makeMovies.FrameSpool(self.frames[:1])
+        for frame in self.frames[1:]:
+            spool.append(frame)
+        assert len(spool) == 3
+        assert spool[-1].getpixel((0, 0)) == (100, 0, 0)
+        assert [im.getpixel((0, 0))[0] for im in spool] == [0, 50, 100]
+        spool.append(self.frames[0])  # after reading, more can be added
+        assert len(spool[1:]) == 3
+        assert spool[3].size == (16, 8)
+        spoolDir = spool._dir
+        assert os.path.isdir(spoolDir)
+        spool.clear()
+        assert len(spool) == 0
+        assert not os.path.exists(spoolDir)
+
+    def test_anyPILImageFormat(self):
+        fileName = os.path.join(self.temp_dir, 'frame.ppm')
+        writer = makeMovies.FrameWriter(fileName, (16, 8), nDigits=2)
+        for frame in self.frames:
+            writer.write(frame)
+        writer.close()
+        assert writer.nFrames == 3
+        assert os.path.isfile(os.path.join(self.temp_dir, 'frame03.ppm'))
+        with pytest.raises(IOError):
+            makeMovies.FrameWriter(os.path.join(self.temp_dir, 'frame.notanimage'),
+                                   (16, 8))
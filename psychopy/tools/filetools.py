@@ -24,9 +24,16 @@ def toFile(filename, data):
 def fromFile(filename):
     """load data (of any sort) from a pickle file
 
-    simple wrapper of the cPickle module in core python
+    simple wrapper of the cPickle module in core python. Files saved by the
+    saveAsColumns method of the data handlers are returned as a
+    :class:`~psychopy.data.ColumnDataFile`
     """
-    f = open(filename)
+    f = open(filename, 'rb')
+    if f.read(8) == 'PSYCOLS\x00':
+        f.close()
+        from psychopy.data import ColumnDataFile
+        return ColumnDataFile(filename)
+    f.seek(0)
     contents = cPickle.load(f)
     f.close()
     #if loading an experiment file make sure we don't save further copies using __del__
@@ -0,0 +1,107 @@
+#!/usr/bin/env python2
+
+'''An OpenGL context with no window, for rendering without a display
+(used by Window(winType='offscreen'))'''
+
+# Part of the PsychoPy library
+# Copyright (C) 2014 Jonathan Peirce
+# Distributed under the terms of the GNU General Public License (GPL).
+
+import ctypes
+import ctypes.util
+import os
+
+import pyglet
+pyglet.options['debug_gl'] = False
+GL = pyglet.gl
+
+import numpy
+
+OSMESA_Y_UP = 0x11
+
+#try to find the Mesa offscreen library (software rasterisation)
+_osmesa = None
+_libName = os.environ.get('PSYCHOPY_OSMESA_LIBRARY') or ctypes.util.find_library('OSMesa')
+if _libName:
+    try:
+        _osmesa = ctypes.CDLL(_libName, mode=ctypes.RTLD_GLOBAL)
+    except OSError:
+        _osmesa = None
+haveOSMesa = _osmesa is not None
+
+if haveOSMesa:
+    _osmesa.OSMesaCreateContextExt.restype = ctypes.c_void_p
+    _osmesa.OSMesaCreateContextExt.argtypes = [ctypes.c_uint, ctypes.c_int,
+                                               ctypes.c_int, ctypes.c_int,
+                                               ctypes.c_void_p]
+    _osmesa.OSMesaMakeCurrent.restype = ctypes.c_ubyte
+    _osmesa.OSMesaMakeCurrent.argtypes = [ctypes.c_void_p, ctypes.c_void_p,
+                                          ctypes.c_uint, ctypes.c_int, ctypes.c_int]
+    _osmesa.OSMesaDestroyContext.argtypes = [ctypes.c_void_p]
+    _osmesa.OSMesaPixelStore.argtypes = [ctypes.c_int, ctypes.c_int]
+
+
+class OffscreenContext(object):
+    """A GL context (created with OSMesa) that renders into an array in
+    memory instead of a window.
+
+    OSMesa contexts are single-buffered, so the contents of the buffer are
+    copied to `front` when flip() is called. Rendering then continues into
+    the (live) back buffer, as for a double-buffered window.
+
+    The GL functions used by pyglet.gl are dispatched to this context
+    through the GL library that Mesa shares with OSMesa. If your OSMesa
+    library is not in a standard location give its path in the environment
+    variable PSYCHOPY_OSMESA_LIBRARY.
+    """
+    def __init__(self, width, height, depthBits=24, stencilBits=8):
+        if not haveOSMesa:
+            raise RuntimeError("winType='offscreen' requires the OSMesa library "
+                               "(e.g. libosmesa6 on Debian/Ubuntu) but it "
+                               "could not be found")
+        self.width = int(width)
+        self.height = int(height)
+        self._context = _osmesa.OSMesaCreateContextExt(GL.GL_RGBA, depthBits,
+                                                       stencilBits, 0, None)
+        if not self._context:
+            raise RuntimeError("Failed to create an OSMesa context")
+        #rows of RGBA pixels, starting at the bottom (as for glReadPixels)
+        self.back = numpy.zeros([self.height, self.width, 4], numpy.uint8)
+        self.front = numpy.zeros([self.height, self.width, 4], numpy.uint8)
+        self.switch_to()
+        _osmesa.OSMesaPixelStore(OSMESA_Y_UP, 1)
+
+    def switch_to(self):
+        """Make this the current GL context (same name as for pyglet windows)
+        """
+        ok = _osmesa.OSMesaMakeCurrent(self._context, self.back.ctypes.data,
+                                       GL.GL_UNSIGNED_BYTE, self.width,
+                                       self.height)
+        if not ok:
+            raise RuntimeError("Failed to make the OSMesa context current")
+        #let pyglet know which extensions and version are now available
+        GL.gl_info.set_active_context()
+        GL.glu_info.set_active_context()
+
+    def flip(self):
+        """Finish rendering and make the result the 'front' buffer
+        """
+        GL.glFinish()
+        self.front[:] = self.back
+
+    def getPixels(self, buffer='front'):
+        """Return the RGBA pixels of the front or back buffer, as an array of
+        rows from the bottom of the frame
+        """
+        if buffer == 'back':
+            GL.glFinish()
+            return self.back
+        return self.front
+
+    def dispatch_events(self):
+        pass  # no window so no events
+
+    def close(self):
+        if self._context:
+            _osmesa.OSMesaDestroyContext(self._context)
+            self._context = None
@@ -563,7 +563,7 @@ class BaseVisualStim(LegacyBaseVisualStim):
     def _selectWindow(self, win):
         global currWindow
         #don't call switch if it's already the curr window
-        if win!=currWindow and win.winType=='pyglet':
+        if win!=currWindow and win.winType in ['pyglet', 'offscreen']:
             win.winHandle.switch_to()
             currWindow = win
 
@@ -25,6 +25,7 @@ from psychopy.tools.attributetools import setWithOperation
 from psychopy.tools.arraytools import val2array
 from psychopy.tools.monitorunittools import cm2pix, deg2pix
 from psychopy.visual.basevisual import BaseVisualStim
+from psychopy.visual.elementarray import ElementArrayStim
 
 import numpy
 from numpy import pi
@@ -106,7 +107,12 @@ class DotStim(BaseVisualStim):
             element : *None* or a visual stimulus object
                 This can be any object that has a ``.draw()`` method and a
                 ``.setPos([x,y])`` method (e.g. a GratingStim, TextStim...)!!
-                See `ElementArrayStim` for a faster implementation of this idea.
+                Alternatively an :class:`~psychopy.visual.ElementArrayStim` with
+                `nElements=nDots` (and the same units as the DotStim) can be
+                given, in which case all the dots are drawn with a single
+                vertex-array call. This is much faster for large numbers of
+                textured dots, and per-dot colors and opacities can be set with
+                the element array's `setColors()` and `setOpacities()`.
             """
         #what local vars are defined (these are the init params) for use by __repr__
         self._initParams = __builtins__['dir']()
@@ -127,6 +133,13 @@ class DotStim(BaseVisualStim):
         self.dir = dir
         self.speed = speed
         self.element = element
+        if isinstance(element, ElementArrayStim):
+            if element.nElements != nDots:
+                raise ValueError("An ElementArrayStim used as the DotStim element "
+                                 "needs nElements=nDots (%i)" % nDots)
+            if element.units != self.units:
+                raise ValueError("An ElementArrayStim used as the DotStim element "
+                                 "needs the same units as the DotStim (%s)" % self.units)
         self.dotLife = dotLife
         self.signalDots = signalDots
         self.noiseDots = noiseDots
@@ -266,6 +279,11 @@ class DotStim(BaseVisualStim):
             GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
             GL.glDrawArrays(GL.GL_POINTS, 0, self.nDots)
             GL.glDisableClientState(GL.GL_VERTEX_ARRAY)
+        elif isinstance(self.element, ElementArrayStim):
+            #all the dots in a single call; xys are relative to the field centre
+            self.element.setFieldPos(self.fieldPos, log=False)
+            self.element.setXYs(self._verticesBase, log=False)
+            self.element.draw(win)
         else:
             #we don't want to do the screen scaling twice so for each dot subtract the screen centre
             initialDepth=self.element.depth
@@ -25,13 +25,17 @@ from psychopy import logging
 from psychopy.tools.arraytools import val2array
 from psychopy.tools.attributetools import setWithOperation
 from psychopy.tools.monitorunittools import convertToPix
-from psychopy.visual.helpers import setColor, createTexture
+from psychopy.visual.helpers import setColor, createCachedTexture
 
 global currWindow
 currWindow = None
 
 import numpy
 
+#operations that setters can apply to a subset of elements
+_operations = {'+': numpy.add, '-': numpy.subtract, '*': numpy.multiply,
+               '/': numpy.divide, '**': numpy.power, '%': numpy.mod}
+
 class ElementArrayStim(object):
     """
     This stimulus class defines a field of elements whose behaviour can be independently
@@ -64,6 +68,7 @@ class ElementArrayStim(object):
                  elementMask='gauss',
                  texRes=48,
                  interpolate=True,
+                 useVBO=False,
                  name='', autoLog=True):
 
         """
@@ -148,6 +153,13 @@ class ElementArrayStim(object):
                 the number of pixels in the textures (overridden if an array
                 or image is provided)
 
+            useVBO : True or *False*
+                If True the vertices, colors and texture coordinates are kept
+                in vertex buffer objects on the graphics card and only the
+                attribute that has changed (e.g. the vertices after setOris)
+                is re-sent, rather than sending every array on every frame.
+                Recommended for large arrays that change on every frame.
+
             name : string
                 The name of the objec to be using during logged messages about
                 this stim
@@ -177,14 +189,25 @@ class ElementArrayStim(object):
         self.phases = phases
         self._needVertexUpdate=True
         self._needColorUpdate=True
+        self._needTexCoordUpdate=True
+        #elements changed by setters given `indices` (see _setSubset)
+        self._dirtyElements = {'vertices': set(), 'colors': set(), 'texCoords': set()}
         self.useShaders=True
+        self.useVBO=useVBO
         self.interpolate=interpolate
         self.fieldDepth=fieldDepth
         self.depths=depths
-        if self.win.winType != 'pyglet':
-            raise TypeError('ElementArrayStim requires a pyglet context')
+        if self.win.winType not in ['pyglet', 'offscreen']:
+            raise TypeError('ElementArrayStim requires a pyglet (or offscreen) context')
         if not self.win._haveShaders:
             raise Exception("ElementArrayStim requires shaders support and floating point textures")
+        if self.useVBO:
+            #one buffer per vertex attribute, so each can be updated separately
+            self._vbos = {}
+            self._vboSizes = {}
+            for attrib in ['vertices', 'colors', 'texCoords', 'maskCoords']:
+                self._vbos[attrib] = GL.GLuint()
+                GL.glGenBuffers(1, ctypes.byref(self._vbos[attrib]))
 
         self.colorSpace=colorSpace
         if rgbs!=None:
@@ -203,6 +226,8 @@ class ElementArrayStim(object):
         GL.glGenTextures(1, ctypes.byref(self._texID))
         self._maskID = GL.GLuint()
         GL.glGenTextures(1, ctypes.byref(self._maskID))
+        #_texID and _maskID may later point to textures from win.textureCache
+        self._ownTexID, self._ownMaskID = self._texID, self._maskID
         self.setMask(elementMask, log=False)
         self.setTex(elementTex, log=False)
 
@@ -222,11 +247,11 @@ class ElementArrayStim(object):
     def _selectWindow(self, win):
         global currWindow
         #don't call switch if it's already the curr window
-        if win!=currWindow and win.winType=='pyglet':
+        if win!=currWindow and win.winType in ['pyglet', 'offscreen']:
             win.winHandle.switch_to()
             currWindow = win
 
-    def setXYs(self,value=None, operation='', log=True):
+    def setXYs(self,value=None, operation='', indices=None, log=True):
         """Set the xy values of the element centres (relative to the centre of the field).
         Values should be:
 
@@ -236,6 +261,10 @@ class ElementArrayStim(object):
         If value is None then the xy positions will be generated automatically, based
         on the fieldSize and fieldPos. In this case opacity will also be overridden
         by this function (it is used to make elements outside the field invisible.
+
+        If `indices` (a list/array of element indices) is given then only those
+        elements are changed, and only they are recalculated and uploaded on the
+        next draw(). `value` then applies to each of the indexed elements.
         """
         if value==None:
             if self.fieldShape in ['sqr', 'square']:
@@ -255,6 +284,9 @@ class ElementArrayStim(object):
                 normxy = xys/(self.fieldSize/2.0)
                 dotDist = numpy.sqrt((normxy[:,0]**2.0 + normxy[:,1]**2.0))
                 self.xys = xys[dotDist<1.0,:][0:self.nElements]
+        elif indices is not None:
+            #only the given elements move (see _setSubset)
+            self._setSubset('xys', value, operation, indices, ['vertices'])
         else:
             #make into an array
             if type(value) in [int, float, list, tuple]:
@@ -264,35 +296,41 @@ class ElementArrayStim(object):
                 raise ValueError("New value for setXYs should be either None or Nx2")
             #set value
             setWithOperation(self, 'xys', value, operation)
-        self._needVertexUpdate=True
+        if indices is None:
+            self._needVertexUpdate=True
         if log and self.autoLog:
             self.win.logOnFlip("Set %s XYs=%s" %(self.name, type(value)),
                 level=logging.EXP,obj=self)
-    def setOris(self,value,operation='', log=True):
+    def setOris(self, value, operation='', indices=None, log=True):
         """Set the orientation for each element.
         Should either be a single value or an Nx1 array/list
+
+        If `indices` (a list/array of element indices) is given then only those
+        elements are changed, and only they are recalculated and uploaded on the
+        next draw(). `value` then applies to each of the indexed elements.
         """
         #make into an array
         if type(value) in [int, float, list, tuple]:
             value = numpy.array(value, dtype=float)
-
-        #check shape
-        if value.shape in [(),(1,)]:
-            value = value.repeat(self.nElements)
-        elif value.shape in [(self.nElements,), (self.nElements,1)]:
-            pass #is already Nx1
+        if indices is not None:
+            #only the given elements change (see _setSubset)
+            self._setSubset('oris', value, operation, indices, ['vertices'])
         else:
-            raise ValueError("New value for setOris should be either Nx1 or a single value")
-
-        #set value
-        setWithOperation(self, 'oris', value, operation)
-
-        self._needVertexUpdate=True
+            #check shape
+            if value.shape in [(),(1,)]:
+                value = value.repeat(self.nElements)
+            elif value.shape in [(self.nElements,), (self.nElements,1)]:
+                pass #is already Nx1
+            else:
+                raise ValueError("New value for setOris should be either Nx1 or a single value")
+            #set value
+            setWithOperation(self, 'oris', value, operation)
+            self._needVertexUpdate=True
         if log and self.autoLog:
             self.win.logOnFlip("Set %s oris=%s" %(self.name, type(value)),
                 level=logging.EXP,obj=self)
     #----------------------------------------------------------------------
-    def setSfs(self, value,operation='', log=True):
+    def setSfs(self, value, operation='', indices=None, log=True):
         """Set the spatial frequency for each element.
         Should either be:
 
@@ -304,107 +342,131 @@ class ElementArrayStim(object):
         are cycles per stimulus width. For units of 'deg' or 'cm' the units
         are c/cm or c/deg respectively.
 
+        If `indices` (a list/array of element indices) is given then only those
+        elements are changed, and only they are recalculated and uploaded on the
+        next draw(). `value` then applies to each of the indexed elements.
         """
 
         #make into an array
         if type(value) in [int, float, list, tuple]:
             value = numpy.array(value, dtype=float)
-
-        #check shape
-        if value.shape in [(),(1,),(2,)]:
-            value = numpy.resize(value, [self.nElements,2])
-        elif value.shape in [(self.nElements,), (self.nElements,1)]:
-            value.shape=(self.nElements,1)#set to be 2D
-            value = value.repeat(2,1) #repeat once on dim 1
-        elif value.shape == (self.nElements,2):
-            pass#all is good
+        if indices is not None:
+            #only the given elements change (see _setSubset)
+            self._setSubset('sfs', value, operation, indices, ['texCoords'])
         else:
-            raise ValueError("New value for setSfs should be either Nx1, Nx2 or a single value")
-
-        # Set value and log
-        setWithOperation(self, 'sfs', value, operation)
+            #check shape
+            if value.shape in [(),(1,),(2,)]:
+                value = numpy.resize(value, [self.nElements,2])
+            elif value.shape in [(self.nElements,), (self.nElements,1)]:
+                value.shape=(self.nElements,1)#set to be 2D
+                value = value.repeat(2,1) #repeat once on dim 1
+            elif value.shape == (self.nElements,2):
+                pass#all is good
+            else:
+                raise ValueError("New value for setSfs should be either Nx1, Nx2 or a single value")
+            # Set value and log
+            setWithOperation(self, 'sfs', value, operation)
         if log and self.autoLog:
             self.win.logOnFlip("Set %s sfs=%s" %(self.name, type(value)),
                 level=logging.EXP,obj=self)
 
-    def setOpacities(self,value,operation='', log=True):
+    def setOpacities(self, value, operation='', indices=None, log=True):
         """Set the opacity for each element.
         Should either be a single value or an Nx1 array/list
+
+        If `indices` (a list/array of element indices) is given then only those
+        elements are changed, and only they are recalculated and uploaded on the
+        next draw(). `value` then applies to each of the indexed elements.
         """
         #make into an array
         if type(value) in [int, float, list, tuple]:
             value = numpy.array(value, dtype=float)
-
-        #check shape
-        if value.shape in [(),(1,)]:
-            value = value.repeat(self.nElements)
-        elif value.shape in [(self.nElements,), (self.nElements,1)]:
-            pass #is already Nx1
+        if indices is not None:
+            #only the given elements change (see _setSubset)
+            self._setSubset('opacities', value, operation, indices, ['colors'])
         else:
-            raise ValueError("New value for setOpacities should be either Nx1 or a single value")
-
-        #set value and log
-        setWithOperation(self, 'opacities', value, operation)
-        self._needColorUpdate =True
+            #check shape
+            if value.shape in [(),(1,)]:
+                value = value.repeat(self.nElements)
+            elif value.shape in [(self.nElements,), (self.nElements,1)]:
+                pass #is already Nx1
+            else:
+                raise ValueError("New value for setOpacities should be either Nx1 or a single value")
+            #set value and log
+            setWithOperation(self, 'opacities', value, operation)
+            self._needColorUpdate =True
         if log and self.autoLog:
             self.win.logOnFlip("Set %s opacities=%s" %(self.name, type(value)),
                 level=logging.EXP,obj=self)
-    def setSizes(self,value,operation='', log=True):
+    def setSizes(self, value, operation='', indices=None, log=True):
         """Set the size for each element.
         Should either be:
 
           - a single value
           - an Nx1 array/list
           - an Nx2 array/list
+
+        If `indices` (a list/array of element indices) is given then only those
+        elements are changed, and only they are recalculated and uploaded on the
+        next draw(). `value` then applies to each of the indexed elements.
         """
         #make into an array
         if type(value) in [int, float, list, tuple]:
             value = numpy.array(value, dtype=float)
-        #check shape
-        if value.shape in [(),(1,),(2,)]:
-            value = numpy.resize(value, [self.nElements,2])
-        elif value.shape in [(self.nElements,), (self.nElements,1)]:
-            value.shape=(self.nElements,1)#set to be 2D
-            value = value.repeat(2,1) #repeat once on dim 1
-        elif value.shape == (self.nElements,2):
-            pass#all is good
+        if indices is not None:
+            #only the given elements change (see _setSubset)
+            self._setSubset('sizes', value, operation, indices, ['vertices', 'texCoords'])
         else:
-            raise ValueError("New value for setSizes should be either Nx1, Nx2 or a single value")
-
-        #set value and log
-        setWithOperation(self, 'sizes', value, operation)
-        self._needVertexUpdate=True
-        self._needTexCoordUpdate=True
+            #check shape
+            if value.shape in [(),(1,),(2,)]:
+                value = numpy.resize(value, [self.nElements,2])
+            elif value.shape in [(self.nElements,), (self.nElements,1)]:
+                value.shape=(self.nElements,1)#set to be 2D
+                value = value.repeat(2,1) #repeat once on dim 1
+            elif value.shape == (self.nElements,2):
+                pass#all is good
+            else:
+                raise ValueError("New value for setSizes should be either Nx1, Nx2 or a single value")
+            #set value and log
+            setWithOperation(self, 'sizes', value, operation)
+            self._needVertexUpdate=True
+            self._needTexCoordUpdate=True
 
         if log and self.autoLog:
             self.win.logOnFlip("Set %s sizes=%s" %(self.name, type(value)),
                 level=logging.EXP,obj=self)
-    def setPhases(self,value,operation='', log=True):
+    def setPhases(self, value, operation='', indices=None, log=True):
         """Set the phase for each element.
         Should either be:
 
           - a single value
           - an Nx1 array/list
           - an Nx2 array/list (for separate X and Y phase)
+
+        If `indices` (a list/array of element indices) is given then only those
+        elements are changed, and only they are recalculated and uploaded on the
+        next draw(). `value` then applies to each of the indexed elements.
         """
         #make into an array
         if type(value) in [int, float, list, tuple]:
             value = numpy.array(value, dtype=float)
-
-        #check shape
-        if value.shape in [(),(1,),(2,)]:
-            value = numpy.resize(value, [self.nElements,2])
-        elif value.shape in [(self.nElements,), (self.nElements,1)]:
-            value.shape=(self.nElements,1)#set to be 2D
-            value = value.repeat(2,1) #repeat once on dim 1
-        elif value.shape == (self.nElements,2):
-            pass#all is good
+        if indices is not None:
+            #only the given elements change (see _setSubset)
+            self._setSubset('phases', value, operation, indices, ['texCoords'])
         else:
-            raise ValueError("New value for setPhases should be either Nx1, Nx2 or a single value")
-
-        #set value and log
-        setWithOperation(self, 'phases', value, operation)
-        self._needTexCoordUpdate=True
+            #check shape
+            if value.shape in [(),(1,),(2,)]:
+                value = numpy.resize(value, [self.nElements,2])
+            elif value.shape in [(self.nElements,), (self.nElements,1)]:
+                value.shape=(self.nElements,1)#set to be 2D
+                value = value.repeat(2,1) #repeat once on dim 1
+            elif value.shape == (self.nElements,2):
+                pass#all is good
+            else:
+                raise ValueError("New value for setPhases should be either Nx1, Nx2 or a single value")
+            #set value and log
+            setWithOperation(self, 'phases', value, operation)
+            self._needTexCoordUpdate=True
 
         if log and self.autoLog:
             self.win.logOnFlip("Set %s phases=%s" %(self.name, type(value)),
@@ -413,7 +475,7 @@ class ElementArrayStim(object):
         """DEPRECATED (as of v1.74.00). Please use setColors() instead
         """
         self.setColors(value,operation, log=log)
-    def setColors(self, color, colorSpace=None, operation='', log=True):
+    def setColors(self, color, colorSpace=None, operation='', indices=None, log=True):
         """Set the color of the stimulus. See :ref:`colorspaces` for further information
         about the various ways to specify colors and their various implications.
 
@@ -449,7 +511,28 @@ class ElementArrayStim(object):
                 thisStim.setColor([1,1,1],'rgb255','+')#increment all guns by 1 value
                 thisStim.setColor(-1, 'rgb', '*') #multiply the color by -1 (which in this space inverts the contrast)
                 thisStim.setColor([10,0,0], 'dkl', '+')#raise the elevation from the isoluminant plane by 10 deg
+
+        indices : a list/array of element indices or None
+
+            if given then only the colors of those elements change (and only they are
+            recalculated and uploaded on the next draw). The color must be a triplet
+            (or single value) or one triplet per index, in the current colorSpace.
         """
+        if indices is not None:
+            if colorSpace not in [None, self.colorSpace] or self.colorSpace in ['named','hex']:
+                raise ValueError("setColors with indices needs colors in the current colorSpace (%s)" %self.colorSpace)
+            self.colors = numpy.resize(self.colors, [self.nElements,3])
+            if self.colorSpace in ['rgb','rgb255']:
+                #rgbs are the colors themselves so just these elements change
+                self._setSubset('colors', color, operation, indices, ['colors'])
+                self.rgbs = self.colors
+                if log and self.autoLog:
+                    self.win.logOnFlip("Set %s colors=%s" %(self.name, type(color)),
+                        level=logging.EXP,obj=self)
+                return
+            #other spaces need converting so update the array as a whole
+            self._setSubset('colors', color, operation, indices, [])
+            color, operation = self.colors, ''
         setColor(self,color, colorSpace=colorSpace, operation=operation,
                     rgbAttrib='rgbs', #or 'fillRGB' etc
                     colorAttrib='colors',
@@ -465,27 +548,34 @@ class ElementArrayStim(object):
         else:
             raise ValueError("New value for setRgbs should be either Nx1, Nx3 or a single value")
         self._needColorUpdate=True
-    def setContrs(self,value,operation='', log=True):
+    def setContrs(self, value, operation='', indices=None, log=True):
         """Set the contrast for each element.
         Should either be:
 
           - a single value
           - an Nx1 array/list
+
+        If `indices` (a list/array of element indices) is given then only those
+        elements are changed, and only they are recalculated and uploaded on the
+        next draw(). `value` then applies to each of the indexed elements.
         """
         #make into an array
         if type(value) in [int, float, list, tuple]:
             value = numpy.array(value, dtype=float)
-        #check shape
-        if value.shape in [(),(1,)]:
-            value = value.repeat(self.nElements)
-        elif value.shape in [(self.nElements,), (self.nElements,1)]:
-            pass #is already Nx1
+        if indices is not None:
+            #only the given elements change (see _setSubset)
+            self._setSubset('contrs', value, operation, indices, ['colors'])
         else:
-            raise ValueError("New value for setContrs should be either Nx1 or a single value")
-
-        #set value and log
-        setWithOperation(self, 'contrs', value, operation)
-        self._needColorUpdate=True
+            #check shape
+            if value.shape in [(),(1,)]:
+                value = value.repeat(self.nElements)
+            elif value.shape in [(self.nElements,), (self.nElements,1)]:
+                pass #is already Nx1
+            else:
+                raise ValueError("New value for setContrs should be either Nx1 or a single value")
+            #set value and log
+            setWithOperation(self, 'contrs', value, operation)
+            self._needColorUpdate=True
 
         if log and self.autoLog:
             self.win.logOnFlip("Set %s contrs=%s" %(self.name, type(value)),
@@ -541,10 +631,16 @@ class ElementArrayStim(object):
 
         if self._needVertexUpdate:
             self._updateVertices()
+        elif self._dirtyElements['vertices']:
+            self._updateVertices(self._popDirty('vertices'))
         if self._needColorUpdate:
             self.updateElementColors()
+        elif self._dirtyElements['colors']:
+            self.updateElementColors(self._popDirty('colors'))
         if self._needTexCoordUpdate:
             self.updateTextureCoords()
+        elif self._dirtyElements['texCoords']:
+            self.updateTextureCoords(self._popDirty('texCoords'))
 
         #scale the drawing frame and get to centre of field
         GL.glPushMatrix()#push before drawing, pop after
@@ -553,8 +649,15 @@ class ElementArrayStim(object):
         #GL.glLoadIdentity()
         self.win.setScale('pix')
 
-        GL.glColorPointer(4, GL.GL_DOUBLE, 0, self._RGBAs.ctypes.data_as(ctypes.POINTER(ctypes.c_double)))
-        GL.glVertexPointer(3, GL.GL_DOUBLE, 0, self.verticesPix.ctypes.data_as(ctypes.POINTER(ctypes.c_double)))
+        if self.useVBO:
+            #pointers are offsets into the bound buffer
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self._vbos['colors'])
+            GL.glColorPointer(4, GL.GL_FLOAT, 0, None)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self._vbos['vertices'])
+            GL.glVertexPointer(3, GL.GL_FLOAT, 0, None)
+        else:
+            GL.glColorPointer(4, GL.GL_FLOAT, 0, self._vertexRGBAs.ctypes.data_as(ctypes.POINTER(ctypes.c_float)))
+            GL.glVertexPointer(3, GL.GL_FLOAT, 0, self.verticesPix.ctypes.data_as(ctypes.POINTER(ctypes.c_float)))
 
         #setup the shaderprogram
         GL.glUseProgram(self.win._progSignedTexMask)
@@ -571,10 +674,19 @@ class ElementArrayStim(object):
 
         #setup client texture coordinates first
         GL.glClientActiveTexture (GL.GL_TEXTURE0)
-        GL.glTexCoordPointer (2, GL.GL_DOUBLE, 0, self._texCoords.ctypes)
+        if self.useVBO:
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self._vbos['texCoords'])
+            GL.glTexCoordPointer (2, GL.GL_FLOAT, 0, None)
+        else:
+            GL.glTexCoordPointer (2, GL.GL_FLOAT, 0, self._texCoords.ctypes)
         GL.glEnableClientState(GL.GL_TEXTURE_COORD_ARRAY)
         GL.glClientActiveTexture (GL.GL_TEXTURE1)
-        GL.glTexCoordPointer (2, GL.GL_DOUBLE, 0, self._maskCoords.ctypes)
+        if self.useVBO:
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self._vbos['maskCoords'])
+            GL.glTexCoordPointer (2, GL.GL_FLOAT, 0, None)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        else:
+            GL.glTexCoordPointer (2, GL.GL_FLOAT, 0, self._maskCoords.ctypes)
         GL.glEnableClientState(GL.GL_TEXTURE_COORD_ARRAY)
 
         GL.glEnableClientState(GL.GL_COLOR_ARRAY)
@@ -598,21 +710,31 @@ class ElementArrayStim(object):
         GL.glPopClientAttrib()
         GL.glPopMatrix()
 
-    def _updateVertices(self):
-        """Sets Stim.verticesPix from fieldPos and
+    def _updateVertices(self, indices=None):
+        """Sets Stim.verticesPix from fieldPos and the xys, sizes and oris of the
+        elements. If `indices` is given only those elements are recalculated.
         """
+        if indices is None:
+            self._dirtyElements['vertices'].clear()
+            sel = slice(None)
+            nElements = self.nElements
+        else:
+            sel = indices
+            nElements = len(indices)
 
         #Handle the orientation, size and location of each element in native units
         #
         radians = 0.017453292519943295
+        sizes = self.sizes[sel]
+        oris = numpy.ravel(self.oris[sel])
 
         #so we can do matrix rotation of coords we need shape=[n*4,3]
         #but we'll convert to [n,4,3] after matrix math
-        verts=numpy.zeros([self.nElements*4, 3],'d')
-        wx = -self.sizes[:,0]*numpy.cos(self.oris[:]*radians)/2
-        wy = self.sizes[:,0]*numpy.sin(self.oris[:]*radians)/2
-        hx = self.sizes[:,1]*numpy.sin(self.oris[:]*radians)/2
-        hy = self.sizes[:,1]*numpy.cos(self.oris[:]*radians)/2
+        verts=numpy.zeros([nElements*4, 3],'d')
+        wx = -sizes[:,0]*numpy.cos(oris*radians)/2
+        wy = sizes[:,0]*numpy.sin(oris*radians)/2
+        hx = sizes[:,1]*numpy.sin(oris*radians)/2
+        hy = sizes[:,1]*numpy.cos(oris*radians)/2
 
         #X vals of each vertex relative to the element's centroid
         verts[0::4,0] = -wx - hx
@@ -626,63 +748,181 @@ class ElementArrayStim(object):
         verts[2::4,1] = +wy + hy
         verts[3::4,1] = -wy + hy
 
-        positions = self.xys+self.fieldPos #set of positions across elements
+        positions = self._perElement(self.xys, sel)+self.fieldPos #set of positions across elements
 
         #depth
-        verts[:,2] = self.depths + self.fieldDepth
+        depths = self._perElement(self.depths, sel)
+        if depths.ndim and depths.shape[0] == nElements:
+            depths = numpy.repeat(numpy.ravel(depths), 4)  # one per vertex
+        verts[:,2] = depths + self.fieldDepth
         #rotate, translate, scale by units
         if positions.shape[0]*4 == verts.shape[0]:
             positions = positions.repeat(4,0)
         verts[:,:2] = convertToPix(vertices = verts[:,:2], pos = positions, units=self.units, win=self.win)
-        verts = verts.reshape([self.nElements,4,3])
+        verts = verts.reshape([nElements,4,3])
 
         #assign to self attrbute
-        self.__dict__['verticesPix'] = numpy.require(verts,requirements=['C'])#make sure it's contiguous
-        self._needVertexUpdate = False
+        if indices is None:
+            self.__dict__['verticesPix'] = numpy.require(verts, numpy.float32, requirements=['C'])#make sure it's contiguous
+            if self.useVBO:
+                self._uploadVBO('vertices', self.verticesPix)
+            self._needVertexUpdate = False
+        else:
+            self.verticesPix[indices] = verts
+            if self.useVBO:
+                self._uploadVBORange('vertices', self.verticesPix, indices)
+
+    def _perElement(self, values, sel):
+        """Select elements from an attribute that may be per-element or a
+        single value shared by all elements (e.g. depths=0)
+        """
+        values = numpy.asarray(values)
+        if values.ndim and values.shape[0] == self.nElements:
+            return values[sel]
+        return values
 
     #----------------------------------------------------------------------
-    def updateElementColors(self):
+    def updateElementColors(self, indices=None):
         """Create a new array of self._RGBAs based on self.rgbs. Not needed by the
         user (simple call setColors())
 
         For element arrays the self.rgbs values correspond to one element so
-        this function also converts them to be one for each vertex of each element
+        self._RGBAs has one row per element. These are repeated for each vertex
+        of each element only when they are sent to the graphics card.
+
+        If `indices` is given only those elements are updated.
         """
         N=self.nElements
-        self._RGBAs=numpy.zeros([N,4],'d')
+        if indices is None:
+            self._dirtyElements['colors'].clear()
+            sel = slice(None)
+            n = N
+        else:
+            sel = indices
+            n = len(indices)
+        RGBAs=numpy.zeros([n,4],numpy.float32)
+        contrs = numpy.reshape(self.contrs[sel], [n,1]).repeat(3,1)
         if self.colorSpace in ['rgb','dkl','lms','hsv']: #these spaces are 0-centred
-            self._RGBAs[:,0:3] = self.rgbs[:,:] * self.contrs[:].reshape([N,1]).repeat(3,1)/2+0.5
+            RGBAs[:,0:3] = self.rgbs[sel] * contrs/2+0.5
         else:
-            self._RGBAs[:,0:3] = self.rgbs * self.contrs[:].reshape([N,1]).repeat(3,1)/255.0
-        self._RGBAs[:,-1] = self.opacities.reshape([N,])
-        self._RGBAs=self._RGBAs.reshape([N,1,4]).repeat(4,1)#repeat for the 4 vertices in the grid
-
-        self._needColorUpdate=False
-
-    def updateTextureCoords(self):
-        """Create a new array of self._maskCoords"""
+            RGBAs[:,0:3] = self.rgbs[sel] * contrs/255.0
+        RGBAs[:,-1] = numpy.reshape(self.opacities[sel], [n,])
+        if indices is None:
+            self._RGBAs = RGBAs
+            vertexRGBAs = self._RGBAs.repeat(4,0)#repeat for the 4 vertices of each element
+            if self.useVBO:
+                self._uploadVBO('colors', vertexRGBAs)
+            else:
+                self._vertexRGBAs = vertexRGBAs
+            self._needColorUpdate=False
+        else:
+            self._RGBAs[indices] = RGBAs
+            if self.useVBO:
+                #only the range spanned by the changed elements is sent
+                first, last = indices.min(), indices.max()+1
+                self._uploadVBO('colors', self._RGBAs[first:last].repeat(4,0),
+                                offset=first*4*4*4)  # 4 vertices of 4 float32s
+            else:
+                self._vertexRGBAs.reshape([N,4,4])[indices] = RGBAs.reshape([n,1,4])
+
+    def updateTextureCoords(self, indices=None):
+        """Create a new array of self._maskCoords (and self._texCoords). If
+        `indices` is given only the texture coords of those elements are updated.
+        """
 
         N=self.nElements
-        self._maskCoords=numpy.array([[1,0],[0,0],[0,1],[1,1]],'d').reshape([1,4,2])
-        self._maskCoords = self._maskCoords.repeat(N,0)
+        if indices is None:
+            self._dirtyElements['texCoords'].clear()
+            sel = slice(None)
+            n = N
+            self._maskCoords=numpy.array([[1,0],[0,0],[0,1],[1,1]],numpy.float32).reshape([1,4,2])
+            self._maskCoords = self._maskCoords.repeat(N,0)
+        else:
+            sel = indices
+            n = len(indices)
+        sfs = self.sfs[sel]
+        phases = self.phases[sel]
 
         #for the main texture
         if self.units in ['norm', 'pix', 'height']:#sf is dependent on size (openGL default)
-            L = -self.sfs[:,0]/2 - self.phases[:,0]+0.5
-            R = +self.sfs[:,0]/2 - self.phases[:,0]+0.5
-            T = +self.sfs[:,1]/2 - self.phases[:,1]+0.5
-            B = -self.sfs[:,1]/2 - self.phases[:,1]+0.5
+            L = -sfs[:,0]/2 - phases[:,0]+0.5
+            R = +sfs[:,0]/2 - phases[:,0]+0.5
+            T = +sfs[:,1]/2 - phases[:,1]+0.5
+            B = -sfs[:,1]/2 - phases[:,1]+0.5
         else: #we should scale to become independent of size
-            L = -self.sfs[:,0]*self.sizes[:,0]/2 - self.phases[:,0]+0.5
-            R = +self.sfs[:,0]*self.sizes[:,0]/2 - self.phases[:,0]+0.5
-            T = +self.sfs[:,1]*self.sizes[:,1]/2 - self.phases[:,1]+0.5
-            B = -self.sfs[:,1]*self.sizes[:,1]/2 - self.phases[:,1]+0.5
+            sizes = self.sizes[sel]
+            L = -sfs[:,0]*sizes[:,0]/2 - phases[:,0]+0.5
+            R = +sfs[:,0]*sizes[:,0]/2 - phases[:,0]+0.5
+            T = +sfs[:,1]*sizes[:,1]/2 - phases[:,1]+0.5
+            B = -sfs[:,1]*sizes[:,1]/2 - phases[:,1]+0.5
 
         #self._texCoords=numpy.array([[1,1],[1,0],[0,0],[0,1]],'d').reshape([1,4,2])
-        self._texCoords=numpy.concatenate([[R,B],[L,B],[L,T],[R,T]]) \
-            .transpose().reshape([N,4,2]).astype('d')
-        self._texCoords = numpy.ascontiguousarray(self._texCoords)
-        self._needTexCoordUpdate=False
+        texCoords=numpy.concatenate([[R,B],[L,B],[L,T],[R,T]]) \
+            .transpose().reshape([n,4,2]).astype(numpy.float32)
+        if indices is None:
+            self._texCoords = numpy.ascontiguousarray(texCoords)
+            if self.useVBO:
+                self._uploadVBO('texCoords', self._texCoords)
+                self._uploadVBO('maskCoords', self._maskCoords)
+            self._needTexCoordUpdate=False
+        else:
+            self._texCoords[indices] = texCoords
+            if self.useVBO:
+                self._uploadVBORange('texCoords', self._texCoords, indices)
+
+    def _uploadVBO(self, attrib, data, offset=None):
+        """Send a (float32, contiguous) array to the vertex buffer for attrib,
+        overwriting the existing storage if the size hasn't changed. If
+        `offset` (in bytes) is given, only that part of the buffer is replaced.
+        """
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self._vbos[attrib])
+        if offset is not None:
+            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, offset, data.nbytes, data.ctypes.data)
+        elif self._vboSizes.get(attrib) == data.nbytes:
+            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, 0, data.nbytes, data.ctypes.data)
+        else:
+            GL.glBufferData(GL.GL_ARRAY_BUFFER, data.nbytes, data.ctypes.data,
+                            GL.GL_DYNAMIC_DRAW)
+            self._vboSizes[attrib] = data.nbytes
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+    def _uploadVBORange(self, attrib, data, indices):
+        """Send the rows of a per-element array between the first and last of
+        `indices` to the vertex buffer for attrib
+        """
+        first, last = indices.min(), indices.max()+1
+        self._uploadVBO(attrib, data[first:last], offset=first*data[0].nbytes)
+
+    def _setSubset(self, attrib, value, operation, indices, dirty):
+        """Set `attrib` (with an optional operation) for just the elements in
+        `indices`, marking them in the dirty lists (e.g. ['vertices']) so that
+        draw() recalculates and uploads only those elements.
+        """
+        indices = numpy.asarray(indices, dtype=int).ravel()
+        current = numpy.asarray(getattr(self, attrib), dtype=float)
+        if current.shape[:1] != (self.nElements,):
+            #a single value shared by all elements (e.g. xys=(0,0)) needs expanding
+            current = numpy.resize(current, [self.nElements]+list(current.shape[-1:]))
+        value = numpy.asarray(value, dtype=float)
+        if current.ndim == 2 and value.shape == indices.shape and value.shape != current.shape[1:]:
+            value = value.reshape([-1,1]) #one value per element (e.g. sizes)
+        if operation == '':
+            current[indices] = value
+        elif operation in _operations:
+            current[indices] = _operations[operation](current[indices], value)
+        else:
+            raise ValueError("Unsupported operation '%s' when setting %s" %(operation, attrib))
+        self.__dict__[attrib] = current
+        for arrayName in dirty:
+            self._dirtyElements[arrayName].update(indices.tolist())
+
+    def _popDirty(self, arrayName):
+        """Return (and forget) the sorted indices of elements that need their
+        arrayName ('vertices', 'colors' or 'texCoords') recalculating
+        """
+        indices = numpy.array(sorted(self._dirtyElements[arrayName]), dtype=int)
+        self._dirtyElements[arrayName].clear()
+        return indices
 
     def setTex(self,value, log=True):
         """Change the texture (all elements have the same base texture). Avoid this
@@ -690,7 +930,8 @@ class ElementArrayStim(object):
         graphics card can be time-consuming.
         """
         self.tex = value
-        createTexture(value, id=self._texID, pixFormat=GL.GL_RGB, stim=self, res=self.texRes)
+        self._texID, wasLum = createCachedTexture(value, id=self._ownTexID,
+            prevID=self._texID, pixFormat=GL.GL_RGB, stim=self, res=self.texRes)
         if log and self.autoLog:
             self.win.logOnFlip("Set %s tex=%s" %(self.name, value),
                 level=logging.EXP,obj=self)
@@ -699,17 +940,25 @@ class ElementArrayStim(object):
         during time-critical points in your script. Uploading new textures to the
         graphics card can be time-consuming."""
         self.mask = value
-        createTexture(value, id=self._maskID, pixFormat=GL.GL_ALPHA, stim=self, res=self.texRes)
+        self._maskID, wasLum = createCachedTexture(value, id=self._ownMaskID,
+            prevID=self._maskID, pixFormat=GL.GL_ALPHA, stim=self, res=self.texRes)
         if log and self.autoLog:
             self.win.logOnFlip("Set %s mask=%s" %(self.name, value),
                 level=logging.EXP,obj=self)
     def __del__(self):
         self.clearTextures()#remove textures from graphics card to prevent crash
+        if self.useVBO:
+            for vbo in self._vbos.values():
+                GL.glDeleteBuffers(1, vbo)
     def clearTextures(self):
         """
         Clear the textures associated with the given stimulus.
         As of v1.61.00 this is called automatically during garbage collection of
         your stimulus, so doesn't need calling explicitly by the user.
         """
-        GL.glDeleteTextures(1, self._texID)
-        GL.glDeleteTextures(1, self._maskID)
+        GL.glDeleteTextures(1, self._ownTexID)
+        GL.glDeleteTextures(1, self._ownMaskID)
+        if self.win.textureCache is not None:
+            self.win.textureCache.release(self._texID)
+            self.win.textureCache.release(self._maskID)
+        self._texID, self._maskID = self._ownTexID, self._ownMaskID
@@ -22,7 +22,7 @@ from psychopy import logging
 from psychopy.tools.arraytools import val2array
 from psychopy.tools.attributetools import attributeSetter
 from psychopy.visual.basevisual import BaseVisualStim
-from psychopy.visual.helpers import createTexture
+from psychopy.visual.helpers import createCachedTexture
 
 import numpy
 
@@ -118,6 +118,8 @@ class GratingStim(BaseVisualStim):
         GL.glGenTextures(1, ctypes.byref(self._texID))
         self._maskID = GL.GLuint()
         GL.glGenTextures(1, ctypes.byref(self._maskID))
+        #_texID and _maskID may later point to textures from win.textureCache
+        self._ownTexID, self._ownMaskID = self._texID, self._maskID
         self.texRes = texRes  #must be power of 2
         self.maskParams = maskParams
         self.interpolate = interpolate
@@ -221,8 +223,12 @@ class GratingStim(BaseVisualStim):
         If not then PsychoPy will upsample your stimulus to the next larger
         power of two.
         """
-        createTexture(value, id=self._texID, pixFormat=GL.GL_RGB, stim=self,
+        texID, wasLum = createCachedTexture(value, id=self._ownTexID,
+            prevID=self._texID, pixFormat=GL.GL_RGB, stim=self,
             res=self.texRes, maskParams=self.maskParams)
+        if texID.value != self._texID.value:
+            self._texID = texID
+            self._needUpdate = True  # the display list binds the texture
         #if user requested size=None then update the size for new stim here
         if hasattr(self, '_requestedSize') and self._requestedSize == None:
             self.size = None  # Reset size do default
@@ -237,8 +243,12 @@ class GratingStim(BaseVisualStim):
             + the name of an image file (most formats supported)
             + a numpy array (1xN or NxN) ranging -1:1
         """
-        createTexture(value, id=self._maskID, pixFormat=GL.GL_ALPHA, stim=self,
+        maskID, wasLum = createCachedTexture(value, id=self._ownMaskID,
+            prevID=self._maskID, pixFormat=GL.GL_ALPHA, stim=self,
             res=self.texRes, maskParams=self.maskParams)
+        if maskID.value != self._maskID.value:
+            self._maskID = maskID
+            self._needUpdate = True
         self.__dict__['mask'] = value
 
     def setSF(self, value, operation='', log=True):
@@ -415,8 +425,12 @@ class GratingStim(BaseVisualStim):
         As of v1.61.00 this is called automatically during garbage collection of
         your stimulus, so doesn't need calling explicitly by the user.
         """
-        GL.glDeleteTextures(1, self._texID)
-        GL.glDeleteTextures(1, self._maskID)
+        GL.glDeleteTextures(1, self._ownTexID)
+        GL.glDeleteTextures(1, self._ownMaskID)
+        if self.win.textureCache is not None:
+            self.win.textureCache.release(self._texID)
+            self.win.textureCache.release(self._maskID)
+        self._texID, self._maskID = self._ownTexID, self._ownMaskID
 
     def _calcCyclesPerStim(self):
         if self.units in ['norm', 'height']:
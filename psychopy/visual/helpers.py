@@ -8,6 +8,9 @@
 
 import sys
 import os
+import ctypes
+import hashlib
+from multiprocessing.pool import ThreadPool
 
 # Ensure setting pyglet.options['debug_gl'] to False is done prior to any
 # other calls to pyglet or pyglet submodules, otherwise it may not get picked
@@ -49,6 +52,95 @@ except:
     haveMatplotlib = False
 
 
+def loadImageData(tex, pixFormat, forcePOW2=True, dataType=GL.GL_UNSIGNED_BYTE):
+    """Load an image (the name of an image file or a PIL Image) and convert it
+    to the array that :func:`createTexture` uploads.
+
+    This makes no calls to OpenGL, so it is safe to call from a background
+    thread (see :class:`ImagePreloader`).
+
+    Returns (intensity, wasLum, origSize)
+    """
+    if type(tex) in [str, unicode, numpy.string_]:
+        # maybe tex is the name of a file:
+        if not os.path.isfile(tex):
+            logging.error("Couldn't find image file '%s'; check path?" %(tex)); logging.flush()
+            raise OSError, "Couldn't find image file '%s'; check path? (tried: %s)" \
+                % (tex, os.path.abspath(tex))#ensure we quit
+        try:
+            im = Image.open(tex)
+            im = im.transpose(Image.FLIP_TOP_BOTTOM)
+        except IOError:
+            logging.error("Found file '%s' but failed to load as an image" %(tex)); logging.flush()
+            raise IOError, "Found file '%s' [= %s] but it failed to load as an image" \
+                % (tex, os.path.abspath(tex))#ensure we quit
+    else:
+        # can't be a file; maybe its an image already in memory?
+        try:
+            im = tex.copy().transpose(Image.FLIP_TOP_BOTTOM) # ? need to flip if in mem?
+        except AttributeError: # nope, not an image in memory
+            logging.error("Couldn't make sense of requested image."); logging.flush()
+            raise AttributeError, "Couldn't make sense of requested image."#ensure we quit
+    # at this point we have a valid im
+    origSize=im.size
+    #is it 1D?
+    if im.size[0]==1 or im.size[1]==1:
+        logging.error("Only 2D textures are supported at the moment")
+    else:
+        maxDim = max(im.size)
+        powerOf2 = int(2**numpy.ceil(numpy.log2(maxDim)))
+        if forcePOW2 and (im.size[0]!=powerOf2 or im.size[1]!=powerOf2):
+            #the warning is left to _reportImageResize, on the drawing thread
+            im=im.resize([powerOf2,powerOf2],Image.BILINEAR)
+
+    #is it Luminance or RGB?
+    if im.mode=='L' and pixFormat==GL.GL_ALPHA:
+        wasLum = True
+    elif pixFormat==GL.GL_ALPHA:#we have RGB and need Lum
+        wasLum = True
+        im = im.convert("L")#force to intensity (in case it was rgb)
+    elif pixFormat==GL.GL_RGB:#we have RGB and keep it that way
+        #texture = im.tostring("raw", "RGB", 0, -1)
+        im = im.convert("RGBA")#force to rgb (in case it was CMYK or L)
+        wasLum=False
+    if dataType==GL.GL_FLOAT:
+        #convert from ubyte to float
+        intensity = numpy.array(im).astype(numpy.float32)*0.0078431372549019607-1.0 # much faster to avoid division 2/255
+    else:
+        intensity = numpy.array(im)
+    if wasLum and intensity.shape!=im.size:
+        intensity.shape=im.size
+    return intensity, wasLum, origSize
+
+def _reportImageResize(tex, origSize, forcePOW2):
+    """Warn (for the first few images) that :func:`loadImageData` had to
+    resize `tex` to a square power of two. This is called by
+    :func:`createTexture`, not loadImageData, so that the count is only
+    updated on the drawing thread and never by an :class:`ImagePreloader`
+    """
+    global _nImageResizes
+    if not forcePOW2 or origSize[0]==1 or origSize[1]==1:
+        return
+    powerOf2 = int(2**numpy.ceil(numpy.log2(max(origSize))))
+    if origSize[0]==powerOf2 and origSize[1]==powerOf2:
+        return
+    if _nImageResizes<reportNImageResizes:
+        logging.warning("Image '%s' was not a square power-of-two image. Linearly interpolating to be %ix%i" %(tex, powerOf2, powerOf2))
+        _nImageResizes+=1
+    elif _nImageResizes==reportNImageResizes:
+        logging.warning("Multiple images have needed resizing - I'll stop bothering you!")
+        _nImageResizes+=1
+
+def _textureDataType(stim, pixFormat, dataType=None):
+    """The dataType that :func:`createTexture` will actually use
+    """
+    if dataType is None:
+        if stim.useShaders and pixFormat == GL.GL_RGB:
+            dataType = GL.GL_FLOAT
+        else:
+            dataType = GL.GL_UNSIGNED_BYTE
+    return dataType
+
 def createTexture(tex, id, pixFormat, stim, res=128, maskParams=None,
                   forcePOW2=True, dataType=None):
     """
@@ -80,16 +172,10 @@ def createTexture(tex, id, pixFormat, stim, res=128, maskParams=None,
     """
     Create an intensity texture, ranging -1:1.0
     """
-    global _nImageResizes
-    notSqr=False #most of the options will be creating a sqr texture
     wasImage=False #change this if image loading works
     useShaders = stim.useShaders
     interpolate = stim.interpolate
-    if dataType==None:
-        if useShaders and pixFormat==GL.GL_RGB:
-            dataType = GL.GL_FLOAT
-        else:
-            dataType = GL.GL_UNSIGNED_BYTE
+    dataType = _textureDataType(stim, pixFormat, dataType)
 
     if type(tex) == numpy.ndarray:
         #handle a numpy array
@@ -213,63 +299,17 @@ def createTexture(tex, id, pixFormat, stim, res=128, maskParams=None,
         intensity[artifact_idx] = 0
 
     else:
-        if type(tex) in [str, unicode, numpy.string_]:
-            # maybe tex is the name of a file:
-            if not os.path.isfile(tex):
-                logging.error("Couldn't find image file '%s'; check path?" %(tex)); logging.flush()
-                raise OSError, "Couldn't find image file '%s'; check path? (tried: %s)" \
-                    % (tex, os.path.abspath(tex))#ensure we quit
-            try:
-                im = Image.open(tex)
-                im = im.transpose(Image.FLIP_TOP_BOTTOM)
-            except IOError:
-                logging.error("Found file '%s' but failed to load as an image" %(tex)); logging.flush()
-                raise IOError, "Found file '%s' [= %s] but it failed to load as an image" \
-                    % (tex, os.path.abspath(tex))#ensure we quit
-        else:
-            # can't be a file; maybe its an image already in memory?
-            try:
-                im = tex.copy().transpose(Image.FLIP_TOP_BOTTOM) # ? need to flip if in mem?
-            except AttributeError: # nope, not an image in memory
-                logging.error("Couldn't make sense of requested image."); logging.flush()
-                raise AttributeError, "Couldn't make sense of requested image."#ensure we quit
-        # at this point we have a valid im
-        stim._origSize=im.size
+        #an image file (or PIL image); it may already have been loaded in the
+        #background by the window's imagePreloader
+        loaded = None
+        preloader = getattr(stim.win, 'imagePreloader', None)
+        if preloader is not None:
+            loaded = preloader.get(tex, pixFormat, forcePOW2, dataType)
+        if loaded is None:
+            loaded = loadImageData(tex, pixFormat, forcePOW2, dataType)
+        intensity, wasLum, stim._origSize = loaded
+        _reportImageResize(tex, stim._origSize, forcePOW2)
         wasImage=True
-        #is it 1D?
-        if im.size[0]==1 or im.size[1]==1:
-            logging.error("Only 2D textures are supported at the moment")
-        else:
-            maxDim = max(im.size)
-            powerOf2 = int(2**numpy.ceil(numpy.log2(maxDim)))
-            if im.size[0]!=powerOf2 or im.size[1]!=powerOf2:
-                if not forcePOW2:
-                    notSqr=True
-                elif _nImageResizes<reportNImageResizes:
-                    logging.warning("Image '%s' was not a square power-of-two image. Linearly interpolating to be %ix%i" %(tex, powerOf2, powerOf2))
-                    _nImageResizes+=1
-                    im=im.resize([powerOf2,powerOf2],Image.BILINEAR)
-                elif _nImageResizes==reportNImageResizes:
-                    logging.warning("Multiple images have needed resizing - I'll stop bothering you!")
-                    im=im.resize([powerOf2,powerOf2],Image.BILINEAR)
-
-        #is it Luminance or RGB?
-        if im.mode=='L' and pixFormat==GL.GL_ALPHA:
-            wasLum = True
-        elif pixFormat==GL.GL_ALPHA:#we have RGB and need Lum
-            wasLum = True
-            im = im.convert("L")#force to intensity (in case it was rgb)
-        elif pixFormat==GL.GL_RGB:#we have RGB and keep it that way
-            #texture = im.tostring("raw", "RGB", 0, -1)
-            im = im.convert("RGBA")#force to rgb (in case it was CMYK or L)
-            wasLum=False
-        if dataType==GL.GL_FLOAT:
-            #convert from ubyte to float
-            intensity = numpy.array(im).astype(numpy.float32)*0.0078431372549019607-1.0 # much faster to avoid division 2/255
-        else:
-            intensity = numpy.array(im)
-        if wasLum and intensity.shape!=im.size:
-            intensity.shape=im.size
 
     if pixFormat==GL.GL_RGB and wasLum and dataType==GL.GL_FLOAT: #grating stim on good machine
         #keep as float32 -1:1
@@ -342,6 +382,531 @@ def createTexture(tex, id, pixFormat, stim, res=128, maskParams=None,
     GL.glTexEnvi(GL.GL_TEXTURE_ENV, GL.GL_TEXTURE_ENV_MODE, GL.GL_MODULATE)#?? do we need this - think not!
     return wasLum
 
+def createCachedTexture(tex, id, pixFormat, stim, res=128, maskParams=None,
+                        forcePOW2=True, dataType=None, prevID=None):
+    """Create a texture, reusing one from the window's texture cache if possible.
+
+    Takes the same arguments as :func:`createTexture` plus `prevID`, the texture
+    that the stimulus was binding until now (handed back to the cache if the
+    cache owns it).
+
+    Returns (texID, wasLum), where texID is the texture the stimulus should now
+    bind. That is `id` itself if the window has no textureCache or if `tex`
+    can't be cached (e.g. a PIL Image in memory), otherwise it is a texture
+    owned by `stim.win.textureCache` that must not be deleted by the stimulus.
+    """
+    cache = getattr(stim.win, 'textureCache', None)
+    key = None
+    if cache is not None:
+        key = cache.makeKey(tex, pixFormat, stim, res=res, maskParams=maskParams,
+                            forcePOW2=forcePOW2, dataType=dataType)
+    if key is None:
+        wasLum = createTexture(tex, id=id, pixFormat=pixFormat, stim=stim,
+                               res=res, maskParams=maskParams,
+                               forcePOW2=forcePOW2, dataType=dataType)
+        texID = id
+    else:
+        entry = cache.get(key)
+        if entry is None:
+            texID = GL.GLuint()
+            GL.glGenTextures(1, ctypes.byref(texID))
+            wasLum = createTexture(tex, id=texID, pixFormat=pixFormat, stim=stim,
+                                   res=res, maskParams=maskParams,
+                                   forcePOW2=forcePOW2, dataType=dataType)
+            entry = cache.add(key, texID, wasLum, stim)
+        else:
+            #restore the attributes that createTexture would have set
+            for attrib, val in entry['stimAttribs'].items():
+                setattr(stim, attrib, val)
+            #and drop any preloaded copy of the image, which isn't needed now
+            preloader = getattr(stim.win, 'imagePreloader', None)
+            if preloader is not None:
+                preloader.discard(tex, pixFormat, forcePOW2,
+                                  _textureDataType(stim, pixFormat, dataType))
+        texID, wasLum = entry['id'], entry['wasLum']
+    if cache is not None and prevID is not None:
+        cache.release(prevID)
+    return texID, wasLum
+
+class TextureCache(object):
+    """A least-recently-used cache of the textures made by :func:`createTexture`
+
+    Each :class:`~psychopy.visual.Window` created with `textureCacheMB>0` has
+    one of these as `win.textureCache`. Stimuli that are repeatedly given the
+    same image file (unchanged on disk), numpy array or built-in texture with
+    the same parameters then simply rebind the existing texture instead of
+    reloading, resizing and uploading it again.
+
+    When the (estimated) texture memory exceeds `maxBytes` the least recently
+    used textures are deleted, but never one that a stimulus is still using.
+    `hits` and `misses` count the lookups that could be cached.
+    """
+    def __init__(self, maxBytes=256*1024**2):
+        self.maxBytes = maxBytes
+        self.nBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}  # key: entry dict
+        self._keyFromID = {}  # texture id (int): key
+        self._nLookups = 0  # used to stamp entries for LRU eviction
+
+    def __len__(self):
+        return len(self._entries)
+
+    def makeKey(self, tex, pixFormat, stim, res=128, maskParams=None,
+                forcePOW2=True, dataType=None):
+        """Return a hashable key describing the texture that createTexture()
+        would make from these arguments, or None if it can't be cached
+        """
+        if type(tex) == numpy.ndarray:
+            arr = numpy.ascontiguousarray(tex)
+            source = ('array', arr.shape, arr.dtype.str,
+                      hashlib.sha1(arr.data).hexdigest())
+            isFile = False
+        elif tex is None:
+            source = ('name', 'None', res)
+            isFile = False
+        elif type(tex) in [str, unicode, numpy.string_]:
+            isFile = os.path.isfile(tex)
+            if isFile:
+                stat = os.stat(tex)
+                source = ('file', os.path.abspath(tex), stat.st_mtime, stat.st_size)
+            else:
+                source = ('name', str(tex), res)
+        else:
+            return None  # e.g. a PIL image already in memory
+        dataType = _textureDataType(stim, pixFormat, dataType)
+        if type(maskParams) == dict:
+            maskParams = tuple(sorted(maskParams.items()))
+        #luminance textures on RGB ubyte are baked using the stimulus color
+        color = None
+        if pixFormat == GL.GL_RGB and dataType != GL.GL_FLOAT and not isFile:
+            color = (tuple(numpy.ravel(stim.rgb)), tuple(numpy.ravel(stim.rgbPedestal)),
+                     stim.contrast, stim.colorSpace)
+        return (source, pixFormat, dataType, repr(maskParams), forcePOW2,
+                bool(stim.interpolate), bool(stim.useShaders), color)
+
+    def get(self, key):
+        """Return the entry for `key` (and mark it as in use) or None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._nLookups += 1
+        entry['lastUsed'] = self._nLookups
+        entry['nUsers'] += 1
+        return entry
+
+    def add(self, key, texID, wasLum, stim):
+        """Store a texture that has just been created by createTexture()
+        for `stim` (which is counted as its first user)
+        """
+        self._nLookups += 1
+        stimAttribs = {}
+        for attrib in ['_origSize', '_tex1D']:
+            if hasattr(stim, attrib):
+                stimAttribs[attrib] = getattr(stim, attrib)
+        entry = {'id': texID, 'wasLum': wasLum, 'stimAttribs': stimAttribs,
+                 'nBytes': self._estimateBytes(texID, key[2], stim.interpolate),
+                 'nUsers': 1, 'lastUsed': self._nLookups}
+        self._entries[key] = entry
+        self._keyFromID[texID.value] = key
+        self.nBytes += entry['nBytes']
+        self._evict()
+        return entry
+
+    def owns(self, texID):
+        """Is this texture owned by the cache (rather than by a stimulus)?
+        """
+        return texID is not None and texID.value in self._keyFromID
+
+    def release(self, texID):
+        """Tell the cache that one stimulus has stopped using `texID`.
+        Textures that aren't owned by the cache are ignored.
+        """
+        key = self._keyFromID.get(texID.value)
+        if key is None:
+            return
+        entry = self._entries[key]
+        entry['nUsers'] = max(0, entry['nUsers']-1)
+        self._evict()
+
+    def clear(self):
+        """Delete all cached textures that are not currently in use
+        """
+        for key, entry in self._entries.items():
+            if entry['nUsers'] == 0:
+                self._remove(key)
+
+    def _evict(self):
+        while self.nBytes > self.maxBytes:
+            unused = [(entry['lastUsed'], key)
+                      for key, entry in self._entries.items()
+                      if entry['nUsers'] == 0]
+            if not unused:
+                break
+            self._remove(min(unused)[1])
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        del self._keyFromID[entry['id'].value]
+        self.nBytes -= entry['nBytes']
+        GL.glDeleteTextures(1, entry['id'])
+
+    def _estimateBytes(self, texID, dataType, mipmaps):
+        width, height = GL.GLint(), GL.GLint()
+        GL.glBindTexture(GL.GL_TEXTURE_2D, texID)
+        GL.glGetTexLevelParameteriv(GL.GL_TEXTURE_2D, 0, GL.GL_TEXTURE_WIDTH,
+                                    ctypes.byref(width))
+        GL.glGetTexLevelParameteriv(GL.GL_TEXTURE_2D, 0, GL.GL_TEXTURE_HEIGHT,
+                                    ctypes.byref(height))
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+        if dataType == GL.GL_FLOAT:
+            bytesPerTexel = 16  # 4 channels of float32
+        else:
+            bytesPerTexel = 4
+        nBytes = width.value*height.value*bytesPerTexel
+        if mipmaps:
+            nBytes = nBytes*4/3
+        return nBytes
+
+class ImagePreloader(object):
+    """Loads image files on background threads so that the decoding, flipping,
+    resizing and conversion done by :func:`createTexture` is finished before
+    the image is needed; only the upload to the graphics card is then left for
+    the drawing thread.
+
+    A :class:`~psychopy.visual.Window` creates one of these (as
+    `win.imagePreloader`) the first time :meth:`Window.preloadImages` is
+    called. Each preloaded image is used once (by the next createTexture call
+    for that file and format) and then discarded.
+    """
+    def __init__(self, nThreads=2):
+        self.nThreads = nThreads
+        self._pool = None
+        self._pending = {}  # key: AsyncResult from the pool
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _makeKey(self, tex, pixFormat, forcePOW2, dataType):
+        if type(tex) not in [str, unicode, numpy.string_]:
+            return None  # only files can be preloaded
+        return (os.path.abspath(tex), pixFormat, bool(forcePOW2), dataType)
+
+    def preload(self, tex, pixFormat=GL.GL_RGB, forcePOW2=False,
+                dataType=GL.GL_UNSIGNED_BYTE):
+        """Start loading the image file `tex` in the background. The defaults
+        match the format used by :meth:`ImageStim.setImage`
+        """
+        key = self._makeKey(tex, pixFormat, forcePOW2, dataType)
+        if key is None or key in self._pending:
+            return
+        if self._pool is None:
+            self._pool = ThreadPool(self.nThreads)
+        self._pending[key] = self._pool.apply_async(loadImageData,
+            (tex, pixFormat, forcePOW2, dataType))
+
+    def get(self, tex, pixFormat, forcePOW2, dataType):
+        """Return the result of :func:`loadImageData` for this image if it was
+        preloaded (waiting for it to finish if necessary), or None
+        """
+        if not self._pending:
+            return None
+        key = self._makeKey(tex, pixFormat, forcePOW2, dataType)
+        result = self._pending.pop(key, None)
+        if result is None:
+            return None
+        try:
+            return result.get()
+        except Exception, err:
+            #fall back to loading synchronously (which reports the error)
+            logging.warning("Preloading image '%s' failed: %s" %(tex, err))
+            return None
+
+    def discard(self, tex, pixFormat, forcePOW2, dataType):
+        """Forget the preloaded copy of this image (if any) without waiting for
+        it, e.g. because its texture was found in the window's textureCache
+        """
+        if self._pending:
+            key = self._makeKey(tex, pixFormat, forcePOW2, dataType)
+            self._pending.pop(key, None)
+
+    def clear(self):
+        """Discard all preloaded images and stop the background threads
+        """
+        self._pending = {}
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+class FrameProfiler(object):
+    """Times each phase of :meth:`Window.flip` so that dropped frames can be
+    attributed to the stimuli, functions or buffer swap that caused them.
+
+    A :class:`~psychopy.visual.Window` creates one of these (as
+    `win.frameProfiler`) when :meth:`Window.setRecordFrameProfile` is called.
+    The results for the last `nFrames` frames are kept in preallocated arrays
+    that are used as a ring buffer, so profiling does not allocate memory
+    while frames are being drawn.
+
+    CPU times come from :func:`psychopy.core.getTime`. Where the graphics
+    card supports GL_ARB_timer_query the time the GPU spent on each autoDraw
+    stimulus and on the FBO blit is also measured, with timestamp queries
+    that are read back a few frames later (so as not to stall the pipeline).
+    """
+    phases = ('draw', 'blit', 'swap', 'finish', 'callOnFlip', 'log')
+    gpuLag = 3  # frames to wait before reading back timer queries
+
+    def __init__(self, nFrames=1000, maxStims=32, gpuTimers=True):
+        self.nFrames = nFrames
+        self.maxStims = maxStims
+        self.useGPU = bool(gpuTimers and hasattr(GL, 'glQueryCounter') and
+                           GL.gl_info.have_extension('GL_ARB_timer_query'))
+        #the ring buffer (rows are frames)
+        self.frameN = numpy.zeros(nFrames, dtype=int)
+        self.t = numpy.zeros(nFrames)
+        self.interval = numpy.zeros(nFrames)
+        self.cpu = numpy.zeros([nFrames, len(self.phases)])
+        self.gpuDraw = numpy.zeros(nFrames)
+        self.gpuBlit = numpy.zeros(nFrames)
+        self.stimCPU = numpy.zeros([nFrames, maxStims])
+        self.stimGPU = numpy.zeros([nFrames, maxStims])
+        self.stimNames = [()]*nFrames
+        self.nRecorded = 0  # total frames recorded (including overwritten)
+        self._lastT = None
+        #timestamps per frame: start, one per stim, end of drawing, end of blit
+        self._queryBlockSize = maxStims+3
+        if self.useGPU:
+            #one block of timestamp queries for each frame awaiting readback
+            nQueries = self._queryBlockSize*(self.gpuLag+1)
+            self._queryIDs = (GL.GLuint*nQueries)()
+            GL.glGenQueries(nQueries, self._queryIDs)
+            self._nQueries = [0]*(self.gpuLag+1)
+
+    def __len__(self):
+        return min(self.nRecorded, self.nFrames)
+
+    def _queryTimestamp(self):
+        block = self.nRecorded % (self.gpuLag+1)
+        n = self._nQueries[block]
+        GL.glQueryCounter(self._queryIDs[block*self._queryBlockSize+n], GL.GL_TIMESTAMP)
+        self._nQueries[block] = n+1
+
+    def beginFrame(self):
+        """Called by flip() before the autoDraw stimuli are drawn
+        """
+        getTime = core.getTime
+        row = self.nRecorded % self.nFrames
+        self._row = row
+        self._nStims = 0
+        self._names = []
+        self.stimCPU[row] = 0
+        self.stimGPU[row] = 0
+        if self.useGPU:
+            self._nQueries[self.nRecorded % (self.gpuLag+1)] = 0
+            self._queryTimestamp()
+        self._frameStart = self._markT = self._stimT = getTime()
+
+    def endStim(self, stim):
+        """Called by flip() after each autoDraw stimulus is drawn
+        """
+        now = core.getTime()
+        n = self._nStims
+        if n < self.maxStims:
+            self.stimCPU[self._row, n] = now-self._stimT
+            self._names.append(getattr(stim, 'name', stim.__class__.__name__))
+            if self.useGPU:
+                self._queryTimestamp()
+            self._nStims = n+1
+        self._stimT = now
+
+    def endPhase(self, phase):
+        """Record the CPU time since the previous phase (or the start of the
+        frame) as the duration of `phase`
+        """
+        now = core.getTime()
+        self.cpu[self._row, self.phases.index(phase)] = now-self._markT
+        if self.useGPU and phase in ['draw', 'blit']:
+            self._queryTimestamp()
+        self._markT = now
+
+    def endFrame(self, t):
+        """Called at the end of flip(), with the time of the flip
+        """
+        row = self._row
+        self.frameN[row] = self.nRecorded
+        self.t[row] = t
+        if self._lastT is None:
+            self.interval[row] = 0
+        else:
+            self.interval[row] = t-self._lastT
+        self._lastT = t
+        self.stimNames[row] = tuple(self._names)
+        self.nRecorded += 1
+        if self.useGPU and self.nRecorded > self.gpuLag:
+            #the oldest block of queries is about to be reused
+            self._readQueries(self.nRecorded-self.gpuLag-1)
+
+    def _readQueries(self, frameN):
+        """Fetch the GPU timestamps for frame `frameN` and store durations
+        """
+        block = frameN % (self.gpuLag+1)
+        n = self._nQueries[block]
+        if n < 3:
+            return
+        first = block*self._queryBlockSize
+        stamps = numpy.zeros(n)
+        result = ctypes.c_uint64()
+        for ii in range(n):
+            GL.glGetQueryObjectui64v(self._queryIDs[first+ii], GL.GL_QUERY_RESULT,
+                                     ctypes.byref(result))
+            stamps[ii] = result.value*1e-9  # ns to s
+        row = frameN % self.nFrames
+        durations = numpy.diff(stamps)
+        #stamps are: start, each stim, end of drawing, end of blit
+        self.stimGPU[row, :n-3] = durations[:n-3]
+        self.gpuDraw[row] = stamps[-2]-stamps[0]
+        self.gpuBlit[row] = durations[-1]
+        self._nQueries[block] = 0
+
+    def flush(self):
+        """Read back any GPU timings that are still pending (this waits for
+        the graphics card to finish them)
+        """
+        if self.useGPU:
+            for frameN in range(max(0, self.nRecorded-self.gpuLag), self.nRecorded):
+                self._readQueries(frameN)
+
+    def getProfile(self):
+        """Return the recorded frames (oldest first) as a dict of arrays with
+        keys 'frameN', 't', 'interval', one per phase (CPU durations in s),
+        'gpuDraw', 'gpuBlit', 'stimCPU', 'stimGPU' (one column per autoDraw
+        stimulus, in drawing order) and 'stimNames' (a list of tuples)
+        """
+        self.flush()
+        order = (numpy.arange(len(self)) + max(0, self.nRecorded-self.nFrames)) % self.nFrames
+        profile = {'frameN': self.frameN[order], 't': self.t[order],
+                   'interval': self.interval[order],
+                   'gpuDraw': self.gpuDraw[order], 'gpuBlit': self.gpuBlit[order],
+                   'stimCPU': self.stimCPU[order], 'stimGPU': self.stimGPU[order],
+                   'stimNames': [self.stimNames[row] for row in order]}
+        for ii, phase in enumerate(self.phases):
+            profile[phase] = self.cpu[order, ii]
+        return profile
+
+    def save(self, fileName, delim=','):
+        """Save one row per frame, with the duration of each phase and the
+        autoDraw stimulus that took longest (and its CPU time)
+        """
+        profile = self.getProfile()
+        header = ['frameN', 't', 'interval'] + list(self.phases) + \
+                 ['gpuDraw', 'gpuBlit', 'slowestStim', 'slowestStimT']
+        f = open(fileName, 'w')
+        f.write(delim.join(header)+'\n')
+        for ii in range(len(profile['frameN'])):
+            names = profile['stimNames'][ii]
+            if names:
+                slowest = profile['stimCPU'][ii, :len(names)].argmax()
+                stimCols = [names[slowest], repr(profile['stimCPU'][ii, slowest])]
+            else:
+                stimCols = ['', '']
+            row = [str(profile['frameN'][ii])]
+            row += [repr(profile[key][ii]) for key in
+                    ['t', 'interval']+list(self.phases)+['gpuDraw', 'gpuBlit']]
+            f.write(delim.join(row+stimCols)+'\n')
+        f.close()
+
+    def clear(self):
+        """Forget all recorded frames
+        """
+        self.flush()
+        self.nRecorded = 0
+        self._lastT = None
+
+    def release(self):
+        """Read back any pending GPU timings and delete the timer queries
+        (called by Window.close() while the GL context still exists). The
+        recorded frames are kept.
+        """
+        if self.useGPU:
+            self.flush()
+            GL.glDeleteQueries(len(self._queryIDs), self._queryIDs)
+            self.useGPU = False
+
+class PBOFrameGrabber(object):
+    """Reads frames from the window into a ring of pixel buffer objects.
+
+    glReadPixels into a bound GL_PIXEL_PACK_BUFFER returns straight away, and
+    the copy happens while the graphics card carries on. Each buffer is only
+    mapped (and copied into a numpy array) when the ring comes back round to
+    it, `nBuffers`-1 frames later, by which time the transfer is normally
+    done. So capturing a frame doesn't stall the drawing of the next one.
+    """
+    def __init__(self, size, nBuffers=3):
+        self.size = (int(size[0]), int(size[1]))
+        self.nBuffers = nBuffers
+        self.nBytes = self.size[0]*self.size[1]*4
+        self._ids = (GL.GLuint*nBuffers)()
+        GL.glGenBuffers(nBuffers, self._ids)
+        for thisID in self._ids:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, thisID)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, self.nBytes, None,
+                            GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self._next = 0  # index of the next buffer to read into
+        self._pending = []  # buffers (oldest first) holding unread frames
+
+    def grab(self, buffer='front'):
+        """Start reading the front or back buffer. Returns the frame read
+        `nBuffers` grabs ago, as a numpy array (rows starting at the bottom),
+        or None if there isn't one yet
+        """
+        frame = None
+        if len(self._pending) == self.nBuffers:
+            frame = self._readPending()
+        if buffer == 'back':
+            GL.glReadBuffer(GL.GL_BACK)
+        else:
+            GL.glReadBuffer(GL.GL_FRONT)
+        thisID = self._ids[self._next]
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, thisID)
+        GL.glReadPixels(0, 0, self.size[0], self.size[1],
+                        GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self._pending.append(thisID)
+        self._next = (self._next+1) % self.nBuffers
+        return frame
+
+    def _readPending(self):
+        thisID = self._pending.pop(0)
+        frame = numpy.empty([self.size[1], self.size[0], 4], numpy.uint8)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, thisID)
+        ptr = GL.glMapBuffer(GL.GL_PIXEL_PACK_BUFFER, GL.GL_READ_ONLY)
+        if ptr:
+            ctypes.memmove(frame.ctypes.data, ptr, self.nBytes)
+            GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        return frame
+
+    def flush(self):
+        """Return a list of the frames still in the buffers (oldest first)
+        """
+        frames = []
+        while self._pending:
+            frames.append(self._readPending())
+        return frames
+
+    def release(self):
+        """Delete the buffers (any frames still in them are lost)
+        """
+        if self._ids is not None:
+            GL.glDeleteBuffers(self.nBuffers, self._ids)
+            self._ids = None
+            self._pending = []
+
 def pointInPolygon(x, y, poly):
     """Determine if a point (`x`, `y`) is inside a polygon, using the ray casting method.
 
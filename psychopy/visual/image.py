@@ -21,7 +21,7 @@ from psychopy import logging
 from psychopy.tools.arraytools import val2array
 from psychopy.visual.basevisual import BaseVisualStim
 from psychopy.visual.helpers import (pointInPolygon, polygonsOverlap,
-                                     createTexture)
+                                     createCachedTexture)
 
 import numpy
 
@@ -83,6 +83,8 @@ class ImageStim(BaseVisualStim):
         GL.glGenTextures(1, ctypes.byref(self._texID))
         self._maskID = GL.GLuint()
         GL.glGenTextures(1, ctypes.byref(self._maskID))
+        #_texID and _maskID may later point to textures from win.textureCache
+        self._ownTexID, self._ownMaskID = self._texID, self._maskID
         self.maskParams= maskParams
         self.texRes=texRes
 
@@ -234,8 +236,12 @@ class ImageStim(BaseVisualStim):
         As of v1.61.00 this is called automatically during garbage collection of
         your stimulus, so doesn't need calling explicitly by the user.
         """
-        GL.glDeleteTextures(1, self._texID)
-        GL.glDeleteTextures(1, self._maskID)
+        GL.glDeleteTextures(1, self._ownTexID)
+        GL.glDeleteTextures(1, self._ownMaskID)
+        if self.win.textureCache is not None:
+            self.win.textureCache.release(self._texID)
+            self.win.textureCache.release(self._maskID)
+        self._texID, self._maskID = self._ownTexID, self._ownMaskID
     def draw(self, win=None):
         if win==None: win=self.win
         self._selectWindow(win)
@@ -262,9 +268,13 @@ class ImageStim(BaseVisualStim):
             datatype = GL.GL_FLOAT
         else:
             datatype = GL.GL_UNSIGNED_BYTE
-        self.isLumImage = createTexture(value, id=self._texID, stim=self,
+        texID, self.isLumImage = createCachedTexture(value, id=self._ownTexID,
+            prevID=self._texID, stim=self,
             pixFormat=GL.GL_RGB, dataType=datatype,
             maskParams=self.maskParams, forcePOW2=False)
+        if texID.value != self._texID.value:
+            self._texID = texID
+            self._needUpdate = True  # the display list binds the texture
         #if user requested size=None then update the size for new stim here
         if hasattr(self, '_requestedSize') and self._requestedSize==None:
             self.size = None  # set size to default
@@ -274,14 +284,24 @@ class ImageStim(BaseVisualStim):
         #if we switched to/from lum image then need to update shader rule
         if wasLumImage != self.isLumImage:
             self._needUpdate=True
+    def preload(self, value):
+        """Start loading an image file in the background so that a later
+        `setImage(value)` only needs to upload it to the graphics card.
+        See :meth:`~psychopy.visual.Window.preloadImages`
+        """
+        self.win.preloadImages([value])
     def setMask(self,value, log=True):
         """Change the image to be used as an alpha-mask for the image
         """
         self.mask = value
-        createTexture(value, id=self._maskID,
+        maskID, wasLum = createCachedTexture(value, id=self._ownMaskID,
+            prevID=self._maskID,
             pixFormat=GL.GL_ALPHA,dataType=GL.GL_UNSIGNED_BYTE,
             stim=self,
             res=self.texRes, maskParams=self.maskParams)
+        if maskID.value != self._maskID.value:
+            self._maskID = maskID
+            self._needUpdate = True
         if log and self.autoLog:
             self.win.logOnFlip("Set %s mask=%s" %(self.name, value),
                 level=logging.EXP,obj=self)
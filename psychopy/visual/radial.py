@@ -102,6 +102,8 @@ class RadialStim(GratingStim):
         GL.glGenTextures(1, ctypes.byref(self._texID))
         self._maskID = GL.GLuint()
         GL.glGenTextures(1, ctypes.byref(self._maskID))
+        #_texID may later point to a texture from win.textureCache
+        self._ownTexID, self._ownMaskID = self._texID, self._maskID
         self.maskParams = None
         self.maskRadialPhase = 0
         self.texRes = texRes #must be power of 2
@@ -502,5 +504,8 @@ class RadialStim(GratingStim):
         As of v1.61.00 this is called automatically during garbage collection of
         your stimulus, so doesn't need calling explicitly by the user.
         """
-        GL.glDeleteTextures(1, self._texID)
-        GL.glDeleteTextures(1, self._maskID)
+        GL.glDeleteTextures(1, self._ownTexID)
+        GL.glDeleteTextures(1, self._ownMaskID)
+        if self.win.textureCache is not None:
+            self.win.textureCache.release(self._texID)
+        self._texID = self._ownTexID
@@ -159,7 +159,7 @@ class SimpleImageStim(object):
     def _selectWindow(self, win):
         global currWindow
         #don't call switch if it's already the curr window
-        if win!=currWindow and win.winType=='pyglet':
+        if win!=currWindow and win.winType in ['pyglet', 'offscreen']:
             win.winHandle.switch_to()
             currWindow = win
     def draw(self, win=None):
@@ -49,7 +49,8 @@ from psychopy.tools.arraytools import val2array
 from psychopy import makeMovies
 from psychopy.visual.text import TextStim
 from psychopy.visual.grating import GratingStim
-from psychopy.visual.helpers import setColor
+from psychopy.visual.helpers import setColor, TextureCache, ImagePreloader, \
+    FrameProfiler, PBOFrameGrabber
 
 try:
     from PIL import Image
@@ -73,6 +74,7 @@ reportNDroppedFrames = 5  # stop raising warning after this
 from psychopy.gamma import getGammaRamp, setGammaRamp, setGamma
 #import pyglet.gl, pyglet.window, pyglet.image, pyglet.font, pyglet.event
 import psychopy._shadersPyglet as _shaders
+from psychopy.visual import _offscreen
 try:
     from pyglet import media
     havePygletMedia = True
@@ -136,6 +138,7 @@ class Window:
                  name='window1',
                  checkTiming=True,
                  useFBO=False,
+                 textureCacheMB=0,
                  autoLog=True):
         """
         :Parameters:
@@ -152,8 +155,11 @@ class Window:
             allowGUI :  *None*, True or False (if None prefs are used)
                 If set to False, window will be drawn with no frame and
                 no buttons to close etc...
-            winType :  *None*, 'pyglet', 'pygame'
-                If None then PsychoPy will revert to user/site preferences
+            winType :  *None*, 'pyglet', 'pygame', 'offscreen'
+                If None then PsychoPy will revert to user/site preferences.
+                'offscreen' renders (in software, using OSMesa) into memory
+                with no window or display at all. Frames can be retrieved
+                with getMovieFrame() as usual.
             monitor : *None*, string or a `~psychopy.monitors.Monitor` object
                 The monitor to be used during the experiment
             units :  *None*, 'height' (of the window), 'norm' (normalised),
@@ -191,6 +197,13 @@ class Window:
                 his will be enabled.
                 You can switch between left and right-eye scenes for drawing
                 operations using :func:`~psychopy.visual.Window.setBuffer`
+            textureCacheMB : *0* or a number of megabytes
+                If greater than 0, textures created by stimuli in this window
+                (images, masks, gratings) are kept in `win.textureCache` so that
+                setting the same image again only rebinds the texture. The
+                least recently used textures are deleted once this much texture
+                memory is in use. `win.textureCache.hits` and `.misses` report
+                how effective the cache has been.
 
             :note: Preferences. Some parameters (e.g. units) can now be given
                 default values in the user/site preferences and these will be
@@ -215,6 +228,13 @@ class Window:
         self._toLog = []
         self._toCall = []
 
+        self.textureCacheMB = textureCacheMB
+        if textureCacheMB:
+            self.textureCache = TextureCache(maxBytes=int(textureCacheMB*1024**2))
+        else:
+            self.textureCache = None
+        self.imagePreloader = None  # created by preloadImages()
+
         # settings for the monitor: local settings (if available) override
         # monitor
         # if we have a monitors.Monitor object (psychopy 0.54 onwards)
@@ -321,13 +341,16 @@ class Window:
 
         self.frameClock = core.Clock()  # from psycho/core
         self.frames = 0  # frames since last fps calc
-        self.movieFrames = []  # list of captured frames (Image objects)
+        self.movieFrames = []  # captured frames (see getMovieFrame())
+        self._movieCapture = None  # (grabber, writer) see startMovieCapture()
 
         self.recordFrameIntervals = False
         # Allows us to omit the long timegap that follows each time turn it off
         self.recordFrameIntervalsJustTurnedOn = False
         self.nDroppedFrames = 0
         self.frameIntervals = []
+        self.frameProfiler = None  # see setRecordFrameProfile()
+        self._profileFrames = False
 
         self._toDraw = []
         self._toDrawDepths = []
@@ -340,7 +363,7 @@ class Window:
         # over several frames with no drawing
         self._monitorFrameRate=None
         self.monitorFramePeriod=0.0 #for testing  when to stop drawing a stim
-        if checkTiming:
+        if checkTiming and self.winType != 'offscreen':  # no refresh to sync to
             self._monitorFrameRate = self.getActualFrameRate()
         if self._monitorFrameRate is not None:
             self.monitorFramePeriod=1.0/self._monitorFrameRate
@@ -409,10 +432,66 @@ class Window:
             f = open(fileName, 'w')
             f.write(intervalStr)
             f.close()
+        if self.frameProfiler is not None:
+            self.saveFrameProfile(os.path.splitext(fileName)[0]+'Profile.csv',
+                                  clear=clear)
         if clear:
             self.frameIntervals = []
             self.frameClock.reset()
 
+    def setRecordFrameProfile(self, value=True, nFrames=1000, gpuTimers=True):
+        """Record how long each part of `.flip()` takes, so that dropped
+        frames can be attributed to particular stimuli or functions.
+
+        For each frame the CPU time spent drawing each autoDraw stimulus,
+        blitting the framebuffer object, swapping buffers, waiting for the
+        blanking interval (glFinish), calling the callOnFlip functions and
+        processing logOnFlip messages is stored. If the graphics card supports
+        timer queries the GPU time for each stimulus is stored too.
+
+        :Parameters:
+
+        value : True or False
+            turns the profiler on (or off, keeping what has been recorded)
+
+        nFrames : int
+            the number of most recent frames to keep
+
+        gpuTimers : True or False
+            whether to use GL timer queries (where available)
+
+        see also:
+            Window.saveFrameProfile(), Window.saveFrameIntervals()
+        """
+        if value:
+            if self.frameProfiler is None or self.frameProfiler.nFrames != nFrames:
+                self.frameProfiler = FrameProfiler(nFrames=nFrames,
+                                                   gpuTimers=gpuTimers)
+            self._profileFrames = True
+        else:
+            self._profileFrames = False
+
+    def saveFrameProfile(self, fileName=None, clear=True):
+        """Save the frame profile (see setRecordFrameProfile()) to disk as
+        comma-separated values, one row per frame, giving the duration (s) of
+        each phase of flip() and the slowest autoDraw stimulus.
+
+        :Parameters:
+
+        fileName : *None* or the filename (including path if necessary) in
+        which to store the data.
+            If None then 'lastFrameProfile.csv' will be used.
+
+        """
+        if self.frameProfiler is None:
+            return
+        if not fileName:
+            fileName = 'lastFrameProfile.csv'
+        if len(self.frameProfiler):
+            self.frameProfiler.save(fileName)
+        if clear:
+            self.frameProfiler.clear()
+
     def onResize(self, width, height):
         '''A default resize event handler.
 
@@ -469,6 +548,34 @@ class Window:
                              'args': args,
                              'kwargs': kwargs})
 
+    def preloadImages(self, images, nThreads=2):
+        """Start loading image files in background threads, ready for a later
+        :meth:`ImageStim.setImage` call.
+
+        Decoding, flipping and converting a large image can take tens of ms.
+        Preloading the images for the next trial (e.g. during the ITI) leaves
+        only the upload to the graphics card for `setImage`. Each preloaded
+        image is used by the next `setImage` for that file; if the image is
+        still loading then `setImage` waits for it to finish.
+
+        :parameters:
+            images: a file name or a list of file names
+            nThreads: number of background threads (used when the first
+                images are preloaded)
+
+        Example::
+
+            win.preloadImages(['face01.jpg', 'face02.jpg'])
+            ...
+            image.setImage('face01.jpg')  # now only needs uploading
+        """
+        if isinstance(images, basestring):
+            images = [images]
+        if self.imagePreloader is None:
+            self.imagePreloader = ImagePreloader(nThreads=nThreads)
+        for fileName in images:
+            self.imagePreloader.preload(fileName)
+
     def flip(self, clearBuffer=True):
         """Flip the front and back buffers after drawing everything for your
         frame. (This replaces the win.update() method, better reflecting what
@@ -479,8 +586,17 @@ class Window:
         the previous screen)
         """
         global currWindow
-        for thisStim in self._toDraw:
-            thisStim.draw()
+        if self._profileFrames:
+            prof = self.frameProfiler
+            prof.beginFrame()
+            for thisStim in self._toDraw:
+                thisStim.draw()
+                prof.endStim(thisStim)
+            prof.endPhase('draw')
+        else:
+            prof = None
+            for thisStim in self._toDraw:
+                thisStim.draw()
 
         if self.useFBO:
             GL.glUseProgram(self._progFBOtoFrame)
@@ -517,6 +633,8 @@ class Window:
         #update the bits++ LUT
         if self.bitsMode in ['fast', 'bits++']:
             self.bits._drawLUTtoScreen()
+        if prof is not None:
+            prof.endPhase('blit')
 
         if self.winType == "pyglet":
             #make sure this is current context
@@ -537,6 +655,11 @@ class Window:
             if pyglet.version < '1.2':
                 pyglet.media.dispatch_events()  # for sounds to be processed
             self.winHandle.flip()
+        elif self.winType == "offscreen":
+            if currWindow != self:
+                self.winHandle.switch_to()
+                currWindow = self
+            self.winHandle.flip()
         else:
             if pygame.display.get_init():
                 pygame.display.flip()
@@ -544,6 +667,8 @@ class Window:
                 pygame.event.pump()
             else:
                 core.quit()  # we've unitialised pygame so quit
+        if prof is not None:
+            prof.endPhase('swap')
 
         if self.useFBO:
             #set rendering back to the framebuffer object
@@ -591,6 +716,8 @@ class Window:
                 GL.glVertex2i(10, 10)
             GL.glEnd()
             GL.glFinish()
+        if prof is not None:
+            prof.endPhase('finish')
 
         #get timestamp
         now = logging.defaultClock.getTime()
@@ -599,6 +726,8 @@ class Window:
         for callEntry in self._toCall:
             callEntry['function'](*callEntry['args'], **callEntry['kwargs'])
         del self._toCall[:]
+        if prof is not None:
+            prof.endPhase('callOnFlip')
 
         # do bookkeeping
         if self.recordFrameIntervals:
@@ -627,6 +756,9 @@ class Window:
                         t=now,
                         obj=logEntry['obj'])
         del self._toLog[:]
+        if prof is not None:
+            prof.endPhase('log')
+            prof.endFrame(now)
 
         #keep the system awake (prevent screen-saver or sleep)
         platform_specific.sendStayAwake()
@@ -729,9 +861,12 @@ class Window:
         Capture the current Window as an image.
         This can be done at any time (usually after a .flip() command).
 
-        Frames are stored in memory until a .saveMovieFrames(filename) command
+        Frames are stored until a .saveMovieFrames(filename) command
         is issued. You can issue getMovieFrame() as often
-        as you like and then save them all in one go when finished.
+        as you like and then save them all in one go when finished. They are
+        written to temporary files as they are captured (see
+        makeMovies.FrameSpool), so `win.movieFrames` doesn't use more memory
+        as the number of frames grows.
 
         The back buffer will return the frame that hasn't yet been 'flipped'
         to be visible on screen but has the advantage that the mouse and any
@@ -739,26 +874,94 @@ class Window:
 
         The default front buffer is to be called immediately after a win.flip()
         and gives a complete copy of the screen at the window's coordinates.
+
+        If startMovieCapture() has been called the frame is instead read
+        asynchronously and written to disk in the background.
         """
+        if self._movieCapture is not None:
+            grabber, writer = self._movieCapture
+            if grabber is None:  # offscreen so the pixels are in memory
+                frame = self.winHandle.getPixels(buffer).copy()
+            else:
+                frame = grabber.grab(buffer)
+            if frame is not None:
+                writer.write(frame)
+            return
         im = self._getFrame(buffer=buffer)
+        if not isinstance(self.movieFrames, makeMovies.FrameSpool):
+            #spool any frames already in the list too
+            self.movieFrames = makeMovies.FrameSpool(self.movieFrames)
         self.movieFrames.append(im)
 
+    def startMovieCapture(self, fileName, fps=30, nBuffers=3,
+                          encoder='ffmpeg', maxQueue=60):
+        """Start capturing frames (with getMovieFrame()) straight to disk,
+        without stalling the drawing of the following frames.
+
+        Each frame is read into one of a ring of `nBuffers` pixel buffer
+        objects, copied out of it a couple of frames later and written by a
+        background thread, so getMovieFrame() can be called on every frame.
+
+        :parameters:
+
+            fileName: an image name (e.g. 'frame.png', giving frame0001.png,
+                frame0002.png...) or a movie (e.g. 'stim.mp4'), for which the
+                raw frames are piped to `encoder` (ffmpeg by default)
+
+            fps: the frame rate of the movie
+
+            nBuffers: the number of frames that can be in transit
+
+            maxQueue: the max number of frames waiting to be written; if the
+                disk can't keep up getMovieFrame() then waits
+
+        Call stopMovieCapture() to finish writing the file(s).
+        """
+        if self._movieCapture is not None:
+            self.stopMovieCapture()
+        writer = makeMovies.FrameWriter(fileName, self.size, fps=fps,
+                                        encoder=encoder, maxQueue=maxQueue)
+        if self.winType == 'offscreen':
+            grabber = None
+        else:
+            grabber = PBOFrameGrabber(self.size, nBuffers=nBuffers)
+        self._movieCapture = (grabber, writer)
+
+    def stopMovieCapture(self):
+        """Write the frames still being captured and close the file(s)
+        started by startMovieCapture(). Returns the number of frames written.
+        """
+        if self._movieCapture is None:
+            return 0
+        grabber, writer = self._movieCapture
+        self._movieCapture = None
+        if grabber is not None:
+            for frame in grabber.flush():
+                writer.write(frame)
+            grabber.release()
+        writer.close()
+        return writer.nFrames
+
     def _getFrame(self, buffer='front'):
         """
         Return the current Window as an image.
         """
-        #GL.glLoadIdentity()
-        #do the reading of the pixels
-        if buffer == 'back':
-            GL.glReadBuffer(GL.GL_BACK)
+        if self.winType == 'offscreen':
+            #the pixels are already in memory
+            bufferDat = self.winHandle.getPixels(buffer).tostring()
         else:
-            GL.glReadBuffer(GL.GL_FRONT)
+            #GL.glLoadIdentity()
+            #do the reading of the pixels
+            if buffer == 'back':
+                GL.glReadBuffer(GL.GL_BACK)
+            else:
+                GL.glReadBuffer(GL.GL_FRONT)
 
-        #fetch the data with glReadPixels
-        #pyglet.gl stores the data in a ctypes buffer
-        bufferDat = (GL.GLubyte * (4 * self.size[0] * self.size[1]))()
-        GL.glReadPixels(0, 0, self.size[0], self.size[1],
-                        GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, bufferDat)
+            #fetch the data with glReadPixels
+            #pyglet.gl stores the data in a ctypes buffer
+            bufferDat = (GL.GLubyte * (4 * self.size[0] * self.size[1]))()
+            GL.glReadPixels(0, 0, self.size[0], self.size[1],
+                            GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, bufferDat)
         im = Image.fromstring(mode='RGBA', size=self.size, data=bufferDat)
 
         im = im.transpose(Image.FLIP_TOP_BOTTOM)
@@ -767,10 +970,11 @@ class Window:
         return im
 
     def saveMovieFrames(self, fileName, mpgCodec='mpeg1video',
-                        fps=30, clearFrames=True):
+                        fps=30, clearFrames=True, nThreads=4):
         """
-        Writes any captured frames to disk. Will write any format
-        that is understood by PIL (tif, jpg, bmp, png...)
+        Writes any captured frames to disk. Will write any image format
+        that is understood by PIL (tif, jpg, bmp, png, ppm...) or, with ffmpeg,
+        a movie (mp4, mov, avi, mkv...)
 
         :parameters:
 
@@ -794,10 +998,18 @@ class Window:
                 in .mpg
 
             fps: the frame rate to be used throughout the movie **only for
-                quicktime (.mov) movies**
+                movies encoded by ffmpeg (.mp4, .mov, .avi, .mkv)**
 
             clearFrames: set this to False if you want the frames to be kept
-                for additional calls to `saveMovieFrames`
+                for additional calls to `saveMovieFrames`. Otherwise the
+                frames (and their temporary files) are deleted once saved.
+
+            nThreads: the number of threads writing image files
+
+        Image files are written, and movies encoded, in the background as the
+        frames are read back one at a time from their temporary files.
+        Movies (other than .gif and .mpg) are made by piping the frames to
+        ffmpeg, which must be installed.
 
         Examples::
 
@@ -805,8 +1017,8 @@ class Window:
             # frame002.tif etc...
             myWin.saveMovieFrames('frame.tif')
 
-            # on OS X only
-            myWin.saveMovieFrames('stimuli.mov', fps=25)
+            # needs ffmpeg
+            myWin.saveMovieFrames('stimuli.mp4', fps=25)
 
             # not great quality animated gif
             myWin.saveMovieFrames('stimuli.gif')
@@ -823,30 +1035,30 @@ class Window:
         else:
             logging.info('writing %i frames' % len(self.movieFrames))
         if fileExt == '.gif':
-            makeMovies.makeAnimatedGIF(fileName, self.movieFrames)
+            makeMovies.makeAnimatedGIF(fileName, self.movieFrames,
+                                       streaming=True)
         elif fileExt in ['.mpg', '.mpeg']:
             if sys.platform == 'darwin':
                 raise IOError('Mpeg movies are not currently available under '
                               'OSX. You can use quicktime movies (.mov) '
                               'instead though.')
             makeMovies.makeMPEG(fileName, self.movieFrames, codec=mpgCodec)
-        elif fileExt in ['.mov', '.MOV']:
-            raise NotImplementedError("Support for Quicktime movies has been "
-                                      "removed (at least for now). You need "
-                                      "to export your frames as images "
-                                      "(e.g. png files) and combine them "
-                                      "yourself (e.g. with ffmpeg)")
-        elif len(self.movieFrames) == 1:
+        elif len(self.movieFrames) == 1 and \
+                fileExt.lower() not in makeMovies.FrameWriter.movieExts:
             self.movieFrames[0].save(fileName)
         else:
-            frame_name_format = "%s%%0%dd%s" % \
-                (fileRoot,
-                 numpy.ceil(numpy.log10(len(self.movieFrames) + 1)),
-                 fileExt)
-            for frameN, thisFrame in enumerate(self.movieFrames):
-                thisFileName = frame_name_format % (frameN+1,)
-                thisFrame.save(thisFileName)
+            # image sequence, or a movie encoded by ffmpeg
+            nDigits = int(numpy.ceil(numpy.log10(len(self.movieFrames) + 1)))
+            writer = makeMovies.FrameWriter(fileName, self.movieFrames[0].size,
+                                            fps=fps, nThreads=nThreads,
+                                            nDigits=nDigits)
+            # the frames are read back (if spooled) one at a time
+            for thisFrame in self.movieFrames:
+                writer.write(thisFrame)
+            writer.close()
         if clearFrames:
+            if isinstance(self.movieFrames, makeMovies.FrameSpool):
+                self.movieFrames.clear()  # deletes the temporary files
             self.movieFrames = []
 
     def _getRegionOfFrame(self, rect=[-1, 1, 1, -1],
@@ -874,15 +1086,19 @@ class Window:
         horz = box[2] - box[0]
         vert = box[3] - box[1]
 
-        if buffer == 'back':
-            GL.glReadBuffer(GL.GL_BACK)
+        if self.winType == 'offscreen':
+            pixels = self.winHandle.getPixels(buffer)
+            bufferDat = pixels[box[1]:box[1]+vert, box[0]:box[0]+horz].tostring()
         else:
-            GL.glReadBuffer(GL.GL_FRONT)
+            if buffer == 'back':
+                GL.glReadBuffer(GL.GL_BACK)
+            else:
+                GL.glReadBuffer(GL.GL_FRONT)
 
-        #http://www.opengl.org/sdk/docs/man/xhtml/glGetTexImage.xml
-        bufferDat = (GL.GLubyte * (4 * horz * vert))()
-        GL.glReadPixels(box[0], box[1], horz, vert,
-                        GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, bufferDat)
+            #http://www.opengl.org/sdk/docs/man/xhtml/glGetTexImage.xml
+            bufferDat = (GL.GLubyte * (4 * horz * vert))()
+            GL.glReadPixels(box[0], box[1], horz, vert,
+                            GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, bufferDat)
         # not right
         #GL.glGetTexImage(GL.GL_TEXTURE_1D, 0,
         #                 GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, bufferDat)
@@ -909,6 +1125,14 @@ class Window:
         if (not self.useNativeGamma) and self.origGammaRamp is not None:
             setGammaRamp(self.winHandle, self.origGammaRamp)
         self.setMouseVisible(True)
+        if self.textureCache is not None:
+            self.textureCache.clear()  # while we still have the GL context
+        if self.imagePreloader is not None:
+            self.imagePreloader.clear()
+        if self.frameProfiler is not None:
+            self._profileFrames = False
+            self.frameProfiler.release()
+        self.stopMovieCapture()
         if self.winType == 'pyglet':
             # If iohub is running, inform it to stop looking for this win id
             # when filtering kb and mouse events (if the filter is enabled of course)
@@ -917,6 +1141,8 @@ class Window:
                 from psychopy.iohub.client import ioHubConnection
                 ioHubConnection.ACTIVE_CONNECTION.unregisterPygletWindowHandles(self._hw_handle)
             self.winHandle.close()
+        elif self.winType == 'offscreen':
+            self.winHandle.close()
         else:
             #pygame.quit()
             pygame.display.quit()
@@ -1030,7 +1256,7 @@ class Window:
 
         # if it is None then this will be done during window setup
         if self.winHandle is not None:
-            if self.winType == 'pyglet':
+            if self.winType in ['pyglet', 'offscreen']:
                 self.winHandle.switch_to()
             GL.glClearColor(desiredRGB[0], desiredRGB[1], desiredRGB[2], 1.0)
 
@@ -1039,7 +1265,7 @@ class Window:
         """
         global GL, currWindow
         self.rgb = val2array(newRGB, False, length=3)
-        if self.winType == 'pyglet' and currWindow != self:
+        if self.winType in ['pyglet', 'offscreen'] and currWindow != self:
             self.winHandle.switch_to()
         GL.glClearColor((self.rgb[0]+1.0)/2.0,
                         (self.rgb[1]+1.0)/2.0,
@@ -1314,6 +1540,28 @@ class Window:
                                                  winSettings)
         pygame.display.set_gamma(1.0)  # this will be set appropriately later
 
+    def _setupOffscreen(self):
+        self.winType = "offscreen"
+        if self.allowStencil:
+            stencil_size = 8
+        else:
+            stencil_size = 0
+        self._isFullScr = False  # there's no screen
+        self.winHandle = _offscreen.OffscreenContext(self.size[0], self.size[1],
+                                                     stencilBits=stencil_size)
+        self._hw_handle = None
+        if self.useFBO and not GL.gl_info.have_extension('GL_EXT_framebuffer_object'):
+            logging.warn("Trying to use a framebuffer pbject but GL_EXT_framebuffer_object is not supported. Disabling")
+            self.useFBO=False
+        try:
+            #TextStim renders with pygame fonts unless the window is pyglet
+            pygame.font.init()
+        except:
+            pass  # text won't be available
+        if self.autoLog:
+            logging.info('created offscreen (OSMesa) context of size %s' %
+                         str(self.size))
+
     def _setupGL(self):
         if self.winType == 'pygame':
             try:
@@ -1328,11 +1576,13 @@ class Window:
             self._setupPygame()
         elif self.winType == "pyglet":
             self._setupPyglet()
+        elif self.winType == "offscreen":
+            self._setupOffscreen()
 
         #check whether shaders are supported
         # also will need to check for ARB_float extension,
         # but that should be done after context is created
-        self._haveShaders = (self.winType == 'pyglet' and
+        self._haveShaders = (self.winType in ['pyglet', 'offscreen'] and
                              pyglet.gl.gl_info.get_version() >= '2.0')
 
         #setup screen color